@@ -0,0 +1,175 @@
+"""
+Requests/sec of the moderation and video-state endpoints through Django's
+ASGI request path, native async views vs. the previous sync implementation.
+
+    python -m benchmarks.asgi_views --requests 500 --concurrency 20 --json out.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'syncstream_project.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from asgiref.sync import async_to_sync  # noqa: E402
+from channels.layers import get_channel_layer  # noqa: E402
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.contrib.auth.decorators import login_required  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.http import JsonResponse  # noqa: E402
+from django.shortcuts import get_object_or_404  # noqa: E402
+from django.test import AsyncClient, override_settings  # noqa: E402
+from django.test.utils import setup_test_environment, teardown_test_environment  # noqa: E402
+from django.urls import include, path  # noqa: E402
+from django.views.decorators.csrf import csrf_exempt  # noqa: E402
+from django.views.decorators.http import require_POST  # noqa: E402
+
+from rooms.models import Room, Participant  # noqa: E402
+
+User = get_user_model()
+
+
+# Sync baselines: the shape these endpoints had before they were ported to
+# async views, kept here only so the two can be measured side by side.
+
+@require_POST
+@login_required
+def sync_mute_user(request, room_id, user_id):
+    room = get_object_or_404(Room, id=room_id)
+    target_user = get_object_or_404(User, id=user_id)
+    participant = get_object_or_404(Participant, room=room, user=target_user)
+
+    if request.user != room.creator:
+        return JsonResponse({'error': 'Only room creators can mute users'}, status=403)
+
+    duration = int(request.POST.get('duration', 5))
+    participant.mute(duration, request.user)
+
+    async_to_sync(get_channel_layer().group_send)(
+        f'room_{room_id}',
+        {
+            'type': 'user_muted',
+            'user_id': str(target_user.id),
+            'username': target_user.username,
+            'muted_by': request.user.username,
+            'duration': duration,
+            'muted_until': participant.muted_until.isoformat() if participant.muted_until else None
+        }
+    )
+    return JsonResponse({'success': True, 'duration': duration})
+
+
+@csrf_exempt
+@require_POST
+@login_required
+def sync_update_video_state_api(request, room_id):
+    room = Room.objects.get(id=room_id, is_active=True)
+
+    if not room.participants.filter(user=request.user, is_online=True).exists():
+        return JsonResponse({'error': 'Not a participant'}, status=403)
+
+    data = json.loads(request.body)
+    room.update_video_state(data.get('action'), data.get('timestamp', 0), data.get('url'))
+    return JsonResponse({'status': 'success', 'state': room.get_video_state()})
+
+
+urlpatterns = [
+    path('rooms/', include('rooms.urls', namespace='rooms')),
+    path('sync/<uuid:room_id>/users/<int:user_id>/mute/', sync_mute_user),
+    path('sync/api/<uuid:room_id>/video-state/', sync_update_video_state_api),
+]
+
+
+def seed(participant_count):
+    creator = User.objects.create_user('bench_creator', password='bench')
+    room = Room.objects.create(name='Benchmark room', creator=creator)
+    Participant.objects.create(room=room, user=creator, is_online=True)
+    targets = []
+    for i in range(participant_count):
+        user = User.objects.create_user(f'bench_user_{i}', password='bench')
+        Participant.objects.create(room=room, user=user, is_online=True)
+        targets.append(user.id)
+    return creator, room, targets
+
+
+async def measure(client, make_request, total, concurrency):
+    remaining = iter(range(total))
+    failures = 0
+
+    async def worker():
+        nonlocal failures
+        for i in remaining:
+            response = await make_request(client, i)
+            if response.status_code != 200:
+                failures += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {'requests': total, 'seconds': round(elapsed, 4), 'rps': round(total / elapsed, 1), 'failures': failures}
+
+
+async def run(creator, room, targets, total, concurrency):
+    client = AsyncClient()
+    await client.aforce_login(creator)
+
+    def mute(prefix):
+        async def make_request(client, i):
+            return await client.post(f'{prefix}{room.id}/users/{targets[i % len(targets)]}/mute/', {'duration': 5})
+        return make_request
+
+    def video_state(prefix):
+        async def make_request(client, i):
+            body = json.dumps({'action': 'play' if i % 2 else 'pause', 'timestamp': i})
+            return await client.post(f'{prefix}{room.id}/video-state/', body, content_type='application/json')
+        return make_request
+
+    cases = [
+        ('mute_user', 'sync', mute('/sync/')),
+        ('mute_user', 'async', mute('/rooms/')),
+        ('update_video_state_api', 'sync', video_state('/sync/api/')),
+        ('update_video_state_api', 'async', video_state('/rooms/api/')),
+    ]
+
+    results = []
+    for endpoint, variant, make_request in cases:
+        await measure(client, make_request, min(total, 20), concurrency)
+        result = await measure(client, make_request, total, concurrency)
+        results.append({'endpoint': endpoint, 'variant': variant, **result})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--participants', type=int, default=50)
+    parser.add_argument('--json', dest='json_path')
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        with override_settings(ROOT_URLCONF=__name__):
+            creator, room, targets = seed(args.participants)
+            results = asyncio.run(run(creator, room, targets, args.requests, args.concurrency))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+    print(f"{'endpoint':<26}{'variant':<9}{'req/s':>10}{'seconds':>10}{'failures':>10}")
+    for result in results:
+        print(f"{result['endpoint']:<26}{result['variant']:<9}{result['rps']:>10}{result['seconds']:>10}{result['failures']:>10}")
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({'concurrency': args.concurrency, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
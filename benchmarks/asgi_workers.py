@@ -0,0 +1,229 @@
+"""
+WebSocket capacity of `manage.py serve` as the number of worker processes
+grows. For each worker count the server is started, --connections sockets
+are opened across rooms of --room-size members, and every socket then sends
+--pings pings back to back. Reports connect time, pongs/sec and round-trip
+percentiles.
+
+    python -m benchmarks.asgi_workers --workers 1 2 4 --connections 200 --pings 20 --json out.json
+
+The server runs against a throwaway SQLite database unless
+BENCH_DATABASE_URL is set. Set REDIS_URL to measure with the Redis channel
+layer the way production runs; without it only one worker is measured,
+since serve needs a shared channel layer for more. Pongs/sec should grow
+with the worker count up to the number of cores; past that, extra workers only add scheduling.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+BENCH_DIR = tempfile.mkdtemp(prefix='syncstream-bench-')
+os.environ['DATABASE_URL'] = os.getenv('BENCH_DATABASE_URL', f'sqlite:///{BENCH_DIR}/db.sqlite3')
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'syncstream_project.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.test import Client  # noqa: E402
+
+from rooms.loadtest import WebSocketClient  # noqa: E402
+from rooms.models import Room, Participant  # noqa: E402
+from rooms.telemetry import percentile  # noqa: E402
+
+User = get_user_model()
+
+HOST = '127.0.0.1'
+STARTUP_TIMEOUT = 60
+CONNECT_TIMEOUT = 30
+
+
+class BenchConnection(WebSocketClient):
+    """Matches each pong to the ping it answers."""
+
+    def __init__(self, reader, writer, on_message=None):
+        self.waiting = {}
+        super().__init__(reader, writer, self.on_pong)
+
+    def on_pong(self, data):
+        if data.get('type') == 'pong':
+            waiter = self.waiting.pop(data.get('client_time'), None)
+            if waiter is not None and not waiter.done():
+                waiter.set_result(time.perf_counter())
+
+    async def receive(self):
+        await super().receive()
+        for waiter in self.waiting.values():
+            if not waiter.done():
+                waiter.set_exception(ConnectionError('connection closed'))
+        self.waiting.clear()
+
+    async def ping(self, client_time):
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiting[client_time] = waiter
+        started = time.perf_counter()
+        await self.send_json({'type': 'ping', 'client_time': client_time})
+        return await waiter - started
+
+
+def seed(connections, room_size):
+    # Unusable passwords keep seeding from spending minutes on hashing.
+    users = [User(username=f'bench_ws_{i}') for i in range(connections)]
+    for user in users:
+        user.set_unusable_password()
+    User.objects.bulk_create(users)
+    users = list(User.objects.filter(username__startswith='bench_ws_').order_by('id'))
+
+    rooms = [
+        Room.objects.create(name=f'Benchmark room {i}', creator=users[i * room_size], max_users=room_size)
+        for i in range(math.ceil(connections / room_size))
+    ]
+    sessions = []
+    for i, user in enumerate(users):
+        client = Client()
+        client.force_login(user)
+        sessions.append((rooms[i // room_size].id, client.cookies[settings.SESSION_COOKIE_NAME].value))
+    return sessions
+
+
+def health(port):
+    try:
+        with urllib.request.urlopen(f'http://{HOST}:{port}/healthz/', timeout=2) as response:
+            return json.load(response)
+    except (OSError, ValueError):
+        return None
+
+
+def start_server(workers, port):
+    server = subprocess.Popen(
+        [sys.executable, 'manage.py', 'serve', '--workers', str(workers), '--port', str(port),
+         '--bind', HOST, '--graceful-timeout', '5'],
+        cwd=settings.BASE_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    # Every worker answers on its own port once it is up.
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while any(health(port + 1 + i) is None for i in range(workers)):
+        if server.poll() is not None or time.monotonic() > deadline:
+            server.kill()
+            raise RuntimeError(f'Server with {workers} workers did not start')
+        time.sleep(0.5)
+    return server
+
+
+def stop_server(server):
+    server.terminate()
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+async def connect(port, room_id, session_key):
+    cookie = f'{settings.SESSION_COOKIE_NAME}={session_key}'
+    url = f'ws://{HOST}:{port}/ws/room/{room_id}/'
+    return await asyncio.wait_for(BenchConnection.connect(url, {'Cookie': cookie}), CONNECT_TIMEOUT)
+
+
+async def measure(port, sessions, pings, concurrency):
+    limit = asyncio.Semaphore(concurrency)
+
+    async def open_one(room_id, session_key):
+        async with limit:
+            return await connect(port, room_id, session_key)
+
+    started = time.perf_counter()
+    opened = await asyncio.gather(*(open_one(*session) for session in sessions), return_exceptions=True)
+    connect_seconds = time.perf_counter() - started
+    connections = [connection for connection in opened if isinstance(connection, BenchConnection)]
+
+    rtts = []
+    failures = len(sessions) - len(connections)
+
+    async def ping_loop(n, connection):
+        nonlocal failures
+        for i in range(pings):
+            try:
+                rtts.append(await asyncio.wait_for(connection.ping(n * pings + i), CONNECT_TIMEOUT))
+            except (ConnectionError, asyncio.TimeoutError):
+                failures += 1
+                return
+
+    started = time.perf_counter()
+    await asyncio.gather(*(ping_loop(n, connection) for n, connection in enumerate(connections)))
+    ping_seconds = time.perf_counter() - started
+
+    for connection in connections:
+        await connection.close()
+    # Let the workers finish their disconnect handlers before the next round.
+    await asyncio.sleep(1)
+
+    rtts.sort()
+    return {
+        'connections': len(connections),
+        'failures': failures,
+        'connect_seconds': round(connect_seconds, 2),
+        'pongs_per_second': round(len(rtts) / ping_seconds, 1) if ping_seconds else 0,
+        'rtt_p50_ms': round(percentile(rtts, 50) * 1000, 2) if rtts else None,
+        'rtt_p99_ms': round(percentile(rtts, 99) * 1000, 2) if rtts else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, os.cpu_count()])
+    parser.add_argument('--connections', type=int, default=200)
+    parser.add_argument('--room-size', type=int, default=10)
+    parser.add_argument('--pings', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=50, help='Connections opened at once')
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--json', dest='json_path')
+    args = parser.parse_args()
+
+    results = []
+    try:
+        call_command('migrate', verbosity=0)
+        sessions = seed(args.connections, args.room_size)
+        worker_counts = sorted(set(args.workers))
+        if 'Redis' not in settings.CHANNEL_LAYERS['default']['BACKEND'] and worker_counts[-1] > 1:
+            # serve refuses more than one worker without a shared layer.
+            print('No Redis channel layer configured; measuring 1 worker only')
+            worker_counts = [1]
+        for workers in worker_counts:
+            Participant.objects.update(is_online=False)
+            server = start_server(workers, args.port)
+            try:
+                result = asyncio.run(measure(args.port, sessions, args.pings, args.concurrency))
+            finally:
+                stop_server(server)
+            results.append({'workers': workers, **result})
+    finally:
+        shutil.rmtree(BENCH_DIR, ignore_errors=True)
+
+    print(f"{os.cpu_count()} cores, {args.connections} connections, {args.pings} pings each")
+    print(f"{'workers':>8}{'open':>8}{'failed':>8}{'connect s':>11}{'pongs/s':>10}{'p50 ms':>9}{'p99 ms':>9}")
+    for result in results:
+        print(
+            f"{result['workers']:>8}{result['connections']:>8}{result['failures']:>8}{result['connect_seconds']:>11}"
+            f"{result['pongs_per_second']:>10}{str(result['rtt_p50_ms']):>9}{str(result['rtt_p99_ms']):>9}"
+        )
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({'cores': os.cpu_count(), 'connections': args.connections, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Group fanout through the in-process LocalChannelLayer vs. channels'
+InMemoryChannelLayer and channels_redis' RedisChannelLayer. For each group
+size, every member has a task receiving in a loop while --messages room
+events are group_sent one after another; reports group_send latency and
+end-to-end deliveries/sec.
+
+    python -m benchmarks.channel_layers --sizes 10 100 1000 --messages 200 --json out.json
+
+Redis is measured when --redis-url (or REDIS_URL) points at a reachable
+server and skipped otherwise.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'syncstream_project.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from channels.layers import InMemoryChannelLayer  # noqa: E402
+
+from rooms.telemetry import percentile  # noqa: E402
+from syncstream_project.channel_layer import LocalChannelLayer  # noqa: E402
+
+# A typical room event; the in-memory layer deep-copies it per member.
+MESSAGE = {
+    'type': 'video_control',
+    'action': 'play',
+    'timestamp': 123.4,
+    'action_at': 1700000000.0,
+    'execute_at': 1700000000.3,
+    'url': 'https://www.youtube.com/watch?v=dQw4w9WgXcQ',
+    'user_id': 42,
+    'username': 'benchmark',
+}
+
+
+def make_layers(messages, redis_url):
+    # Capacity covers every message, so no layer drops any.
+    capacity = messages + 10
+    layers = [
+        ('LocalChannelLayer', lambda: LocalChannelLayer(capacity=capacity)),
+        ('InMemoryChannelLayer', lambda: InMemoryChannelLayer(capacity=capacity)),
+    ]
+    if redis_url:
+        from channels_redis.core import RedisChannelLayer
+
+        layers.append(('RedisChannelLayer', lambda: RedisChannelLayer(hosts=[redis_url], capacity=capacity)))
+    return layers
+
+
+async def measure(layer, size, messages):
+    channels = [await layer.new_channel() for _ in range(size)]
+    for channel in channels:
+        await layer.group_add('benchmark', channel)
+
+    async def receive_all(channel):
+        for _ in range(messages):
+            await layer.receive(channel)
+
+    receivers = [asyncio.ensure_future(receive_all(channel)) for channel in channels]
+    await asyncio.sleep(0)
+
+    latencies = []
+    started = time.perf_counter()
+    for i in range(messages):
+        sent = time.perf_counter()
+        await layer.group_send('benchmark', {**MESSAGE, 'timestamp': i})
+        latencies.append(time.perf_counter() - sent)
+    await asyncio.gather(*receivers)
+    seconds = time.perf_counter() - started
+
+    for channel in channels:
+        await layer.group_discard('benchmark', channel)
+    await layer.flush()
+    latencies.sort()
+    return {
+        'seconds': round(seconds, 3),
+        'deliveries_per_second': round(size * messages / seconds),
+        'group_send_p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'group_send_p99_ms': round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+async def redis_reachable(redis_url):
+    from channels_redis.core import RedisChannelLayer
+
+    layer = RedisChannelLayer(hosts=[redis_url])
+    try:
+        await asyncio.wait_for(layer.flush(), 2)
+        return True
+    except Exception:
+        return False
+    finally:
+        await layer.close_pools()
+
+
+async def run(sizes, messages, redis_url):
+    if redis_url and not await redis_reachable(redis_url):
+        print(f"Redis at {redis_url} is not reachable; skipping RedisChannelLayer")
+        redis_url = None
+
+    results = []
+    for name, make_layer in make_layers(messages, redis_url):
+        for size in sizes:
+            layer = make_layer()
+            await measure(layer, min(size, 10), min(messages, 10))
+            result = await measure(layer, size, messages)
+            results.append({'layer': name, 'members': size, **result})
+            if hasattr(layer, 'close_pools'):
+                await layer.close_pools()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--redis-url', default=os.getenv('REDIS_URL'))
+    parser.add_argument('--json', dest='json_path')
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.sizes, args.messages, args.redis_url))
+
+    print(f"{'layer':<22}{'members':>8}{'deliveries/s':>14}{'send p50 ms':>13}{'send p99 ms':>13}")
+    for result in results:
+        print(
+            f"{result['layer']:<22}{result['members']:>8}{result['deliveries_per_second']:>14}"
+            f"{result['group_send_p50_ms']:>13}{result['group_send_p99_ms']:>13}"
+        )
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({'messages': args.messages, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
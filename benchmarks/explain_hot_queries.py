@@ -0,0 +1,140 @@
+"""
+Query plans of the hot Message and Participant lookups on a seeded dataset,
+without and with the indexes added in rooms.0005.
+
+    python -m benchmarks.explain_hot_queries --rooms 50 --users 500 --messages 200000
+"""
+import argparse
+import json
+import os
+import random
+import time
+from datetime import timedelta
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'syncstream_project.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.db.models import Count, Q  # noqa: E402
+from django.test.utils import setup_test_environment, teardown_test_environment  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from rooms.models import Room, Participant, Message  # noqa: E402
+from rooms.synthetic import explicit_timestamps  # noqa: E402
+
+User = get_user_model()
+
+BEFORE_MIGRATION = '0004_message_archive'
+AFTER_MIGRATION = '0005_message_participant_indexes'
+
+
+def seed(room_count, user_count, message_count):
+    users = User.objects.bulk_create(
+        [User(username=f'explain_user_{i}', password='!') for i in range(user_count)]
+    )
+    rooms = Room.objects.bulk_create(
+        [Room(name=f'Explain room {i}', creator=users[i % user_count]) for i in range(room_count)]
+    )
+
+    participants = []
+    for room in rooms:
+        for user in random.sample(users, min(user_count, 50)):
+            participants.append(Participant(
+                room=room, user=user,
+                is_online=random.random() < 0.2,
+                is_banned=random.random() < 0.02,
+            ))
+    Participant.objects.bulk_create(participants, batch_size=5000)
+
+    start = timezone.now() - timedelta(days=30)
+    step = timedelta(days=30) / message_count
+    messages = (
+        Message(room=random.choice(rooms), user=random.choice(users), message='hello', created_at=start + step * i)
+        for i in range(message_count)
+    )
+    # Without this, auto_now_add would give every row the insert time.
+    with explicit_timestamps(Message._meta.get_field('created_at')):
+        batch = []
+        for message in messages:
+            batch.append(message)
+            if len(batch) == 5000:
+                Message.objects.bulk_create(batch)
+                batch = []
+        Message.objects.bulk_create(batch)
+
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+    room = max(rooms, key=lambda r: r.messages.count())
+    user = room.participants.first().user
+    return room, user
+
+
+def hot_queries(room, user):
+    cursor = timezone.now() - timedelta(days=10)
+    return {
+        'room_state_messages': room.messages.select_related('user').order_by('-created_at')[:20],
+        'history_page': Message.objects.filter(room=room, created_at__lt=cursor).order_by('-created_at')[:50],
+        'archive_oldest': Message.objects.filter(room=room, created_at__lt=cursor).order_by('created_at').values('created_at')[:1],
+        'online_count': room.participants.filter(is_online=True).values('pk'),
+        'ban_check': Participant.objects.filter(room=room, user=user, is_banned=True).values('pk')[:1],
+        'directory_counts': Room.objects.filter(is_active=True, is_private=False).annotate(
+            online_count=Count('participants', filter=Q(participants__is_online=True)),
+        ).order_by('-online_count')[:12],
+    }
+
+
+def measure(room, user, repeat):
+    results = {}
+    for name, queryset in hot_queries(room, user).items():
+        plan = queryset.explain()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            list(queryset.all())
+        elapsed = (time.perf_counter() - start) / repeat
+        results[name] = {'plan': plan, 'ms': round(elapsed * 1000, 3)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rooms', type=int, default=50)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--json', dest='json_path')
+    args = parser.parse_args()
+
+    random.seed(0)
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        call_command('migrate', 'rooms', BEFORE_MIGRATION, verbosity=0)
+        room, user = seed(args.rooms, args.users, args.messages)
+        before = measure(room, user, args.repeat)
+
+        call_command('migrate', 'rooms', AFTER_MIGRATION, verbosity=0)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        after = measure(room, user, args.repeat)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+    for name in before:
+        print(f"== {name}: {before[name]['ms']} ms -> {after[name]['ms']} ms")
+        print(f"   before: {before[name]['plan']}")
+        print(f"   after:  {after[name]['plan']}")
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({'vendor': connection.vendor, 'before': before, 'after': after}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
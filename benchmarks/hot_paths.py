@@ -0,0 +1,320 @@
+"""
+Per-call cost of the consumer and model hot paths on seeded data at several
+sizes: RoomConsumer.receive dispatch for each client message type, each
+group handler's serialize-and-send, Room.contains_banned_words,
+Participant.is_currently_muted, Room.get_participants_info, room_state_api
+and room_list with each sort mode.
+
+    python -m benchmarks.hot_paths --sizes 10 100 1000 --save-baseline
+    python -m benchmarks.hot_paths --sizes 10 100 1000
+
+A size of N seeds N participants, N banned words and N messages in the
+measured room and N rooms in the directory. Each case is timed --repeat
+times, each time for at least --min-time seconds, and the fastest run is
+kept. --save-baseline writes the results to --baseline; later runs compare
+against that file and exit with status 1 when a case got more than
+--threshold percent slower. Baselines only mean something on the machine
+that recorded them, so they are not checked in.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import timedelta
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'syncstream_project.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from channels.layers import get_channel_layer  # noqa: E402
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.core.cache import cache  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import setup_test_environment, teardown_test_environment  # noqa: E402
+from django.urls import reverse  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from rooms.actors import room_actors  # noqa: E402
+from rooms.clock import ClockModel  # noqa: E402
+from rooms.consumers import RoomConsumer  # noqa: E402
+from rooms.models import Room, Participant, Message  # noqa: E402
+from rooms.synthetic import explicit_timestamps  # noqa: E402
+from rooms.telemetry import ingester as sync_events  # noqa: E402
+
+User = get_user_model()
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baselines', 'hot_paths.json')
+SORT_MODES = ('newest', 'oldest', 'most_popular', 'most_active')
+
+
+def seed(size):
+    Room.objects.all().delete()
+    User.objects.all().delete()
+    cache.clear()
+
+    users = [User(username=f'hot_user_{i}') for i in range(max(size, 2))]
+    for user in users:
+        user.set_unusable_password()
+    users = User.objects.bulk_create(users)
+
+    room = Room.objects.create(
+        name='Hot path room', creator=users[0], max_users=size + 1,
+        banned_words=[f'banned{i}word' for i in range(size)],
+    )
+    Participant.objects.bulk_create(
+        [Participant(room=room, user=user, is_online=i % 3 != 0) for i, user in enumerate(users[:size])],
+        batch_size=1000,
+    )
+    now = timezone.now()
+    with explicit_timestamps(Message._meta.get_field('created_at')):
+        Message.objects.bulk_create(
+            [Message(room=room, user=users[i % len(users)], message=f'message {i}',
+                     created_at=now - timedelta(seconds=size - i)) for i in range(size)],
+            batch_size=1000,
+        )
+
+    # The directory: N rooms with a few participants each, so the counts
+    # the sort modes order by differ.
+    rooms = Room.objects.bulk_create(
+        [Room(name=f'Directory room {i}', creator=users[i % len(users)]) for i in range(size)]
+    )
+    Participant.objects.bulk_create(
+        [Participant(room=directory_room, user=users[(i + j) % len(users)], is_online=j % 2 == 0)
+         for i, directory_room in enumerate(rooms) for j in range(i % 5)],
+        batch_size=1000,
+    )
+    return room, users
+
+
+def sample_events(size, user):
+    user_fields = {'user_id': user.id, 'username': user.username}
+    return {
+        'chat_message': {**user_fields, 'message': 'what a scene', 'timestamp': timezone.now().isoformat(),
+                         'message_id': '5f0c6d0e-6a3b-4b5e-9a57-0e9d6f1b2c3d'},
+        'video_control': {**user_fields, 'action': 'play', 'timestamp': 12.5, 'url': 'https://example.com/v.mp4',
+                          'server_timestamp': time.time(), 'action_at': time.time(), 'execute_at': time.time()},
+        'typing_indicator': {**user_fields, 'is_typing': True},
+        'screen_share_started': {**user_fields, 'session_id': 'a1b2c3'},
+        'screen_share_ended': user_fields,
+        'user_joined': user_fields,
+        'user_left': user_fields,
+        'webrtc_signal': {**user_fields, 'data': {'type': 'ice-candidate', 'candidate': 'candidate:0 1 UDP'}},
+        'message_deleted': {'message_id': '5f0c6d0e', 'deleted_by': 'host', 'message_content': 'spoiler',
+                            'message_author': user.username},
+        'banned_word_added': {'word': 'spoiler', 'added_by': 'host'},
+        'banned_word_removed': {'word': 'spoiler', 'removed_by': 'host'},
+        'user_kicked': {**user_fields, 'kicked_by': 'host'},
+        'user_muted': {**user_fields, 'muted_by': 'host', 'duration': 5, 'muted_until': timezone.now().isoformat()},
+        'user_unmuted': {**user_fields, 'unmuted_by': 'host'},
+        'user_banned': {**user_fields, 'banned_by': 'host'},
+        'user_unbanned': {**user_fields, 'unbanned_by': 'host'},
+        # A bulk action over every participant of the room.
+        'users_moderated': {'action': 'mute', 'moderated_by': 'host', 'duration': 5, 'muted_until': None,
+                            'users': [{'user_id': i, 'username': f'hot_user_{i}'} for i in range(size)]},
+    }
+
+
+def client_messages(size):
+    return {
+        'ping': {'type': 'ping', 'client_time': time.time() * 1000},
+        'typing_start': {'type': 'typing_start'},
+        'chat_message': {'type': 'chat_message', 'message': 'a message without any of the words'},
+        'video_control': {'type': 'video_control', 'action': 'seek', 'timestamp': 30, 'client_time': time.time() * 1000},
+        'webrtc_signal': {'type': 'webrtc_signal', 'data': {'type': 'ice-candidate', 'candidate': 'candidate:0 1 UDP'}},
+        'unknown': {'type': 'unknown'},
+    }
+
+
+async def make_consumer(room, user):
+    # A connected consumer without the handshake; what it sends is dropped
+    # after serialization.
+    async def discard(message):
+        pass
+
+    consumer = RoomConsumer()
+    consumer.scope = {'type': 'websocket', 'user': user, 'url_route': {'kwargs': {'room_id': str(room.id)}}}
+    consumer.room_id = str(room.id)
+    consumer.room_group_name = f'room_{room.id}'
+    consumer.user = user
+    consumer.clock = ClockModel()
+    consumer.corrections_paused_until = 0
+    consumer.moved = consumer.reconnecting = False
+    consumer.channel_layer = get_channel_layer()
+    consumer.channel_name = await consumer.channel_layer.new_channel()
+    consumer.base_send = discard
+    consumer.actor = await room_actors.acquire(consumer.room_id, room=room)
+    await consumer.actor.ask('join', user_id=user.id, username=user.username)
+    return consumer
+
+
+def timed_sync(fn):
+    def run(number):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        return time.perf_counter() - started
+    return run
+
+
+def timed_async(loop, fn):
+    async def batch(number):
+        started = time.perf_counter()
+        for _ in range(number):
+            await fn()
+        return time.perf_counter() - started
+    return lambda number: loop.run_until_complete(batch(number))
+
+
+def measure(run, repeat, min_time):
+    # Like timeit.autorange: grow the batch until one takes min_time.
+    number = 1
+    while run(number) < min_time:
+        number *= 2
+    runs = sorted(run(number) / number for _ in range(repeat))
+    return {
+        'us_per_op': round(runs[0] * 1e6, 2),
+        'us_per_op_median': round(statistics.median(runs) * 1e6, 2),
+        'ops_per_second': round(1 / runs[0]),
+        'number': number,
+    }
+
+
+def cases(loop, room, users, size):
+    room = Room.objects.get(id=room.id)
+    participant = Participant.objects.get(room=room, user=users[1])
+    participant.is_muted = True
+    participant.muted_until = timezone.now() + timedelta(days=1)
+    clean = 'what a great scene, rewind that part again ' * 3
+    http = Client()
+    http.force_login(users[0])
+    state_url = reverse('rooms:room_state_api', args=[room.id])
+    list_url = reverse('rooms:room_list')
+
+    def uncached(fn):
+        def run():
+            cache.clear()
+            fn()
+        return run
+
+    consumer = loop.run_until_complete(make_consumer(room, users[0]))
+    yield 'contains_banned_words', 'clean', timed_sync(lambda: room.contains_banned_words(clean))
+    yield 'contains_banned_words', 'last_word', timed_sync(lambda: room.contains_banned_words(f'a banned{size - 1}word'))
+    yield 'is_currently_muted', 'muted', timed_sync(participant.is_currently_muted)
+    yield 'get_participants_info', '', timed_sync(room.get_participants_info)
+    yield 'room_state_api', 'cached', timed_sync(lambda: http.get(state_url))
+    yield 'room_state_api', 'uncached', timed_sync(uncached(lambda: http.get(state_url)))
+    for mode in SORT_MODES:
+        yield 'room_list', mode, timed_sync(uncached(lambda mode=mode: http.get(list_url, {'sort': mode})))
+
+    for kind, message in client_messages(size).items():
+        text_data = json.dumps(message)
+        yield 'consumer_receive', kind, timed_async(loop, lambda text_data=text_data: consumer.receive(text_data))
+    for handler, event in sample_events(size, users[1]).items():
+        event = {'type': handler, **event}
+        yield 'group_handler', handler, timed_async(loop, lambda handler=handler, event=event: getattr(consumer, handler)(event))
+
+
+def run(sizes, repeat, min_time, only):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    results = []
+    try:
+        for size in sizes:
+            room, users = seed(size)
+            for name, variant, run_case in cases(loop, room, users, size):
+                if only and name not in only:
+                    continue
+                results.append({'benchmark': name, 'variant': variant, 'size': size,
+                                **measure(run_case, repeat, min_time)})
+            loop.run_until_complete(room_actors.stop_all())
+            sync_events.flush()
+    finally:
+        loop.close()
+    return results
+
+
+def key(result):
+    return f"{result['benchmark']}[{result['variant']}]@{result['size']}"
+
+
+def compare(results, baseline, threshold):
+    previous = {key(result): result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        before = previous.get(key(result))
+        if before is None:
+            continue
+        change = (result['us_per_op'] - before['us_per_op']) / before['us_per_op'] * 100
+        result['baseline_us_per_op'] = before['us_per_op']
+        result['change_percent'] = round(change, 1)
+        if change > threshold:
+            regressions.append(result)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.05, help='Seconds each timed run lasts at least')
+    parser.add_argument('--only', nargs='+', help='Benchmarks to run, e.g. room_list consumer_receive')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='Store these results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=20.0, help='Percent slowdown reported as a regression')
+    parser.add_argument('--json', dest='json_path')
+    args = parser.parse_args()
+
+    # Unknown message types and the like are logged on every call.
+    logging.getLogger('rooms').setLevel(logging.ERROR)
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        results = run(args.sizes, args.repeat, args.min_time, args.only)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+    regressions = []
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+
+    print(f"{'benchmark':<24}{'variant':<22}{'size':>6}{'us/op':>12}{'median':>12}{'ops/s':>12}{'vs base':>10}")
+    for result in results:
+        change = f"{result['change_percent']:+.1f}%" if 'change_percent' in result else ''
+        print(
+            f"{result['benchmark']:<24}{result['variant']:<22}{result['size']:>6}{result['us_per_op']:>12}"
+            f"{result['us_per_op_median']:>12}{result['ops_per_second']:>12}{change:>10}"
+        )
+
+    report = {
+        'machine': {'python': platform.python_version(), 'platform': platform.platform(), 'cores': os.cpu_count()},
+        'database': connection.vendor,
+        'results': results,
+    }
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+
+    if regressions:
+        print(f"\n{len(regressions)} case(s) more than {args.threshold}% slower than the baseline:")
+        for result in regressions:
+            print(f"  {key(result)}: {result['baseline_us_per_op']} -> {result['us_per_op']} us/op")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
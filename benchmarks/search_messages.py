@@ -0,0 +1,114 @@
+"""
+Latency of rooms.search.search_messages on one large room, for a rare word,
+a common word and a deep page of the common word.
+
+    python -m benchmarks.search_messages --messages 1000000
+"""
+import argparse
+import json
+import os
+import random
+import time
+from datetime import timedelta
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'syncstream_project.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test.utils import setup_test_environment, teardown_test_environment  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from rooms.models import Room, Message  # noqa: E402
+from rooms.search import search_messages  # noqa: E402
+
+User = get_user_model()
+
+WORDS = (
+    'play pause sync movie trailer scene episode laugh wait back again lag ok yes no '
+    'what who where when why popcorn volume subtitles loading buffer start stop skip'
+).split()
+RARE_WORD = 'xylophone'
+
+
+def seed(message_count, user_count):
+    users = User.objects.bulk_create(
+        [User(username=f'search_user_{i}', password='!') for i in range(user_count)]
+    )
+    room = Room.objects.create(name='Search benchmark', creator=users[0])
+    noise_room = Room.objects.create(name='Search noise', creator=users[0])
+
+    start = timezone.now() - timedelta(days=30)
+    step = timedelta(days=30) / message_count
+    batch = []
+    for i in range(message_count):
+        words = random.choices(WORDS, k=random.randint(3, 12))
+        if i % 10000 == 1:
+            words.append(RARE_WORD)
+        batch.append(Message(
+            room=room if i % 10 else noise_room,
+            user=random.choice(users),
+            message=' '.join(words),
+            created_at=start + step * i,
+        ))
+        if len(batch) == 5000:
+            Message.objects.bulk_create(batch)
+            batch = []
+    Message.objects.bulk_create(batch)
+
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+    return room
+
+
+def measure(room, repeat):
+    common = search_messages(room, 'popcorn', limit=50)
+    cases = {
+        'rare_word': lambda: search_messages(room, RARE_WORD, limit=50),
+        'common_word': lambda: search_messages(room, 'popcorn', limit=50),
+        'two_words': lambda: search_messages(room, 'popcorn trailer', limit=50),
+        'common_word_page_2': lambda: search_messages(
+            room, 'popcorn', before=Message.objects.get(pk=common[-1]['id']).created_at, limit=50
+        ),
+    }
+    results = {}
+    for name, run in cases.items():
+        found = len(run())
+        start = time.perf_counter()
+        for _ in range(repeat):
+            run()
+        results[name] = {'results': found, 'ms': round((time.perf_counter() - start) / repeat * 1000, 3)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--json', dest='json_path')
+    args = parser.parse_args()
+
+    random.seed(0)
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        room = seed(args.messages, args.users)
+        results = measure(room, args.repeat)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+    for name, result in results.items():
+        print(f"== {name}: {result['ms']} ms ({result['results']} results)")
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({'vendor': connection.vendor, 'messages': args.messages, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
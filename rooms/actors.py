@@ -0,0 +1,439 @@
+import asyncio
+import logging
+import time
+import uuid
+from datetime import datetime, timezone as dt_timezone
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+from .events import send_group_events
+from .presence import get_sweep_interval, sweep_presence
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SNAPSHOT_INTERVAL = 1.0
+DEFAULT_IDLE_TIMEOUT = 30
+TYPING_TIMEOUT = 5
+
+_STOP = object()
+
+
+class ActorStopped(RuntimeError):
+    pass
+
+
+class RoomActor:
+    """
+    Owns one room's mutable live state in this process: the video clock,
+    who is typing, who is muted and who is connected. Every change goes
+    through the inbox and is applied by a single task, so concurrent
+    consumers can't interleave read-modify-write cycles. The video clock is
+    saved as a snapshot at most every snapshot_interval seconds and when the
+    actor stops; events are published to the room group as before.
+
+    The actor also listens on the room group, so mutes from the moderation
+    views and video changes made by another process's actor reach it.
+    """
+
+    def __init__(self, room_id, runtime=None):
+        self.room_id = str(room_id)
+        self.group_name = f'room_{self.room_id}'
+        self.actor_id = uuid.uuid4().hex
+        self.runtime = runtime
+        self.members = 0
+        self.inbox = asyncio.Queue()
+        self.task = None
+        self.stopping = False
+        self.channel_layer = get_channel_layer()
+        self.channel_name = None
+
+        self.room = None
+        self.video = None
+        self.mutes = {}
+        self.typing = {}
+        self.connections = {}
+        self.dirty = False
+        self.last_snapshot = time.monotonic()
+        self.snapshot_interval = getattr(settings, 'ROOM_ACTOR_SNAPSHOT_INTERVAL', DEFAULT_SNAPSHOT_INTERVAL)
+        self.processed = 0
+        self.snapshots = 0
+        self.next_sweep = time.monotonic() + get_sweep_interval() if get_sweep_interval() > 0 else None
+
+    # Lifecycle
+
+    def start(self, room=None, after=None):
+        self.task = asyncio.get_running_loop().create_task(self.run(room, after))
+        return self
+
+    def on_this_loop(self):
+        try:
+            return self.task is not None and self.task.get_loop() is asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+
+    def alive(self):
+        return not self.stopping and self.on_this_loop() and not self.task.done()
+
+    async def stop(self):
+        if self.task is None or self.task.done():
+            return
+        self.inbox.put_nowait((_STOP, None, None))
+        await asyncio.shield(self.task)
+
+    async def run(self, room=None, after=None):
+        if after is not None:
+            # The previous actor for this room saves its snapshot first.
+            await asyncio.wait([after])
+        reader = None
+        try:
+            await self.load(room)
+            self.channel_name = await self.channel_layer.new_channel()
+            await self.channel_layer.group_add(self.group_name, self.channel_name)
+            reader = asyncio.get_running_loop().create_task(self.read_group())
+
+            while True:
+                try:
+                    kind, payload, reply = await asyncio.wait_for(self.inbox.get(), self.next_timeout())
+                except asyncio.TimeoutError:
+                    kind = None
+                if kind is _STOP:
+                    break
+                if kind is not None:
+                    await self.dispatch(kind, payload, reply)
+                if self.dirty and time.monotonic() - self.last_snapshot >= self.snapshot_interval:
+                    await self.save_snapshot()
+                if self.next_sweep is not None and time.monotonic() >= self.next_sweep:
+                    await self.sweep_presence()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception(f"Room actor {self.room_id} crashed")
+        finally:
+            self.stopping = True
+            if reader is not None:
+                reader.cancel()
+            if self.dirty:
+                await self.save_snapshot()
+            if self.channel_name:
+                await self.channel_layer.group_discard(self.group_name, self.channel_name)
+            self.fail_pending()
+            if self.runtime is not None:
+                self.runtime.forget(self)
+
+    def next_timeout(self):
+        now = time.monotonic()
+        deadlines = [self.next_sweep] if self.next_sweep is not None else []
+        if self.dirty:
+            deadlines.append(self.last_snapshot + self.snapshot_interval)
+        return max(0, min(deadlines) - now) if deadlines else None
+
+    def fail_pending(self):
+        while not self.inbox.empty():
+            _, _, reply = self.inbox.get_nowait()
+            if reply is not None and not reply.done():
+                reply.set_exception(ActorStopped(f"Room actor {self.room_id} stopped"))
+
+    async def read_group(self):
+        while True:
+            event = await self.channel_layer.receive(self.channel_name)
+            self.inbox.put_nowait(('group_event', event, None))
+
+    # Messaging
+
+    def tell(self, kind, **payload):
+        if self.task is not None and not self.task.done():
+            self.inbox.put_nowait((kind, payload, None))
+
+    async def ask(self, kind, **payload):
+        if self.task is None or self.task.done():
+            raise ActorStopped(f"Room actor {self.room_id} is not running")
+        reply = asyncio.get_running_loop().create_future()
+        self.inbox.put_nowait((kind, payload, reply))
+        return await reply
+
+    async def dispatch(self, kind, payload, reply):
+        try:
+            result = await getattr(self, f'on_{kind}')(**payload)
+        except Exception as e:
+            logger.error(f"Room actor {self.room_id} failed on {kind}: {str(e)}")
+            if reply is not None and not reply.done():
+                reply.set_exception(e)
+        else:
+            if reply is not None and not reply.done():
+                reply.set_result(result)
+        self.processed += 1
+
+    async def publish(self, event):
+        await self.channel_layer.group_send(self.group_name, {**event, 'origin': self.actor_id})
+
+    # State, read directly by consumers on the same event loop
+
+    def clock(self):
+        return dict(self.video) if self.video else None
+
+    def is_muted(self, user_id):
+        if user_id not in self.mutes:
+            return False
+        muted_until = self.mutes[user_id]
+        if muted_until is not None and timezone.now() > muted_until:
+            del self.mutes[user_id]
+            return False
+        return True
+
+    def typing_users(self):
+        now = time.monotonic()
+        return [username for username, expires in self.typing.values() if expires > now]
+
+    def stats(self):
+        return {
+            'room_id': self.room_id,
+            'members': self.members,
+            'connected_users': len(self.connections),
+            'inbox': self.inbox.qsize(),
+            'processed': self.processed,
+            'snapshots': self.snapshots,
+        }
+
+    # Persistence
+
+    @database_sync_to_async
+    def load(self, room=None):
+        from .caching import room_clock
+        from .models import Room, Participant, VIDEO_STATE_FIELDS
+
+        if room is None:
+            room = Room.objects.only(*VIDEO_STATE_FIELDS).get(id=self.room_id)
+        self.room = room
+        self.video = room_clock(room)
+        self.mutes = dict(
+            Participant.objects.filter(room_id=self.room_id, is_muted=True).values_list('user_id', 'muted_until')
+        )
+
+    async def save_snapshot(self):
+        self.dirty = False
+        self.last_snapshot = time.monotonic()
+        try:
+            await self.write_snapshot(dict(self.video))
+            self.snapshots += 1
+        except DatabaseError as e:
+            logger.error(f"Could not save video snapshot for room {self.room_id}: {str(e)}")
+
+    async def sweep_presence(self):
+        # Clients drained or moved off a worker are left online for the
+        # worker they reconnect to; the ones that never arrive anywhere are
+        # taken offline by whichever workers are still serving rooms.
+        self.next_sweep = time.monotonic() + get_sweep_interval()
+        # A user still connected here keeps their place, whatever deadline
+        # another tab of theirs left behind.
+        connected = self.runtime.connected() if self.runtime is not None else []
+        try:
+            expired = await database_sync_to_async(sweep_presence)(connected)
+        except DatabaseError as e:
+            logger.error(f"Could not sweep room presence: {str(e)}")
+            return
+        await send_group_events([
+            (f'room_{room_id}', {'type': 'user_left', 'user_id': user_id, 'username': username})
+            for room_id, user_id, username in expired
+        ])
+
+    @database_sync_to_async
+    def write_snapshot(self, video):
+        from .models import VIDEO_STATE_FIELDS
+
+        # Only the video columns are written, and the save still sends
+        # post_save so caches and the room clock follow.
+        updated_at = video['updated_at']
+        self.room.current_video_url = video['url']
+        self.room.video_state = video['state']
+        self.room.video_timestamp = video['position']
+        self.room.last_video_update = datetime.fromtimestamp(updated_at, tz=dt_timezone.utc) if updated_at else None
+        self.room.save(update_fields=VIDEO_STATE_FIELDS)
+
+    # Handlers
+
+    async def on_video_control(self, action, timestamp, url, action_at, user_id, username, **event):
+        self.apply_video(action, timestamp, url, action_at)
+        await self.publish({
+            'type': 'video_control',
+            'action': action,
+            'timestamp': timestamp,
+            'action_at': action_at,
+            'url': url,
+            'user_id': user_id,
+            'username': username,
+            **event,
+        })
+        return self.clock()
+
+    def apply_video(self, action, timestamp, url, action_at):
+        from .models import VIDEO_STATE_ACTIONS
+
+        if url and url != self.video['url']:
+            self.video['url'] = url
+        if action in VIDEO_STATE_ACTIONS:
+            self.video['state'] = action
+        if isinstance(timestamp, (int, float)) and timestamp >= 0:
+            self.video['position'] = timestamp
+        self.video['updated_at'] = action_at
+        self.dirty = True
+
+    async def on_is_muted(self, user_id):
+        return self.is_muted(user_id)
+
+    async def on_typing(self, user_id, username, is_typing):
+        if is_typing and self.is_muted(user_id):
+            return False
+        was_typing = user_id in self.typing and self.typing[user_id][1] > time.monotonic()
+        if is_typing:
+            self.typing[user_id] = (username, time.monotonic() + TYPING_TIMEOUT)
+        else:
+            self.typing.pop(user_id, None)
+        if is_typing and was_typing:
+            return True
+        await self.publish({
+            'type': 'typing_indicator',
+            'user_id': user_id,
+            'username': username,
+            'is_typing': is_typing,
+        })
+        return True
+
+    async def on_join(self, user_id, username, announce=True):
+        self.connections[user_id] = self.connections.get(user_id, 0) + 1
+        if self.connections[user_id] == 1 and announce:
+            await self.publish({'type': 'user_joined', 'user_id': user_id, 'username': username})
+
+    async def on_leave(self, user_id, username):
+        remaining = self.connections.get(user_id, 0) - 1
+        if remaining > 0:
+            self.connections[user_id] = remaining
+            return
+        self.connections.pop(user_id, None)
+        self.typing.pop(user_id, None)
+        await self.publish({'type': 'user_left', 'user_id': user_id, 'username': username})
+
+    async def on_stop_if_idle(self):
+        # Retiring here, between awaits, means no consumer can acquire this
+        # actor once it has decided to stop.
+        if self.members <= 0:
+            self.stopping = True
+            if self.runtime is not None:
+                self.runtime.retire(self)
+            self.inbox.put_nowait((_STOP, None, None))
+
+    async def on_save(self):
+        if self.dirty:
+            await self.save_snapshot()
+
+    async def on_group_event(self, **event):
+        # Events this actor published come back to it; everything else is a
+        # change made outside it.
+        if event.get('origin') == self.actor_id:
+            return
+        event_type = event.get('type')
+        if event_type == 'video_control' and event.get('action_at'):
+            self.apply_video(event['action'], event['timestamp'], event.get('url'), event['action_at'])
+            # The actor that published it saves the snapshot.
+            self.dirty = False
+        # The views send user ids as strings; mutes are keyed by int.
+        elif event_type == 'user_muted':
+            self.mutes[int(event['user_id'])] = parse_datetime(event.get('muted_until'))
+        elif event_type == 'user_unmuted':
+            self.mutes.pop(int(event['user_id']), None)
+        elif event_type == 'users_moderated' and event.get('action') in ('mute', 'unmute'):
+            muted_until = parse_datetime(event.get('muted_until'))
+            for user in event.get('users', []):
+                if event['action'] == 'mute':
+                    self.mutes[int(user['user_id'])] = muted_until
+                else:
+                    self.mutes.pop(int(user['user_id']), None)
+
+
+def parse_datetime(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+class RoomActorRuntime:
+    """
+    The process's room actors, started when a room's first consumer connects
+    and stopped idle_timeout seconds after its last one leaves.
+    """
+
+    def __init__(self):
+        self._actors = {}
+        self._stopping = {}
+
+    async def acquire(self, room_id, room=None):
+        room_id = str(room_id)
+        actor = self._actors.get(room_id)
+        if actor is None or not actor.alive():
+            previous = self._stopping.get(room_id) or actor
+            after = previous.task if previous is not None and previous.on_this_loop() else None
+            actor = RoomActor(room_id, runtime=self).start(room, after=after)
+            self._actors[room_id] = actor
+        actor.members += 1
+        return actor
+
+    async def release(self, actor):
+        actor.members -= 1
+        if actor.members > 0:
+            return
+        idle_timeout = getattr(settings, 'ROOM_ACTOR_IDLE_TIMEOUT', DEFAULT_IDLE_TIMEOUT)
+        if idle_timeout <= 0:
+            actor.stopping = True
+            self.retire(actor)
+            await actor.stop()
+        else:
+            asyncio.get_running_loop().call_later(idle_timeout, actor.tell, 'stop_if_idle')
+
+    def retire(self, actor):
+        if self._actors.get(actor.room_id) is actor:
+            del self._actors[actor.room_id]
+            self._stopping[actor.room_id] = actor
+
+    def forget(self, actor):
+        if self._actors.get(actor.room_id) is actor:
+            del self._actors[actor.room_id]
+        if self._stopping.get(actor.room_id) is actor:
+            del self._stopping[actor.room_id]
+
+    def room_ids(self):
+        return [room_id for room_id, actor in self._actors.items() if actor.alive()]
+
+    def connected(self):
+        return [
+            (room_id, user_id)
+            for room_id, actor in self._actors.items() if actor.alive()
+            for user_id in actor.connections
+        ]
+
+    def get(self, room_id):
+        actor = self._actors.get(str(room_id))
+        return actor if actor is not None and actor.alive() else None
+
+    async def stop_all(self):
+        actors = list(self._actors.values())
+        for actor in actors:
+            self.retire(actor)
+        for actor in actors:
+            actor.stopping = True
+        await asyncio.gather(*(actor.stop() for actor in actors if actor.on_this_loop()))
+
+    async def save_all(self):
+        # Writes every unsaved video clock now, e.g. before a shutdown.
+        actors = [actor for actor in self._actors.values() if actor.alive()]
+        await asyncio.gather(*(actor.ask('save') for actor in actors), return_exceptions=True)
+
+    def stats(self):
+        actors = [actor for actor in self._actors.values() if actor.alive()]
+        return {
+            'actors': len(actors),
+            'members': sum(actor.members for actor in actors),
+            'inbox': sum(actor.inbox.qsize() for actor in actors),
+            'rooms': [actor.stats() for actor in actors],
+        }
+
+
+room_actors = RoomActorRuntime()
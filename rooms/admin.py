@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Room, Participant, Message, ScreenSession
+from .models import Room, Participant, Message, MessageArchive, ScreenSession, RoomDeletionJob, RoomSyncSummary
 
 @admin.register(Room)
 class RoomAdmin(admin.ModelAdmin):
@@ -11,9 +11,11 @@ class RoomAdmin(admin.ModelAdmin):
     
     
     def permanently_delete_rooms(self, request, queryset):
-        count = queryset.count()
-        queryset.delete()
-        self.message_user(request, f"{count} rooms permanently deleted.")
+        count = 0
+        for room in queryset:
+            room.hard_delete(request.user)
+            count += 1
+        self.message_user(request, f"{count} rooms queued for permanent deletion.")
     permanently_delete_rooms.short_description = "Permanently delete selected rooms"
 
 @admin.register(Participant)
@@ -34,4 +36,24 @@ class ScreenSessionAdmin(admin.ModelAdmin):
     list_display = ('user', 'room', 'started_at', 'ended_at', 'is_active')
     list_filter = ('is_active', 'started_at')
     search_fields = ('user__username', 'room__name')
-    readonly_fields = ('started_at', 'ended_at')
\ No newline at end of file
+    readonly_fields = ('started_at', 'ended_at')
+
+@admin.register(RoomDeletionJob)
+class RoomDeletionJobAdmin(admin.ModelAdmin):
+    list_display = ('room_name', 'room_id', 'status', 'stage', 'attempts', 'created_at', 'finished_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('room_name', 'room_id')
+    readonly_fields = ('created_at', 'updated_at', 'finished_at', 'deleted_counts', 'last_error')
+
+@admin.register(MessageArchive)
+class MessageArchiveAdmin(admin.ModelAdmin):
+    list_display = ('room', 'day', 'part', 'message_count', 'size_bytes', 'codec', 'created_at')
+    list_filter = ('codec', 'day')
+    search_fields = ('room__name',)
+    readonly_fields = ('path', 'user_counts', 'first_created_at', 'last_created_at', 'created_at')
+
+@admin.register(RoomSyncSummary)
+class RoomSyncSummaryAdmin(admin.ModelAdmin):
+    list_display = ('room', 'period_start', 'samples', 'latency_p50', 'latency_p95', 'latency_p99', 'drift_p95')
+    list_filter = ('period_start',)
+    search_fields = ('room__name',)
@@ -0,0 +1,205 @@
+import gzip
+import json
+import logging
+import uuid
+from collections import Counter
+from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from users.models import UserStats
+from .caching import bump_room_state_version
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_PART_SIZE = 50000
+ARCHIVE_DELETE_CHUNK_SIZE = 5000
+ARCHIVE_CACHE_TIMEOUT = 300
+ARCHIVE_CACHE_MAX_BYTES = 512 * 1024
+
+
+def get_archive_storage():
+    return FileSystemStorage(location=settings.MESSAGE_ARCHIVE_ROOT)
+
+
+def delete_archive_files(paths):
+    storage = get_archive_storage()
+    for path in paths:
+        storage.delete(path)
+
+
+def compress(data):
+    if zstandard is not None:
+        return 'zstd', zstandard.ZstdCompressor(level=10).compress(data)
+    return 'gzip', gzip.compress(data)
+
+
+def decompress(codec, data):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('The zstandard package is required to read zstd message archives')
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def get_retention_days(room):
+    if room.message_retention_days is not None:
+        return room.message_retention_days
+    return getattr(settings, 'MESSAGE_RETENTION_DAYS', None)
+
+
+def get_retention_cutoff(room, now=None):
+    days = get_retention_days(room)
+    if days is None:
+        return None
+    # Only whole days are archived, so every blob covers a finished day.
+    today = timezone.localdate(now or timezone.now())
+    return timezone.make_aware(datetime.combine(today - timedelta(days=days), time.min))
+
+
+def day_bounds(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def archive_message_chunk(room, day, messages):
+    from .models import Message, MessageArchive
+
+    part = MessageArchive.objects.filter(room=room, day=day).count()
+    lines = ''.join(json.dumps(message.to_dict()) + '\n' for message in messages)
+    codec, blob = compress(lines.encode())
+    extension = 'jsonl.zst' if codec == 'zstd' else 'jsonl.gz'
+
+    storage = get_archive_storage()
+    path = f'rooms/{room.id}/{day.isoformat()}-{part}.{extension}'
+    if storage.exists(path):
+        # Left behind by a run that failed before its transaction committed.
+        storage.delete(path)
+    path = storage.save(path, ContentFile(blob))
+
+    user_counts = Counter(str(message.user_id) for message in messages)
+    pks = [message.pk for message in messages]
+
+    with transaction.atomic():
+        missing = set(user_counts) - {
+            str(user_id) for user_id in UserStats.objects.filter(user_id__in=user_counts).values_list('user_id', flat=True)
+        }
+        if missing:
+            UserStats.rebuild([int(user_id) for user_id in missing])
+        UserStats.adjust_many(user_counts, 'archived_messages')
+
+        archive = MessageArchive.objects.create(
+            room=room,
+            day=day,
+            part=part,
+            path=path,
+            codec=codec,
+            message_count=len(messages),
+            user_counts=dict(user_counts),
+            size_bytes=len(blob),
+            first_created_at=messages[0].created_at,
+            last_created_at=messages[-1].created_at,
+        )
+
+        for i in range(0, len(pks), ARCHIVE_DELETE_CHUNK_SIZE):
+            chunk = Message.objects.filter(pk__in=pks[i:i + ARCHIVE_DELETE_CHUNK_SIZE])
+            chunk._raw_delete(chunk.db)
+
+    return archive
+
+
+def archive_room_messages(room, cutoff=None, part_size=ARCHIVE_PART_SIZE):
+    from .models import Message
+
+    cutoff = cutoff or get_retention_cutoff(room)
+    if cutoff is None:
+        return 0
+
+    archived = 0
+    while True:
+        oldest = (
+            Message.objects.filter(room=room, created_at__lt=cutoff)
+            .order_by('created_at')
+            .values_list('created_at', flat=True)
+            .first()
+        )
+        if oldest is None:
+            break
+
+        day = timezone.localdate(oldest)
+        start, end = day_bounds(day)
+        messages = list(
+            Message.objects.filter(room=room, created_at__gte=start, created_at__lt=min(end, cutoff))
+            .select_related('user')
+            .order_by('created_at', 'id')[:part_size]
+        )
+        archive = archive_message_chunk(room, day, messages)
+        archived += archive.message_count
+        logger.info(f"Archived {archive.message_count} messages from room {room.id} for {day}")
+
+    if archived:
+        bump_room_state_version(room.id)
+    return archived
+
+
+def read_archive(archive):
+    # Returns the raw JSON lines, oldest first. The compressed blob is cached
+    # rather than the parsed entries: it is several times smaller, and a
+    # history page stops parsing once it is full. Parts too big for one cache
+    # value are read from storage each time.
+    cache_key = f'message_archive_blob_{archive.pk}'
+    blob = cache.get(cache_key)
+    if blob is None:
+        with get_archive_storage().open(archive.path, 'rb') as f:
+            blob = f.read()
+        if len(blob) <= ARCHIVE_CACHE_MAX_BYTES:
+            cache.set(cache_key, blob, timeout=ARCHIVE_CACHE_TIMEOUT)
+    return decompress(archive.codec, blob).decode().splitlines()
+
+
+def is_before_cursor(entry, before, before_id):
+    created_at = parse_datetime(entry['created_at'])
+    if created_at != before:
+        return created_at < before
+    return before_id is not None and uuid.UUID(entry['id']) < before_id
+
+
+def get_room_history(room, before=None, before_id=None, limit=50):
+    # Newest first: recent rows come from the Message table, and once those
+    # run out the page continues into the archived days. Pages are keyed by
+    # (created_at, id), so messages sharing the timestamp at the end of a
+    # page are not skipped. Clients that send no before_id still skip them.
+    from .models import Message
+
+    hot = Message.objects.filter(room=room).select_related('user').order_by('-created_at', '-id')
+    if before:
+        older = Q(created_at__lt=before)
+        if before_id is not None:
+            older |= Q(created_at=before, id__lt=before_id)
+        hot = hot.filter(older)
+    results = [message.to_dict() for message in hot[:limit]]
+
+    if len(results) < limit:
+        archives = room.message_archives.order_by('-day', '-part')
+        if before:
+            archives = archives.filter(first_created_at__lte=before)
+        for archive in archives.iterator():
+            for line in reversed(read_archive(archive)):
+                entry = json.loads(line)
+                if before and not is_before_cursor(entry, before, before_id):
+                    continue
+                results.append(entry)
+                if len(results) >= limit:
+                    return results
+
+    return results
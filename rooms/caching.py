@@ -0,0 +1,177 @@
+import time
+import logging
+from django.core.cache import cache
+from django.db.models import Count, Q
+from syncstream_project.db_routers import replica_cache_timeout
+
+logger = logging.getLogger(__name__)
+
+ROOM_STATE_SNAPSHOT_TIMEOUT = 60
+ROOM_SETTINGS_TIMEOUT = 300
+ROOM_STATE_MESSAGES_LIMIT = 20
+
+DIRECTORY_VERSION_KEY = 'room_directory_version'
+DIRECTORY_CACHE_TIMEOUT = 300
+HOME_ROOMS_LIMIT = 12
+
+
+def _new_version():
+    # Seeding from the clock keeps versions moving forward even if the key is
+    # evicted, so an old ETag can never match a freshly rebuilt snapshot.
+    return int(time.time() * 1000)
+
+
+def _get_version(key):
+    version = cache.get(key)
+    if version is None:
+        version = _new_version()
+        if not cache.add(key, version, timeout=None):
+            version = cache.get(key, version)
+    return version
+
+
+def _bump_version(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = _new_version()
+        cache.set(key, version, timeout=None)
+        return version
+
+
+def _room_state_version_key(room_id):
+    return f'room_{room_id}_state_version'
+
+
+def get_room_state_version(room_id):
+    return _get_version(_room_state_version_key(room_id))
+
+
+def bump_room_state_version(room_id):
+    return _bump_version(_room_state_version_key(room_id))
+
+
+def _room_settings_version_key(room_id):
+    return f'room_{room_id}_settings_version'
+
+
+def get_room_settings_version(room_id):
+    return _get_version(_room_settings_version_key(room_id))
+
+
+def bump_room_settings_version(room_id):
+    return _bump_version(_room_settings_version_key(room_id))
+
+
+def get_directory_version():
+    return _get_version(DIRECTORY_VERSION_KEY)
+
+
+def bump_directory_version():
+    return _bump_version(DIRECTORY_VERSION_KEY)
+
+
+def build_room_state(room):
+    participants = list(room.participants.select_related('user'))
+    recent_messages = room.messages.select_related('user').order_by('-created_at')[:ROOM_STATE_MESSAGES_LIMIT]
+
+    return {
+        'room': {
+            'id': str(room.id),
+            'name': room.name,
+            'creator': room.creator.username,
+            'video_state': room.get_video_state(),
+            'participants_count': len(participants),
+            'online_count': sum(1 for participant in participants if participant.is_online),
+            'is_private': room.is_private
+        },
+        'participants': [
+            {
+                'id': participant.user.id,
+                'username': participant.user.username,
+                'is_online': participant.is_online,
+                'is_moderator': participant.is_moderator,
+                'joined_at': participant.joined_at.isoformat()
+            }
+            for participant in participants
+        ],
+        'messages': [
+            {
+                'id': str(msg.id),
+                'user': msg.user.username,
+                'message': msg.message,
+                'type': msg.message_type,
+                'timestamp': msg.created_at.isoformat()
+            }
+            for msg in recent_messages
+        ]
+    }
+
+
+def get_room_state_snapshot(room_id):
+    from .models import Room
+
+    version = get_room_state_version(room_id)
+    snapshot_key = f'room_{room_id}_state_{version}'
+
+    snapshot = cache.get(snapshot_key)
+    if snapshot is not None:
+        return snapshot
+
+    try:
+        room = Room.objects.select_related('creator').get(id=room_id, is_active=True)
+    except Room.DoesNotExist:
+        return None
+
+    snapshot = build_room_state(room)
+    snapshot['version'] = version
+    cache.set(snapshot_key, snapshot, timeout=replica_cache_timeout(ROOM_STATE_SNAPSHOT_TIMEOUT))
+    return snapshot
+
+
+def get_cached_room(room_id):
+    """
+    Returns the Room for per-message permission checks (allow_chat, banned
+    words, screen sharing) without a query in the common case. Video state
+    saves don't invalidate it, so its video fields may be stale; use a fresh
+    Room for anything that reads or saves those.
+    """
+    from .models import Room
+
+    room_key = f'room_{room_id}_settings_{get_room_settings_version(room_id)}'
+    room = cache.get(room_key)
+    if room is None:
+        room = Room.objects.filter(id=room_id).first()
+        if room is not None:
+            cache.set(room_key, room, timeout=replica_cache_timeout(ROOM_SETTINGS_TIMEOUT))
+    return room
+
+
+def room_clock(room):
+    return {
+        'url': room.current_video_url,
+        'state': room.video_state,
+        'position': room.video_timestamp,
+        'updated_at': room.last_video_update.timestamp() if room.last_video_update else None,
+    }
+
+
+def annotate_room_counts(queryset):
+    return queryset.select_related('creator').annotate(
+        participant_count=Count('participants'),
+        online_count=Count('participants', filter=Q(participants__is_online=True)),
+    )
+
+
+def get_home_rooms():
+    from .models import Room
+
+    cache_key = f'room_directory_home_{get_directory_version()}'
+    rooms = cache.get(cache_key)
+    if rooms is None:
+        rooms = list(
+            annotate_room_counts(Room.objects.filter(is_active=True, is_private=False))
+            .order_by('-online_count', '-created_at')[:HOME_ROOMS_LIMIT]
+        )
+        cache.set(cache_key, rooms, timeout=replica_cache_timeout(DIRECTORY_CACHE_TIMEOUT))
+    return rooms
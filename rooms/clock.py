@@ -0,0 +1,78 @@
+import time
+from collections import deque
+
+CLOCK_WINDOW_SIZE = 8
+CLOCK_WINDOW_SECONDS = 120
+MAX_PENDING_PINGS = 16
+# Anything slower than this is a stalled tab or a dropped pong, not a
+# usable sample.
+MAX_SAMPLE_RTT = 10.0
+
+
+class ClockModel:
+    """
+    NTP-style estimate of one connection's clock, kept by the consumer.
+
+    Every ping gives four timestamps: client send (t0), server receive (t1),
+    server send (t2) and client receive (t3, reported with the next ping).
+    Each sample gives the round trip (t3 - t0) - (t2 - t1) and the offset
+    ((t1 - t0) + (t2 - t3)) / 2, the server clock minus the client clock.
+    Queueing delay only ever adds to the round trip and skews the offset,
+    so the estimate comes from the lowest-RTT sample in a sliding window.
+    All values are in seconds.
+    """
+
+    def __init__(self, window_size=CLOCK_WINDOW_SIZE, window_seconds=CLOCK_WINDOW_SECONDS):
+        self.samples = deque(maxlen=window_size)
+        self.window_seconds = window_seconds
+        self._pending = {}
+
+    def ping_received(self, client_time, received_at, sent_at):
+        # Server-side halves of a sample; completed by pong_acknowledged.
+        self._pending[client_time] = (received_at, sent_at)
+        while len(self._pending) > MAX_PENDING_PINGS:
+            self._pending.pop(next(iter(self._pending)))
+
+    def pong_acknowledged(self, client_time, client_received_at, now=None):
+        server_times = self._pending.pop(client_time, None)
+        if server_times is None:
+            return None
+        return self.add_sample(client_time, *server_times, client_received_at, now=now)
+
+    def add_sample(self, t0, t1, t2, t3, now=None):
+        rtt = (t3 - t0) - (t2 - t1)
+        if rtt < 0 or rtt > MAX_SAMPLE_RTT:
+            return None
+        offset = ((t1 - t0) + (t2 - t3)) / 2
+        self.samples.append((now or time.time(), rtt, offset))
+        return rtt, offset
+
+    def _best(self, now=None):
+        cutoff = (now or time.time()) - self.window_seconds
+        recent = [sample for sample in self.samples if sample[0] >= cutoff]
+        if not recent:
+            return None
+        return min(recent, key=lambda sample: sample[1])
+
+    def estimate(self, now=None):
+        # (offset, rtt) of the best recent sample, or None before the first
+        # complete ping.
+        best = self._best(now)
+        if best is None:
+            return None
+        return best[2], best[1]
+
+    def offset(self, now=None):
+        estimate = self.estimate(now)
+        return estimate[0] if estimate else None
+
+    def to_server_time(self, client_time, now=None):
+        offset = self.offset(now)
+        return client_time + offset if offset is not None else None
+
+    def as_dict(self, now=None):
+        estimate = self.estimate(now)
+        if estimate is None:
+            return {'clock_offset': None, 'rtt': None, 'clock_samples': 0}
+        offset, rtt = estimate
+        return {'clock_offset': round(offset, 4), 'rtt': round(rtt, 4), 'clock_samples': len(self.samples)}
@@ -5,9 +5,17 @@ from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
 from .models import Room, Participant, Message, ScreenSession
+from .actors import room_actors, ActorStopped
+from .workers import room_router, get_worker_id, ROOM_MOVED_CLOSE_CODE
+from .drain import worker_drain, SERVICE_RESTART_CLOSE_CODE
+from .presence import expect_reconnect
+from .caching import get_cached_room
+from .telemetry import ingester as sync_events, clock_position, DRIFT_ACTIONS
+from .clock import ClockModel
+from syncstream_project.db_routers import replica_reads, routing_scope
 from django.utils import timezone
 from asgiref.sync import sync_to_async
-from django.core.cache import cache
+from django.conf import settings
 import asyncio
 
 logger = logging.getLogger(__name__)
@@ -18,6 +26,18 @@ class RoomConsumer(AsyncWebsocketConsumer):
         self.room_id = self.scope['url_route']['kwargs']['room_id']
         self.room_group_name = f'room_{self.room_id}'
         self.user = self.scope['user']
+        self.clock = ClockModel()
+        self.corrections_paused_until = 0
+        self.actor = None
+        self.moved = False
+        self.reconnecting = False
+
+        # A draining worker takes no new connections; the client retries
+        # and lands on another worker.
+        if worker_drain.draining:
+            self.reconnecting = True
+            await self.close(code=SERVICE_RESTART_CLOSE_CODE)
+            return
 
         await self.channel_layer.group_add(
             self.room_group_name,
@@ -28,6 +48,14 @@ class RoomConsumer(AsyncWebsocketConsumer):
             await self.close(code=4003)
             return
 
+        # Each room is served by one worker; anyone who reached another is
+        # sent there before any work is done here.
+        redirect = await room_router.redirect_for(self.room_id)
+        if redirect:
+            await self.accept()
+            await self.room_moved({'worker_id': redirect[0], 'url': redirect[1]})
+            return
+
         try:
             room = await self.get_room()
             if not room:
@@ -66,18 +94,14 @@ class RoomConsumer(AsyncWebsocketConsumer):
                 return
                 
             await self.update_user_online_status(True)
-            await self.update_participant_online_status(True)
             
             await self.accept()
             
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'user_joined',
-                    'user_id': self.user.id,
-                    'username': self.user.username,
-                }
-            )
+            # The room's actor announces the user once, however many tabs
+            # they have open.
+            self.actor = await room_actors.acquire(self.room_id, room=room)
+            await self.actor.ask('join', user_id=self.user.id, username=self.user.username)
+            worker_drain.add(self)
             
             logger.info(f"User {self.user.username} connected to room {self.room_id}")
             
@@ -86,24 +110,33 @@ class RoomConsumer(AsyncWebsocketConsumer):
             await self.close(code=4002)
 
     async def disconnect(self, close_code):
-        if self.user.is_authenticated:
+        worker_drain.discard(self)
+        
+        # A moved or drained client is reconnecting to another worker, which
+        # keeps it online there; it goes offline if it hasn't arrived by the
+        # reconnect deadline. One turned away before joining leaves the
+        # user's other tabs as they are.
+        if self.user.is_authenticated and (self.moved or self.reconnecting):
+            if self.actor is not None:
+                await self.mark_reconnecting()
+        elif self.user.is_authenticated:
             try:
                 await self.remove_participant()
                 await self.update_user_online_status(False)
-                await self.update_participant_online_status(False)
                 
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'user_left',
-                        'user_id': self.user.id,
-                        'username': self.user.username,
-                    }
-                )
+                if self.actor is not None and not self.actor.task.done():
+                    await self.actor.ask('leave', user_id=self.user.id, username=self.user.username)
                 
                 logger.info(f"User {self.user.username} disconnected from room {self.room_id}")
             except Exception as e:
                 logger.error(f"Error during disconnect: {str(e)}")
+        
+        if self.actor is not None:
+            await room_actors.release(self.actor)
+            self.actor = None
+
+        if sync_events.pending():
+            await self.flush_sync_events()
 
         try:
             await self.channel_layer.group_discard(
@@ -114,6 +147,11 @@ class RoomConsumer(AsyncWebsocketConsumer):
             logger.error(f"Error leaving group: {str(e)}")
 
     async def receive(self, text_data):
+        # Each inbound message is its own unit of work for replica routing.
+        with routing_scope():
+            await self.handle_receive(text_data)
+
+    async def handle_receive(self, text_data):
         try:
             data = json.loads(text_data)
             message_type = data.get('type')
@@ -126,6 +164,8 @@ class RoomConsumer(AsyncWebsocketConsumer):
                 await self.handle_screen_share(data)
             elif message_type == 'ping':
                 await self.handle_ping(data)
+            elif message_type == 'drift_report':
+                await self.handle_drift_report(data)
             elif message_type == 'webrtc_signal':
                 await self.handle_webrtc_signal(data)
             elif message_type == 'typing_start':
@@ -152,39 +192,37 @@ class RoomConsumer(AsyncWebsocketConsumer):
                 'message': 'Internal server error'
             }))
 
+    # The room actor
+
+    async def live_actor(self):
+        # Every use of the room's actor goes through here or ask_actor. An
+        # actor that crashed is replaced, and this connection counted again by
+        # the new one, instead of leaving the socket on a dead actor.
+        if self.actor.task.done() and not worker_drain.draining:
+            previous = self.actor
+            self.actor = await room_actors.acquire(self.room_id)
+            await room_actors.release(previous)
+            logger.warning(f"Re-acquired the stopped actor of room {self.room_id}")
+            await self.actor.ask('join', user_id=self.user.id, username=self.user.username, announce=False)
+        return self.actor
+
+    async def ask_actor(self, kind, **payload):
+        actor = await self.live_actor()
+        try:
+            return await actor.ask(kind, **payload)
+        except ActorStopped:
+            # Stopped while the request was queued; once more on a fresh one.
+            return await (await self.live_actor()).ask(kind, **payload)
+
     async def handle_typing_start(self):
         try:
-            is_muted = await self.check_if_muted()
-            if is_muted:
-                return
-            
-            await self.add_user_to_typing_cache()
-                
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'typing_indicator',
-                    'user_id': self.user.id,
-                    'username': self.user.username,
-                    'is_typing': True
-                }
-            )
+            await self.ask_actor('typing', user_id=self.user.id, username=self.user.username, is_typing=True)
         except Exception as e:
             logger.error(f"Error handling typing start: {str(e)}")
 
     async def handle_typing_stop(self):
         try:
-            await self.remove_user_from_typing_cache()
-                
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'typing_indicator',
-                    'user_id': self.user.id,
-                    'username': self.user.username,
-                    'is_typing': False
-                }
-            )
+            await self.ask_actor('typing', user_id=self.user.id, username=self.user.username, is_typing=False)
         except Exception as e:
             logger.error(f"Error handling typing stop: {str(e)}")
 
@@ -205,30 +243,41 @@ class RoomConsumer(AsyncWebsocketConsumer):
             timestamp = data.get('timestamp', 0)
             url = data.get('url', '')
             
-            room = await self.get_room()
-            if room:
-                server_timestamp = time.time()
-                await self.update_video_state(room, action, timestamp, url, server_timestamp)
-                
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'video_control',
-                        'action': action,
-                        'timestamp': timestamp,
-                        'server_timestamp': server_timestamp,
-                        'url': url,
-                        'user_id': self.user.id,
-                        'username': self.user.username,
-                    }
-                )
+            # The room's actor applies the change, publishes it and saves a
+            # snapshot of the clock shortly after. Its clock is empty only
+            # while it is still loading; the ask waits for that.
+            clock = (await self.live_actor()).clock()
+            server_timestamp = time.time()
+            action_at = self.get_action_time(data.get('client_time'), server_timestamp)
+            if clock:
+                self.record_sync_event(clock, action, timestamp, data.get('client_time'), server_timestamp, action_at)
+            await self.ask_actor(
+                'video_control',
+                action=action,
+                timestamp=timestamp,
+                url=url,
+                action_at=action_at,
+                user_id=self.user.id,
+                username=self.user.username,
+                server_timestamp=server_timestamp,
+                execute_at=server_timestamp + getattr(settings, 'VIDEO_CONTROL_LEAD', 0.3),
+            )
+            if sync_events.flush_due():
+                await self.flush_sync_events()
         except Exception as e:
             logger.error(f"Error handling video control: {str(e)}")
+            # The client has already moved its own player; tell it the room
+            # did not follow so it can resync.
+            await self.send(text_data=json.dumps({
+                'type': 'error',
+                'message': 'Video change was not applied',
+                'action': data.get('action'),
+            }))
 
     async def handle_screen_share(self, data):
         try:
             action = data.get('action')
-            room = await self.get_room()
+            room = await self.get_room_settings()
             
             if room and room.allow_screen_share:
                 if action == 'start':
@@ -258,15 +307,83 @@ class RoomConsumer(AsyncWebsocketConsumer):
 
     async def handle_ping(self, data):
         try:
+            received_at = time.time()
             client_time = data.get('client_time')
+            
+            # The client reports when the previous pong arrived, which
+            # completes that ping's sample (client times are in ms).
+            previous = data.get('previous')
+            if isinstance(previous, dict):
+                sent, arrived = previous.get('client_time'), previous.get('received_at')
+                if isinstance(sent, (int, float)) and isinstance(arrived, (int, float)):
+                    self.clock.pong_acknowledged(sent / 1000, arrived / 1000)
+            
+            sent_at = time.time()
+            if isinstance(client_time, (int, float)):
+                self.clock.ping_received(client_time / 1000, received_at, sent_at)
+            
             await self.send(text_data=json.dumps({
                 'type': 'pong',
                 'client_time': client_time,
-                'server_time': time.time()
+                'server_receive_time': received_at,
+                'server_time': sent_at,
+                **self.clock.as_dict(),
             }))
         except Exception as e:
             logger.error(f"Error handling ping: {str(e)}")
 
+    async def handle_drift_report(self, data):
+        # Sent by every viewer every few seconds, so this path reads only the
+        # actor's clock, writes nothing but a buffered telemetry row and
+        # answers only the reporting client, and only when it is off.
+        try:
+            position = data.get('position')
+            if not isinstance(position, (int, float)):
+                return
+            
+            now = time.time()
+            if now < self.corrections_paused_until:
+                return
+            
+            clock = (await self.live_actor()).clock()
+            if not clock or clock['state'] not in ('play', 'pause'):
+                return
+            if data.get('url') and clock['url'] and data['url'] != clock['url']:
+                return
+            
+            reported_at = self.get_action_time(data.get('client_time'), now)
+            drift = position - clock_position(clock, reported_at)
+            room_playing = clock['state'] == 'play'
+            
+            sync_events.record(
+                room_id=self.room_id,
+                user_id=self.user.id,
+                action='drift_report',
+                client_timestamp=reported_at,
+                server_timestamp=now,
+                position=position,
+                drift_ms=drift * 1000,
+            )
+            if sync_events.flush_due():
+                await self.flush_sync_events()
+            
+            threshold = getattr(settings, 'SYNC_DRIFT_THRESHOLD', 0.5)
+            if abs(drift) <= threshold and bool(data.get('playing')) == room_playing:
+                return
+            
+            execute_at = now + getattr(settings, 'VIDEO_CONTROL_LEAD', 0.3)
+            self.corrections_paused_until = execute_at + getattr(settings, 'SYNC_CORRECTION_COOLDOWN', 3)
+            await self.send(text_data=json.dumps({
+                'type': 'sync_correction',
+                'state': clock['state'],
+                'timestamp': clock_position(clock, execute_at),
+                'execute_at': execute_at,
+                'drift': round(drift, 3),
+                **self.clock.as_dict(),
+            }))
+        except Exception as e:
+            logger.error(f"Error handling drift report: {str(e)}")
+
     async def handle_webrtc_signal(self, data):
         try:
             webrtc_data = data.get('data', {})
@@ -312,7 +429,13 @@ class RoomConsumer(AsyncWebsocketConsumer):
             current_time = time.time()
             
             latency = current_time - server_timestamp if server_timestamp else 0
+            execute_at = event.get('execute_at', server_timestamp)
+            # Reports sent while this client applies the change would look
+            # like drift.
+            self.corrections_paused_until = execute_at + getattr(settings, 'SYNC_CORRECTION_COOLDOWN', 3)
             
+            # action_at and execute_at are server clock; clock_offset (server
+            # minus this client) lets the client act at execute_at locally.
             await self.send(text_data=json.dumps({
                 'type': 'video_control',
                 'action': event['action'],
@@ -321,11 +444,29 @@ class RoomConsumer(AsyncWebsocketConsumer):
                 'user_id': event['user_id'],
                 'username': event['username'],
                 'server_timestamp': server_timestamp,
-                'latency': round(latency, 3)
+                'action_at': event.get('action_at', server_timestamp),
+                'execute_at': execute_at,
+                'latency': round(latency, 3),
+                **self.clock.as_dict(),
             }))
         except Exception as e:
             logger.error(f"Error sending video control: {str(e)}")
 
+    async def room_moved(self, event):
+        if event['worker_id'] == get_worker_id():
+            return
+        self.moved = True
+        await self.send(text_data=json.dumps({
+            'type': 'room_moved',
+            'worker_id': event['worker_id'],
+            'url': event['url'],
+        }))
+        await self.close(code=ROOM_MOVED_CLOSE_CODE)
+
+    async def send_reconnect(self, retry_in):
+        self.reconnecting = True
+        await self.send(text_data=json.dumps({'type': 'reconnect', 'retry_in': retry_in}))
+
     async def screen_share_started(self, event):
         await self.send(text_data=json.dumps({
             'type': 'screen_share_started',
@@ -455,10 +596,19 @@ class RoomConsumer(AsyncWebsocketConsumer):
             'unbanned_by': event['unbanned_by']
         }))
 
+    async def users_moderated(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'users_moderated',
+            'action': event['action'],
+            'users': event['users'],
+            'moderated_by': event['moderated_by'],
+            'duration': event['duration'],
+            'muted_until': event['muted_until']
+        }))
+
     async def handle_chat_message(self, data):
         try:
-            is_muted = await self.check_if_muted()
-            if is_muted:
+            if await self.ask_actor('is_muted', user_id=self.user.id):
                 await self.send(text_data=json.dumps({
                     'type': 'error',
                     'message': 'You are currently muted and cannot send messages'
@@ -481,7 +631,7 @@ class RoomConsumer(AsyncWebsocketConsumer):
                 }))
                 return
 
-            room = await self.get_room()
+            room = await self.get_room_settings()
             if room and room.contains_banned_words(message):
                 await self.send(text_data=json.dumps({
                     'type': 'error',
@@ -512,23 +662,25 @@ class RoomConsumer(AsyncWebsocketConsumer):
             }))
 
     @database_sync_to_async
-    def check_if_muted(self):
+    def get_room(self, replica=False):
         try:
-            participant = Participant.objects.get(room_id=self.room_id, user=self.user)
-            return participant.is_currently_muted()
-        except Participant.DoesNotExist:
-            return False
-
-    @database_sync_to_async
-    def get_room(self):
-        try:
-            return Room.objects.get(id=self.room_id)
+            with replica_reads(replica):
+                return Room.objects.get(id=self.room_id)
         except Room.DoesNotExist:
             return None
         except Exception as e:
             logger.error(f"Error getting room {self.room_id}: {str(e)}")
             return None
 
+    @database_sync_to_async
+    def get_room_settings(self):
+        try:
+            with replica_reads():
+                return get_cached_room(self.room_id)
+        except Exception as e:
+            logger.error(f"Error getting room settings {self.room_id}: {str(e)}")
+            return None
+
     @database_sync_to_async
     def check_if_banned(self, room):
         try:
@@ -544,23 +696,14 @@ class RoomConsumer(AsyncWebsocketConsumer):
     @database_sync_to_async
     def check_room_access(self, room):
         try:
-            is_banned = Participant.objects.filter(
-                room=room, 
-                user=self.user, 
-                is_banned=True
-            ).exists()
-        
-            if is_banned:
-                logger.warning(f"User {self.user.id} is banned from room {self.room_id}")
-                return False
-                
+            # Bans are checked by connect() before this runs.
             is_participant = Participant.objects.filter(
                 room=room, 
                 user=self.user, 
                 is_online=True
             ).exists()
             
-            is_creator = room.creator == self.user
+            is_creator = room.creator_id == self.user.id
             
             return is_participant or is_creator
             
@@ -587,7 +730,8 @@ class RoomConsumer(AsyncWebsocketConsumer):
             )
             if not created:
                 participant.is_online = True
-                participant.save()
+                participant.reconnect_deadline = None
+                participant.save(update_fields=['is_online', 'reconnect_deadline'])
             return participant
         except Exception as e:
             logger.error(f"Error adding participant: {str(e)}")
@@ -598,7 +742,7 @@ class RoomConsumer(AsyncWebsocketConsumer):
         try:
             participant = Participant.objects.get(room_id=self.room_id, user=self.user)
             participant.is_online = False
-            participant.save()
+            participant.save(update_fields=['is_online'])
             return True
         except Participant.DoesNotExist:
             logger.warning(f"Participant not found for user {self.user.id} in room {self.room_id}")
@@ -607,6 +751,13 @@ class RoomConsumer(AsyncWebsocketConsumer):
             logger.error(f"Error removing participant: {str(e)}")
             return False
 
+    @database_sync_to_async
+    def mark_reconnecting(self):
+        try:
+            expect_reconnect(self.room_id, self.user.id)
+        except Exception as e:
+            logger.error(f"Error setting reconnect deadline: {str(e)}")
+
     @database_sync_to_async
     def update_user_online_status(self, is_online):
         try:
@@ -619,27 +770,10 @@ class RoomConsumer(AsyncWebsocketConsumer):
             logger.error(f"Error updating user online status: {str(e)}")
             return False
 
-    @database_sync_to_async
-    def update_participant_online_status(self, is_online):
-        try:
-            participant = Participant.objects.get(room_id=self.room_id, user=self.user)
-            participant.is_online = is_online
-            participant.save(update_fields=['is_online'])
-            return True
-        except Participant.DoesNotExist:
-            logger.warning(f"Participant not found for user {self.user.id} in room {self.room_id}")
-            return False
-        except Exception as e:
-            logger.error(f"Error updating participant online status: {str(e)}")
-            return False
-
     @database_sync_to_async
     def save_message(self, room, message):
+        # Mutes are checked against the room actor before this runs.
         try:
-            participant = Participant.objects.get(room=room, user=self.user)
-            if participant.is_currently_muted():
-                return None
-            
             return Message.objects.create(
                 room=room,
                 user=self.user,
@@ -647,33 +781,48 @@ class RoomConsumer(AsyncWebsocketConsumer):
                 message_type='text'
             )
 
-        except Participant.DoesNotExist:
-            logger.warning(f"Participant not found for user {self.user.id} in room {room.id}")
-            return None
-
         except Exception as e:
             logger.error(f"Error saving message: {str(e)}")
             return None
 
+    def get_action_time(self, client_time, server_timestamp):
+        # When the sender acted, on the server clock: their send time mapped
+        # through the clock model, else the receive time less half an RTT.
+        estimate = self.clock.estimate()
+        if estimate is None:
+            return server_timestamp
+        if isinstance(client_time, (int, float)):
+            return min(self.clock.to_server_time(client_time / 1000), server_timestamp)
+        return server_timestamp - estimate[1] / 2
+
+    def record_sync_event(self, clock, action, position, client_time, server_timestamp, action_at):
+        # Buffered only; the batch is written by flush_sync_events.
+        if not isinstance(position, (int, float)):
+            position = None
+        client_timestamp = client_time / 1000 if isinstance(client_time, (int, float)) else None
+        
+        # One-way latency is only meaningful once the clock offset is known.
+        latency_ms = None
+        if client_timestamp and self.clock.offset() is not None:
+            latency_ms = (server_timestamp - action_at) * 1000
+        drift_ms = None
+        if action in DRIFT_ACTIONS and position is not None:
+            drift_ms = (position - clock_position(clock, action_at)) * 1000
+        
+        sync_events.record(
+            room_id=self.room_id,
+            user_id=self.user.id,
+            action=str(action)[:20],
+            client_timestamp=client_timestamp or server_timestamp,
+            server_timestamp=server_timestamp,
+            position=position,
+            latency_ms=latency_ms,
+            drift_ms=drift_ms,
+        )
+
     @database_sync_to_async
-    def update_video_state(self, room, action, timestamp, url, server_timestamp=None):
-        try:
-            if url and url != room.current_video_url:
-                room.current_video_url = url
-            
-            valid_actions = ['play', 'pause', 'load', 'sync', 'seek']
-            if action in valid_actions:
-                room.video_state = action
-            
-            if timestamp >= 0:
-                room.video_timestamp = timestamp
-            
-            room.last_video_update = timezone.now()
-            room.save()
-            return True
-        except Exception as e:
-            logger.error(f"Error updating video state: {str(e)}")
-            return False
+    def flush_sync_events(self):
+        return sync_events.flush()
 
     @database_sync_to_async
     def create_screen_session(self, room):
@@ -704,41 +853,4 @@ class RoomConsumer(AsyncWebsocketConsumer):
             return True
         except Exception as e:
             logger.error(f"Error ending screen session: {str(e)}")
-            return False
-
-    @database_sync_to_async
-    def add_user_to_typing_cache(self):
-        cache_key = f'room_{self.room_id}_typing_users'
-        typing_users = cache.get(cache_key, {})
-        typing_users[self.user.id] = {
-            'username': self.user.username,
-            'timestamp': time.time()
-        }
-        cache.set(cache_key, typing_users, timeout=5)
-
-    @database_sync_to_async
-    def remove_user_from_typing_cache(self):
-        cache_key = f'room_{self.room_id}_typing_users'
-        typing_users = cache.get(cache_key, {})
-        if self.user.id in typing_users:
-            del typing_users[self.user.id]
-        cache.set(cache_key, typing_users, timeout=5)
-
-    @database_sync_to_async
-    def get_typing_users(self):
-        cache_key = f'room_{self.room_id}_typing_users'
-        typing_users = cache.get(cache_key, {})
-        
-        current_time = time.time()
-        expired_users = [
-            user_id for user_id, data in typing_users.items() 
-            if current_time - data['timestamp'] > 5
-        ]
-        
-        for user_id in expired_users:
-            del typing_users[user_id]
-        
-        if expired_users:
-            cache.set(cache_key, typing_users, timeout=10)
-        
-        return list(typing_users.values())
\ No newline at end of file
+            return False
\ No newline at end of file
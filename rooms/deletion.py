@@ -0,0 +1,158 @@
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import transaction, connections, close_old_connections
+from django.db.models import Count, F, Q
+from django.utils import timezone
+from users.models import UserStats
+from .archive import delete_archive_files
+from .caching import bump_room_state_version, bump_directory_version
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 5000
+STALE_JOB_AFTER = timezone.timedelta(minutes=10)
+
+_executor = None
+
+
+def get_chunk_size():
+    return getattr(settings, 'ROOM_DELETION_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+
+
+def room_deletion_stages():
+    from .models import Participant, Message, MessageArchive, ScreenSession, VideoSyncData, RoomSyncSummary
+    return [
+        ('participants', Participant),
+        ('messages', Message),
+        ('message_archives', MessageArchive),
+        ('screen_sessions', ScreenSession),
+        ('sync_data', VideoSyncData),
+        ('sync_summaries', RoomSyncSummary),
+    ]
+
+
+def settle_chunk(stage, model, pks):
+    # Raw deletes skip the model signals, so the counters and files they
+    # would have handled are settled here for the chunk being deleted. The
+    # room was deactivated when the job was queued, which already took it
+    # off the rooms_created and rooms_joined counters.
+    if stage == 'messages':
+        message_counts = model.objects.filter(pk__in=pks).values_list('user_id').annotate(total=Count('pk')).order_by()
+        UserStats.adjust_many({user_id: -total for user_id, total in message_counts}, 'total_messages')
+    elif stage == 'message_archives':
+        archived_counts = Counter()
+        paths = []
+        for path, user_counts in model.objects.filter(pk__in=pks).values_list('path', 'user_counts'):
+            archived_counts.update({int(user_id): -total for user_id, total in user_counts.items()})
+            paths.append(path)
+        UserStats.adjust_many(archived_counts, 'total_messages', 'archived_messages')
+        # A chunk that rolls back keeps its rows, so it must keep its files.
+        transaction.on_commit(lambda: delete_archive_files(paths))
+
+
+def run_room_deletion_job(job, chunk_size=None):
+    from .models import Room
+
+    chunk_size = chunk_size or get_chunk_size()
+    counts = dict(job.deleted_counts)
+
+    for stage, model in room_deletion_stages():
+        job.stage = stage
+        while True:
+            pks = list(
+                model.objects.filter(room_id=job.room_id).order_by().values_list('pk', flat=True)[:chunk_size]
+            )
+            if not pks:
+                break
+
+            with transaction.atomic():
+                settle_chunk(stage, model, pks)
+                chunk = model.objects.filter(pk__in=pks)
+                counts[stage] = counts.get(stage, 0) + chunk._raw_delete(chunk.db)
+                job.deleted_counts = counts
+                job.save(update_fields=['stage', 'deleted_counts', 'updated_at'])
+
+    room = Room.objects.filter(id=job.room_id)
+    if room.exists():
+        counts['room'] = room._raw_delete(room.db)
+
+    job.status = 'done'
+    job.stage = ''
+    job.deleted_counts = counts
+    job.last_error = ''
+    job.finished_at = timezone.now()
+    job.save()
+
+    bump_room_state_version(job.room_id)
+    bump_directory_version()
+    logger.info(f"Room {job.room_id} permanently deleted: {counts}")
+
+
+def claimable_jobs():
+    from .models import RoomDeletionJob
+
+    stale_before = timezone.now() - STALE_JOB_AFTER
+    return RoomDeletionJob.objects.filter(
+        Q(status__in=['pending', 'failed']) | Q(status='running', updated_at__lt=stale_before)
+    )
+
+
+def process_room_deletion(job_id, chunk_size=None):
+    from .models import RoomDeletionJob
+
+    claimed = claimable_jobs().filter(pk=job_id).update(
+        status='running',
+        attempts=F('attempts') + 1,
+        updated_at=timezone.now(),
+    )
+    if not claimed:
+        return False
+
+    job = RoomDeletionJob.objects.get(pk=job_id)
+    try:
+        run_room_deletion_job(job, chunk_size)
+        return True
+    except Exception as e:
+        logger.exception(f"Error deleting room {job.room_id}")
+        RoomDeletionJob.objects.filter(pk=job_id).update(status='failed', last_error=str(e))
+        return False
+
+
+def _run_in_background(job_id):
+    close_old_connections()
+    try:
+        process_room_deletion(job_id)
+    finally:
+        connections.close_all()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='room-deletion')
+    return _executor
+
+
+def enqueue_room_deletion(room, requested_by=None):
+    from .models import RoomDeletionJob
+
+    with transaction.atomic():
+        if room.is_active:
+            room.is_active = False
+            room.deleted_at = timezone.now()
+            room.save(update_fields=['is_active', 'deleted_at'])
+
+        job = RoomDeletionJob.objects.filter(room_id=room.id).exclude(status='done').first()
+        if job is None:
+            job = RoomDeletionJob.objects.create(
+                room_id=room.id,
+                room_name=room.name,
+                requested_by=requested_by,
+            )
+
+        if getattr(settings, 'ROOM_DELETION_IN_PROCESS', True):
+            transaction.on_commit(lambda: _get_executor().submit(_run_in_background, job.pk))
+
+    return job
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import random
+import signal
+from channels.db import database_sync_to_async
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WAVES = 5
+DEFAULT_WAVE_INTERVAL = 2.0
+
+# The client should reconnect after the retry_in hint it was sent with the
+# reconnect frame. WebSocket's own 1012 "service restart" can't be used:
+# daphne only sends 1000 or application codes (3000-4999).
+SERVICE_RESTART_CLOSE_CODE = 4012
+
+
+class WorkerDrain:
+    """
+    Takes a worker out of service without dropping every client at once.
+    On SIGTERM the worker refuses new handshakes and reports itself as
+    draining on /healthz/, saves room actor snapshots and buffered sync
+    telemetry, sends each client a reconnect frame with a randomized
+    retry_in hint, and closes the connections in waves spread over the
+    drain window. SIGTERM is then handed back to the server, which exits.
+    """
+
+    def __init__(self):
+        self.draining = False
+        self.consumers = set()
+        self.task = None
+        self._loop = None
+        self._previous_handler = None
+
+    def install(self):
+        # Called on the first ASGI call, after the server has set up its own
+        # signal handling, so this takes SIGTERM over and can hand it back.
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        previous = signal.getsignal(signal.SIGTERM)
+        try:
+            loop.add_signal_handler(signal.SIGTERM, self.begin)
+        except (NotImplementedError, RuntimeError, ValueError):
+            # Not the main thread, or a platform without loop signal support.
+            return
+        self._loop = loop
+        self._previous_handler = previous
+
+    def add(self, consumer):
+        self.consumers.add(consumer)
+
+    def discard(self, consumer):
+        self.consumers.discard(consumer)
+
+    def begin(self):
+        if self.draining:
+            return
+        self.draining = True
+        logger.info(f"Draining {len(self.consumers)} WebSocket connections")
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def run(self):
+        try:
+            await self.drain()
+        except Exception:
+            logger.exception("WebSocket drain failed")
+        finally:
+            self.hand_back()
+
+    async def drain(self, waves=None, interval=None):
+        from .actors import room_actors
+        from .telemetry import ingester as sync_events
+
+        waves = waves or getattr(settings, 'WEBSOCKET_DRAIN_WAVES', DEFAULT_WAVES)
+        interval = interval if interval is not None else getattr(
+            settings, 'WEBSOCKET_DRAIN_WAVE_INTERVAL', DEFAULT_WAVE_INTERVAL
+        )
+
+        await room_actors.save_all()
+        await database_sync_to_async(sync_events.flush)()
+
+        # Clients in later waves are told to wait longer, so reconnects
+        # arrive spread over the window rather than all at once.
+        consumers = list(self.consumers)
+        random.shuffle(consumers)
+        batches = [consumers[i::waves] for i in range(waves)]
+        for index, batch in enumerate(batches):
+            for consumer in batch:
+                await consumer.send_reconnect(retry_in=round(index * interval + random.uniform(0, interval), 2))
+
+        for batch in batches:
+            await asyncio.sleep(interval)
+            await asyncio.gather(
+                *(consumer.close(code=SERVICE_RESTART_CLOSE_CODE) for consumer in batch if consumer in self.consumers),
+                return_exceptions=True,
+            )
+
+        await room_actors.stop_all()
+        await database_sync_to_async(sync_events.flush)()
+        logger.info("WebSocket drain finished")
+
+    def hand_back(self):
+        if self._loop is None:
+            return
+        self._loop.remove_signal_handler(signal.SIGTERM)
+        signal.signal(signal.SIGTERM, self._previous_handler or signal.SIG_DFL)
+        self._loop = None
+        signal.raise_signal(signal.SIGTERM)
+
+
+worker_drain = WorkerDrain()
+
+
+class DrainMiddleware:
+    """Installs the worker's SIGTERM drain handler on its first request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        worker_drain.install()
+        return await self.app(scope, receive, send)
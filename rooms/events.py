@@ -0,0 +1,17 @@
+import asyncio
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+
+async def send_group_events(events):
+    channel_layer = get_channel_layer()
+    await asyncio.gather(*(
+        channel_layer.group_send(group, event)
+        for group, event in events
+    ))
+
+
+def dispatch_group_events(events):
+    # One thread hop for the whole batch instead of one per group_send.
+    if events:
+        async_to_sync(send_group_events)(events)
@@ -6,7 +6,8 @@ class RoomForm(forms.ModelForm):
         model = Room
         fields = [
             'name', 'description', 'is_private', 
-            'max_users', 'allow_screen_share', 'allow_chat'
+            'max_users', 'allow_screen_share', 'allow_chat',
+            'message_retention_days'
         ]
         widgets = {
             'description': forms.Textarea(attrs={'rows': 3}),
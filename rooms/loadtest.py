@@ -0,0 +1,493 @@
+import asyncio
+import base64
+import json
+import os
+import random
+import struct
+import time
+from collections import Counter
+from importlib import import_module
+from urllib.parse import urlsplit
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from .telemetry import percentile
+
+USERNAME_PREFIX = 'loadtest_'
+ROOM_NAME_PREFIX = 'Load test room'
+CONNECT_TIMEOUT = 30
+
+# Share of each message kind a simulated viewer sends, roughly what a busy
+# room sees: mostly pings and typing, some chat, WebRTC signalling while
+# someone shares a screen, and the odd play/pause/seek.
+DEFAULT_MIX = {'ping': 35, 'typing': 25, 'chat': 20, 'webrtc_signal': 15, 'video_control': 5}
+MESSAGE_KINDS = tuple(DEFAULT_MIX)
+
+# video_control positions are index * POSITION_STRIDE + sequence.
+POSITION_STRIDE = 1000000
+
+CHAT_WORDS = (
+    'lol', 'wait', 'rewind', 'this part', 'again', 'who is that', 'no way', 'skip', 'pause pls', 'ok back',
+    'brb', 'sound is off', 'same', 'haha', 'best scene', 'is it lagging', 'play', 'omg',
+)
+
+
+class WebSocketClient:
+    """
+    Just enough of a WebSocket client for load generation: unfragmented
+    text frames only. Installing daphne pins txaio to Twisted, so autobahn's
+    asyncio client can't be used in a process that has set up Django.
+    """
+
+    def __init__(self, reader, writer, on_message=None):
+        self.reader = reader
+        self.writer = writer
+        self.on_message = on_message
+        self.close_code = None
+        self.task = asyncio.get_running_loop().create_task(self.receive())
+
+    @classmethod
+    async def connect(cls, url, headers=None, on_message=None):
+        parts = urlsplit(url)
+        if parts.scheme != 'ws':
+            raise ValueError('Only ws:// URLs are supported')
+        port = parts.port or 80
+        reader, writer = await asyncio.open_connection(parts.hostname, port)
+        key = base64.b64encode(os.urandom(16)).decode()
+        lines = [
+            f'GET {parts.path or "/"} HTTP/1.1', f'Host: {parts.hostname}:{port}', 'Upgrade: websocket',
+            'Connection: Upgrade', f'Sec-WebSocket-Key: {key}', 'Sec-WebSocket-Version: 13',
+        ]
+        lines += [f'{name}: {value}' for name, value in (headers or {}).items()]
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode())
+        response = await reader.readuntil(b'\r\n\r\n')
+        if not response.startswith(b'HTTP/1.1 101'):
+            writer.close()
+            raise ConnectionError(response.split(b'\r\n', 1)[0].decode())
+        return cls(reader, writer, on_message)
+
+    def write_frame(self, payload, opcode=0x1):
+        mask = os.urandom(4)
+        length = len(payload)
+        if length < 126:
+            header = struct.pack('!BB', 0x80 | opcode, 0x80 | length)
+        elif length < 65536:
+            header = struct.pack('!BBH', 0x80 | opcode, 0x80 | 126, length)
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 0x80 | 127, length)
+        self.writer.write(header + mask + bytes(b ^ mask[i % 4] for i, b in enumerate(payload)))
+
+    async def send_json(self, data):
+        if self.task.done():
+            raise ConnectionError('connection closed')
+        self.write_frame(json.dumps(data).encode())
+
+    async def receive(self):
+        try:
+            while True:
+                first, second = await self.reader.readexactly(2)
+                length = second & 0x7f
+                if length == 126:
+                    length, = struct.unpack('!H', await self.reader.readexactly(2))
+                elif length == 127:
+                    length, = struct.unpack('!Q', await self.reader.readexactly(8))
+                payload = await self.reader.readexactly(length)
+                opcode = first & 0x0f
+                if opcode == 0x8:
+                    self.close_code = struct.unpack('!H', payload[:2])[0] if len(payload) >= 2 else 1005
+                    break
+                if opcode == 0x1 and self.on_message is not None:
+                    self.on_message(json.loads(payload))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            self.close_code = self.close_code or 1006
+
+    async def close(self):
+        if not self.task.done():
+            self.write_frame(struct.pack('!H', 1000), opcode=0x8)
+        self.writer.close()
+        self.task.cancel()
+
+
+class CommunicatorClient:
+    """The same interface over channels' WebsocketCommunicator, for runs without a server."""
+
+    def __init__(self, communicator, on_message=None):
+        self.communicator = communicator
+        self.on_message = on_message
+        self.close_code = None
+        self.task = asyncio.get_running_loop().create_task(self.receive())
+
+    @classmethod
+    async def connect(cls, application, path, user, on_message=None):
+        from channels.testing import WebsocketCommunicator
+
+        communicator = WebsocketCommunicator(application, path)
+        communicator.scope['user'] = user
+        connected, code = await communicator.connect(timeout=CONNECT_TIMEOUT)
+        if not connected:
+            raise ConnectionError(f'closed with code {code}')
+        return cls(communicator, on_message)
+
+    async def send_json(self, data):
+        if self.task.done():
+            raise ConnectionError('connection closed')
+        await self.communicator.send_json_to(data)
+
+    async def receive(self):
+        while True:
+            # A timeout here would cancel the consumer, so wait as long as
+            # the run can last.
+            output = await self.communicator.receive_output(timeout=24 * 3600)
+            if output['type'] == 'websocket.close':
+                self.close_code = output.get('code', 1000)
+                return
+            if output['type'] == 'websocket.send' and self.on_message is not None:
+                self.on_message(json.loads(output['text']))
+
+    async def close(self):
+        if not self.task.done():
+            self.task.cancel()
+            await self.communicator.disconnect()
+
+
+class ProcessSampler:
+    """
+    CPU and memory of the server processes, and their children (the workers
+    of `manage.py serve`), read from /proc once a second.
+    """
+
+    def __init__(self, pids):
+        self.pids = list(pids)
+        self.ticks = os.sysconf('SC_CLK_TCK')
+        self.page_size = os.sysconf('SC_PAGE_SIZE')
+        self.peak_rss = 0
+        self.started = None
+        self.start_cpu = None
+        self.end_cpu = None
+        self.elapsed = 0
+
+    def processes(self):
+        pids = set(self.pids)
+        for pid in self.pids:
+            try:
+                with open(f'/proc/{pid}/task/{pid}/children') as f:
+                    pids.update(int(child) for child in f.read().split())
+            except OSError:
+                pass
+        return pids
+
+    def read(self):
+        cpu = rss = 0
+        for pid in self.processes():
+            try:
+                with open(f'/proc/{pid}/stat') as f:
+                    fields = f.read().rsplit(')', 1)[1].split()
+                with open(f'/proc/{pid}/statm') as f:
+                    rss += int(f.read().split()[1]) * self.page_size
+            except OSError:
+                continue
+            # utime and stime, fields 14 and 15 of /proc/<pid>/stat.
+            cpu += (int(fields[11]) + int(fields[12])) / self.ticks
+        return cpu, rss
+
+    async def run(self):
+        self.started = time.monotonic()
+        self.start_cpu, self.peak_rss = self.read()
+        while True:
+            await asyncio.sleep(1)
+            self.sample()
+
+    def sample(self):
+        self.end_cpu, rss = self.read()
+        self.peak_rss = max(self.peak_rss, rss)
+        self.elapsed = time.monotonic() - self.started
+
+    def report(self):
+        if self.start_cpu is None or not os.path.exists('/proc'):
+            return None
+        self.sample()
+        return {
+            'pids': sorted(self.processes()),
+            'cpu_percent': round(100 * (self.end_cpu - self.start_cpu) / self.elapsed, 1) if self.elapsed else None,
+            'peak_rss_mb': round(self.peak_rss / 2 ** 20, 1),
+        }
+
+
+def summarize_ms(values):
+    if not values:
+        return {'samples': 0, 'p50': None, 'p95': None, 'p99': None, 'max': None}
+    values = sorted(values)
+    return {
+        'samples': len(values),
+        **{f'p{pct}': round(percentile(values, pct) * 1000, 2) for pct in (50, 95, 99)},
+        'max': round(values[-1] * 1000, 2),
+    }
+
+
+class SimulatedViewer:
+    """One client in a room, sending a random mix of messages at `rate` per second."""
+
+    def __init__(self, load_test, index, user, room_id):
+        self.load_test = load_test
+        self.index = index
+        self.user = user
+        self.room_id = room_id
+        self.client = None
+        self.sequence = 0
+        self.typing = False
+        self.pings = {}
+
+    def next_token(self):
+        self.sequence += 1
+        return f'{self.index}-{self.sequence}'
+
+    async def connect(self):
+        self.client = await self.load_test.open_client(self, self.on_message)
+
+    async def run(self, until):
+        rng = self.load_test.rng
+        kinds, weights = zip(*self.load_test.mix.items())
+        while True:
+            await asyncio.sleep(min(rng.expovariate(self.load_test.rate), max(0, until - time.monotonic())))
+            if time.monotonic() >= until:
+                return
+            kind = rng.choices(kinds, weights)[0]
+            try:
+                await self.client.send_json(self.message(kind, rng))
+            except ConnectionError:
+                self.load_test.errors['disconnected'] += 1
+                return
+            self.load_test.sent[kind] += 1
+
+    def message(self, kind, rng):
+        sent_at = time.perf_counter()
+        if kind == 'ping':
+            client_time = time.time() * 1000
+            self.pings[client_time] = sent_at
+            return {'type': 'ping', 'client_time': client_time}
+        if kind == 'typing':
+            self.typing = not self.typing
+            return {'type': 'typing_start' if self.typing else 'typing_stop'}
+
+        # Broadcasts carry a token, so every other member can time its copy.
+        token = self.next_token()
+        self.load_test.broadcasts[token] = sent_at
+        if kind == 'chat':
+            words = ' '.join(rng.choices(CHAT_WORDS, k=rng.randint(1, 6)))
+            return {'type': 'chat_message', 'message': f'{words} #{token}'}
+        if kind == 'webrtc_signal':
+            return {'type': 'webrtc_signal', 'data': {'type': 'ice-candidate', 'candidate': 'candidate:0 1 UDP', 'lt': token}}
+        # video_control echoes only the position, so the token is encoded
+        # in it.
+        return {
+            'type': 'video_control', 'action': rng.choice(('play', 'pause', 'sync')),
+            'timestamp': self.index * POSITION_STRIDE + self.sequence, 'client_time': time.time() * 1000,
+        }
+
+    def on_message(self, data):
+        received_at = time.perf_counter()
+        self.load_test.received += 1
+        kind = data.get('type')
+        if kind == 'pong':
+            sent_at = self.pings.pop(data.get('client_time'), None)
+            if sent_at is not None:
+                self.load_test.ping_rtts.append(received_at - sent_at)
+            return
+        if kind == 'error':
+            self.load_test.errors[data.get('message', 'error')] += 1
+            return
+        if data.get('user_id') == self.user.id:
+            return
+        token = None
+        if kind == 'chat_message':
+            token = data.get('message', '').rsplit('#', 1)[-1]
+        elif kind == 'webrtc_signal':
+            token = (data.get('data') or {}).get('lt')
+        elif kind == 'video_control' and isinstance(data.get('timestamp'), int):
+            token = '-'.join(map(str, divmod(data['timestamp'], POSITION_STRIDE)))
+
+        sent_at = self.load_test.broadcasts.get(token)
+        if sent_at is not None:
+            self.load_test.fanout.append(received_at - sent_at)
+
+
+class LoadTest:
+    """
+    Runs `clients` simulated viewers spread over `rooms` rooms for
+    `duration` seconds, either against a running server at `url` or in this
+    process through WebsocketCommunicator, and reports connect rate, fanout
+    latency, message rates and server CPU/memory.
+
+    Users and rooms are created with the loadtest_ prefix; a server at `url`
+    must use the same database and SECRET_KEY so their sessions are valid.
+    Call setup() first and teardown() once no server is serving the rooms.
+    """
+
+    def __init__(self, clients=100, rooms=10, duration=30, rate=1.0, mix=None, url=None,
+                 connect_concurrency=50, server_pids=(), seed=None):
+        self.clients = clients
+        self.rooms = rooms
+        self.duration = duration
+        self.rate = rate
+        self.mix = {kind: weight for kind, weight in (mix or DEFAULT_MIX).items() if weight > 0}
+        self.url = url.rstrip('/') if url else None
+        self.connect_concurrency = connect_concurrency
+        self.server_pids = server_pids or (() if url else (os.getpid(),))
+        self.seed = seed
+        self.rng = random.Random(seed)
+
+        self.sent = {kind: 0 for kind in MESSAGE_KINDS}
+        self.received = 0
+        self.errors = Counter()
+        self.broadcasts = {}
+        self.fanout = []
+        self.ping_rtts = []
+        self.connect_times = []
+        self.application = None
+        self.sessions = {}
+
+    # Data
+
+    def setup(self):
+        # Users and rooms from an earlier run are reused: a server may still
+        # hold state for them, so they are only deleted by teardown().
+        from .models import Room
+
+        User = get_user_model()
+        usernames = [f'{USERNAME_PREFIX}{i}' for i in range(self.clients)]
+        existing = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+        users = [User(username=username) for username in usernames if username not in existing]
+        for user in users:
+            # Hashing a real password per user would dominate setup time.
+            user.set_unusable_password()
+        User.objects.bulk_create(users)
+        by_name = {user.username: user for user in User.objects.filter(username__in=usernames)}
+        users = [by_name[username] for username in usernames]
+
+        per_room = -(-self.clients // self.rooms)
+        rooms = []
+        for i in range(-(-self.clients // per_room)):
+            room, _ = Room.objects.update_or_create(
+                name=f'{ROOM_NAME_PREFIX} {i}', creator__username__startswith=USERNAME_PREFIX,
+                defaults={'max_users': per_room, 'is_active': True},
+                create_defaults={'creator': users[i * per_room], 'max_users': per_room},
+            )
+            rooms.append(room)
+        if self.url:
+            self.sessions = {user.id: self.create_session(user) for user in users}
+        self.viewers = [
+            SimulatedViewer(self, i, user, rooms[i // per_room].id) for i, user in enumerate(users)
+        ]
+
+    def create_session(self, user):
+        # What login() stores, without a request.
+        engine = import_module(settings.SESSION_ENGINE)
+        session = engine.SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+        return session.session_key
+
+    def teardown(self):
+        # Rooms, participants and messages go with their users.
+        get_user_model().objects.filter(username__startswith=USERNAME_PREFIX).delete()
+
+    # Connections
+
+    async def open_client(self, viewer, on_message):
+        path = f'/ws/room/{viewer.room_id}/'
+        if self.url:
+            cookie = f'{settings.SESSION_COOKIE_NAME}={self.sessions[viewer.user.id]}'
+            return await asyncio.wait_for(
+                WebSocketClient.connect(f'{self.url}{path}', {'Cookie': cookie}, on_message), CONNECT_TIMEOUT,
+            )
+        if self.application is None:
+            from channels.routing import URLRouter
+            from .routing import websocket_urlpatterns
+
+            self.application = URLRouter(websocket_urlpatterns)
+        return await CommunicatorClient.connect(self.application, path, viewer.user, on_message)
+
+    async def connect_all(self):
+        limit = asyncio.Semaphore(self.connect_concurrency)
+
+        async def connect(viewer):
+            async with limit:
+                started = time.perf_counter()
+                try:
+                    await viewer.connect()
+                except (ConnectionError, OSError, asyncio.TimeoutError) as e:
+                    self.errors[f'connect: {e}'] += 1
+                    return
+                self.connect_times.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(connect(viewer) for viewer in self.viewers))
+        return time.perf_counter() - started
+
+    # Run
+
+    async def run(self):
+        sampler = ProcessSampler(self.server_pids) if self.server_pids and os.path.exists('/proc') else None
+        sampler_task = asyncio.ensure_future(sampler.run()) if sampler else None
+
+        connect_seconds = await self.connect_all()
+        connected = [viewer for viewer in self.viewers if viewer.client is not None]
+        until = time.monotonic() + self.duration
+        started = time.perf_counter()
+        await asyncio.gather(*(viewer.run(until) for viewer in connected))
+        seconds = time.perf_counter() - started
+        # Let the last broadcasts arrive before closing.
+        await asyncio.sleep(1)
+
+        server = sampler.report() if sampler else None
+        if sampler_task is not None:
+            sampler_task.cancel()
+        for viewer in connected:
+            await viewer.client.close()
+        if not self.url:
+            await self.stop_in_process()
+
+        return self.report(connected, connect_seconds, seconds, server)
+
+    async def stop_in_process(self):
+        from .actors import room_actors
+        from .telemetry import ingester as sync_events
+
+        await asyncio.sleep(0.5)
+        await room_actors.stop_all()
+        await database_sync_to_async(sync_events.flush)()
+
+    def report(self, connected, connect_seconds, seconds, server):
+        sent = sum(self.sent.values())
+        return {
+            'config': {
+                'mode': 'server' if self.url else 'in-process',
+                'url': self.url,
+                'clients': self.clients,
+                'rooms': self.rooms,
+                'duration': self.duration,
+                'rate': self.rate,
+                'mix': self.mix,
+                'seed': self.seed,
+                'channel_layer': settings.CHANNEL_LAYERS['default']['BACKEND'],
+            },
+            'connect': {
+                'connected': len(connected),
+                'failed': self.clients - len(connected),
+                'seconds': round(connect_seconds, 2),
+                'per_second': round(len(connected) / connect_seconds, 1) if connect_seconds else None,
+                'latency_ms': summarize_ms(self.connect_times),
+            },
+            'messages': {
+                'sent': dict(self.sent),
+                'sent_per_second': round(sent / seconds, 1),
+                'received': self.received,
+                'received_per_second': round(self.received / seconds, 1),
+                'errors': dict(self.errors),
+            },
+            'fanout_ms': summarize_ms(self.fanout),
+            'ping_rtt_ms': summarize_ms(self.ping_rtts),
+            'server': server,
+        }
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from rooms.archive import ARCHIVE_PART_SIZE, archive_room_messages
+from rooms.models import Room
+
+
+class Command(BaseCommand):
+    help = 'Move chat messages past their retention period into compressed per-day archive files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--room', action='append', dest='room_ids', help='Only archive these room ids')
+        parser.add_argument('--part-size', type=int, default=ARCHIVE_PART_SIZE)
+
+    def handle(self, *args, **options):
+        rooms = Room.objects.order_by('created_at')
+        if options['room_ids']:
+            rooms = rooms.filter(id__in=options['room_ids'])
+        elif getattr(settings, 'MESSAGE_RETENTION_DAYS', None) is None:
+            rooms = rooms.filter(message_retention_days__isnull=False)
+
+        total = 0
+        for room in rooms.iterator():
+            archived = archive_room_messages(room, part_size=options['part_size'])
+            if archived:
+                self.stdout.write(f"{room.name} ({room.id}): archived {archived} messages")
+            total += archived
+
+        self.stdout.write(self.style.SUCCESS(f"Done: {total} messages archived"))
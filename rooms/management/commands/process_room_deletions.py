@@ -0,0 +1,25 @@
+import time
+from django.core.management.base import BaseCommand
+from rooms.deletion import claimable_jobs, process_room_deletion
+
+
+class Command(BaseCommand):
+    help = 'Run pending, failed or stalled permanent room deletions in bounded chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=None)
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new jobs')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            job_ids = list(claimable_jobs().values_list('pk', flat=True))
+            for job_id in job_ids:
+                if process_room_deletion(job_id, options['chunk_size']):
+                    self.stdout.write(self.style.SUCCESS(f"Finished deletion job {job_id}"))
+                else:
+                    self.stdout.write(self.style.WARNING(f"Deletion job {job_id} skipped or failed"))
+
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
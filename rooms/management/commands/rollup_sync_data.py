@@ -0,0 +1,24 @@
+import time
+from django.core.management.base import BaseCommand
+from rooms.telemetry import rollup_sync_data, prune_sync_data
+
+
+class Command(BaseCommand):
+    help = 'Summarize raw video sync events into hourly per-room latency and drift percentiles, then prune old events'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--no-prune', action='store_true', help='Keep raw events after summarizing them')
+        parser.add_argument('--loop', action='store_true', help='Keep running every --interval seconds')
+        parser.add_argument('--interval', type=float, default=600.0, help='Seconds between runs with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            summaries = rollup_sync_data()
+            self.stdout.write(self.style.SUCCESS(f"Wrote {summaries} sync summaries"))
+            if not options['no_prune']:
+                pruned = prune_sync_data()
+                self.stdout.write(f"Pruned {pruned} raw sync events")
+
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
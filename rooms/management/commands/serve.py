@@ -0,0 +1,220 @@
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+ASGI_APPLICATION = 'syncstream_project.asgi:application'
+POLL_INTERVAL = 0.5
+# A worker that exits sooner than this after starting is restarted with a
+# growing delay instead of in a tight loop.
+MIN_UPTIME = 10
+MAX_RESTART_DELAY = 30
+
+
+class Worker:
+    def __init__(self, worker_id, port):
+        self.worker_id = worker_id
+        self.port = port
+        self.process = None
+        self.started_at = None
+        self.failures = 0
+        self.restart_at = 0
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+
+class Command(BaseCommand):
+    help = (
+        'Run the ASGI app as a supervised pool of daphne worker processes sharing one listening socket. '
+        'SIGHUP reloads the workers one at a time; SIGTERM or SIGINT shuts them all down.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int,
+                            help='Worker processes to run (default: WEB_CONCURRENCY, or the number of cores when '
+                                 'the channel layer is Redis and 1 otherwise)')
+        parser.add_argument('--bind', default='0.0.0.0', help='Interface of the shared listening socket')
+        parser.add_argument('--port', type=int, default=int(os.getenv('PORT', 8000)),
+                            help='Port of the shared listening socket (default: PORT or 8000)')
+        parser.add_argument('--worker-bind', default='127.0.0.1',
+                            help="Interface of each worker's own port, used for health checks and room routing")
+        parser.add_argument('--worker-port-base', type=int,
+                            help='Worker N also listens on this port + N (default: --port + 1)')
+        parser.add_argument('--public-url',
+                            help='WebSocket base URL of a worker\'s own port, e.g. "wss://example.com:{port}". '
+                                 'When set, ROOM_WORKERS is filled in so each room is served by one worker')
+        parser.add_argument('--graceful-timeout', type=float, default=30.0,
+                            help='Seconds a stopping worker gets before it is killed')
+        parser.add_argument('--health-timeout', type=float, default=30.0,
+                            help='Seconds a new worker gets to answer /healthz/ during a reload')
+        parser.add_argument('--backlog', type=int, default=2048)
+
+    def handle(self, *args, **options):
+        self.options = options
+        # An in-process channel layer is not shared between processes: with
+        # more than one worker, room messages would only reach the members
+        # connected to the sender's worker.
+        shared_layer = 'Redis' in settings.CHANNEL_LAYERS['default']['BACKEND']
+        if options['workers'] is None:
+            options['workers'] = int(os.getenv('WEB_CONCURRENCY', 0)) or (os.cpu_count() if shared_layer else 1)
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1')
+        if options['workers'] > 1 and not shared_layer:
+            raise CommandError(
+                f"{options['workers']} workers need a shared channel layer; set REDIS_URL or CHANNEL_REDIS_URL, "
+                f"or run one worker."
+            )
+        if options['workers'] > 1 and not options['public_url']:
+            self.stdout.write(
+                'Without --public-url rooms are not routed to one worker; members of a room on different '
+                'workers are kept in step through the channel layer.'
+            )
+
+        port_base = options['worker_port_base'] or options['port'] + 1
+        self.workers = [Worker(str(i), port_base + i) for i in range(options['workers'])]
+        self.room_workers = ''
+        if options['public_url']:
+            self.room_workers = ','.join(
+                f"{worker.worker_id}={options['public_url'].format(port=worker.port)}" for worker in self.workers
+            )
+
+        # One socket, opened here and inherited by every worker: the kernel
+        # hands each new connection to whichever worker accepts it first.
+        self.sock = socket.socket(socket.AF_INET6 if ':' in options['bind'] else socket.AF_INET)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((options['bind'], options['port']))
+        self.sock.listen(options['backlog'])
+        self.sock.set_inheritable(True)
+
+        self.stopping = False
+        self.reload_requested = False
+        signal.signal(signal.SIGTERM, self.request_stop)
+        signal.signal(signal.SIGINT, self.request_stop)
+        signal.signal(signal.SIGHUP, self.request_reload)
+
+        self.stdout.write(f"Serving on {options['bind']}:{options['port']} with {len(self.workers)} workers")
+        try:
+            for worker in self.workers:
+                self.start(worker)
+            self.supervise()
+        finally:
+            self.stop_all()
+            self.sock.close()
+
+    def request_stop(self, signum, frame):
+        self.stopping = True
+
+    def request_reload(self, signum, frame):
+        self.reload_requested = True
+
+    def worker_env(self, worker):
+        env = dict(os.environ, ROOM_WORKER_ID=worker.worker_id)
+        if self.room_workers:
+            env['ROOM_WORKERS'] = self.room_workers
+        return env
+
+    def start(self, worker):
+        fd = self.sock.fileno()
+        command = [
+            sys.executable, '-m', 'daphne',
+            '--fd', str(fd),
+            '-e', f"tcp:port={worker.port}:interface={self.options['worker_bind']}",
+            '--proxy-headers',
+            '--application-close-timeout', str(int(self.options['graceful_timeout'])),
+            ASGI_APPLICATION,
+        ]
+        worker.process = subprocess.Popen(command, env=self.worker_env(worker), pass_fds=(fd,), cwd=settings.BASE_DIR)
+        worker.started_at = time.monotonic()
+        self.stdout.write(f"Started worker {worker.worker_id} (pid {worker.process.pid}, port {worker.port})")
+
+    def stop(self, worker):
+        if not worker.alive():
+            return
+        worker.process.terminate()
+        try:
+            worker.process.wait(timeout=self.options['graceful_timeout'])
+        except subprocess.TimeoutExpired:
+            self.stderr.write(f"Worker {worker.worker_id} did not stop in time; killing it")
+            worker.process.kill()
+            worker.process.wait()
+
+    def stop_all(self):
+        # Signal every worker first so they drain in parallel.
+        for worker in self.workers:
+            if worker.alive():
+                worker.process.terminate()
+        deadline = time.monotonic() + self.options['graceful_timeout']
+        for worker in self.workers:
+            if worker.process is None:
+                continue
+            try:
+                worker.process.wait(timeout=max(0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                worker.process.kill()
+                worker.process.wait()
+        self.stdout.write('All workers stopped')
+
+    def health(self, worker):
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{worker.port}/healthz/', timeout=2) as response:
+                return json.load(response)
+        except (OSError, ValueError):
+            return None
+
+    def wait_healthy(self, worker):
+        deadline = time.monotonic() + self.options['health_timeout']
+        while time.monotonic() < deadline and not self.stopping:
+            if not worker.alive():
+                return False
+            if self.health(worker) is not None:
+                return True
+            time.sleep(POLL_INTERVAL)
+        return False
+
+    def reload(self):
+        # Rolling reload: one worker at a time is replaced, and the next is
+        # only touched once its replacement answers health checks, so the
+        # shared socket always has workers accepting on it.
+        self.stdout.write('Reloading workers')
+        for worker in self.workers:
+            if self.stopping:
+                return
+            self.stop(worker)
+            self.start(worker)
+            if not self.wait_healthy(worker):
+                self.stderr.write(self.style.ERROR(f"Worker {worker.worker_id} is not healthy after reload"))
+        self.stdout.write(self.style.SUCCESS('Reload finished'))
+
+    def supervise(self):
+        while not self.stopping:
+            if self.reload_requested:
+                self.reload_requested = False
+                self.reload()
+                continue
+
+            now = time.monotonic()
+            for worker in self.workers:
+                if worker.alive():
+                    continue
+                if worker.restart_at == 0:
+                    code = worker.process.returncode
+                    if now - worker.started_at < MIN_UPTIME:
+                        worker.failures += 1
+                    else:
+                        worker.failures = 0
+                    delay = min(MAX_RESTART_DELAY, 2 ** worker.failures - 1)
+                    self.stderr.write(self.style.ERROR(
+                        f"Worker {worker.worker_id} exited with code {code}; restarting in {delay}s"
+                    ))
+                    worker.restart_at = now + delay
+                if now >= worker.restart_at:
+                    worker.restart_at = 0
+                    self.start(worker)
+            time.sleep(POLL_INTERVAL)
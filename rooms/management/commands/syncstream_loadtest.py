@@ -0,0 +1,104 @@
+import asyncio
+import json
+from django.core.management.base import BaseCommand, CommandError
+from rooms.loadtest import DEFAULT_MIX, LoadTest
+
+
+def parse_mix(value):
+    mix = dict.fromkeys(DEFAULT_MIX, 0)
+    for part in value.split(','):
+        kind, _, weight = part.partition('=')
+        kind = kind.strip()
+        if kind not in mix:
+            raise CommandError(f"Unknown message kind '{kind}'; choose from {', '.join(DEFAULT_MIX)}")
+        try:
+            mix[kind] = float(weight)
+        except ValueError:
+            raise CommandError(f"Weight for '{kind}' must be a number")
+    if not any(mix.values()):
+        raise CommandError('The message mix needs at least one positive weight')
+    return mix
+
+
+class Command(BaseCommand):
+    help = (
+        'Simulate viewers sending a mix of chat, typing, video_control, ping and webrtc_signal messages, '
+        'against a running server (--url) or in this process, and report connect rate, fanout latency, '
+        'message rates and server CPU/memory'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=100, help='Simulated viewers')
+        parser.add_argument('--rooms', type=int, default=10, help='Rooms the viewers are spread over')
+        parser.add_argument('--duration', type=float, default=30.0, help='Seconds of traffic after connecting')
+        parser.add_argument('--rate', type=float, default=1.0, help='Messages per second per viewer')
+        parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                            help='Relative weights, e.g. "chat=20,typing=25,video_control=5,ping=35,webrtc_signal=15"')
+        parser.add_argument('--url',
+                            help='WebSocket base URL of a running server, e.g. ws://127.0.0.1:8000. '
+                                 'It must share this database and SECRET_KEY. Without it the test runs in-process')
+        parser.add_argument('--server-pid', type=int, action='append', default=[],
+                            help='Process to sample CPU and memory of, with its children (repeatable). '
+                                 'Defaults to this process in-process')
+        parser.add_argument('--connect-concurrency', type=int, default=50, help='Connections opened at once')
+        parser.add_argument('--seed', type=int, help='Seed for the message mix, to repeat a run')
+        parser.add_argument('--json', dest='json_path', help='Write the report here, to diff between versions')
+        parser.add_argument('--keep-data', action='store_true',
+                            help='Keep the loadtest_ users and rooms after an in-process run. With --url they are '
+                                 'always kept, since the server may still hold state for them, and reused next run')
+
+    def handle(self, *args, **options):
+        if options['clients'] < 1 or options['rooms'] < 1:
+            raise CommandError('--clients and --rooms must be at least 1')
+        if options['rate'] <= 0:
+            raise CommandError('--rate must be positive')
+
+        load_test = LoadTest(
+            clients=options['clients'],
+            rooms=options['rooms'],
+            duration=options['duration'],
+            rate=options['rate'],
+            mix=options['mix'],
+            url=options['url'],
+            connect_concurrency=options['connect_concurrency'],
+            server_pids=options['server_pid'],
+            seed=options['seed'],
+        )
+        load_test.setup()
+        try:
+            report = asyncio.run(load_test.run())
+        finally:
+            if not options['url'] and not options['keep_data']:
+                load_test.teardown()
+
+        self.write_report(report)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Wrote {options['json_path']}")
+
+    def write_report(self, report):
+        config, connect, messages = report['config'], report['connect'], report['messages']
+        self.stdout.write(
+            f"{config['clients']} clients in {config['rooms']} rooms, {config['mode']}, "
+            f"{config['duration']}s at {config['rate']} msg/s each"
+        )
+        self.stdout.write(
+            f"connect   {connect['connected']} ok, {connect['failed']} failed, {connect['per_second']}/s, "
+            f"p50 {connect['latency_ms']['p50']} ms, p99 {connect['latency_ms']['p99']} ms"
+        )
+        self.stdout.write(
+            f"messages  {messages['sent_per_second']} sent/s, {messages['received_per_second']} received/s"
+        )
+        for name in ('fanout_ms', 'ping_rtt_ms'):
+            stats = report[name]
+            self.stdout.write(
+                f"{name.rsplit('_', 1)[0]:<10}p50 {stats['p50']} ms, p95 {stats['p95']} ms, "
+                f"p99 {stats['p99']} ms, max {stats['max']} ms ({stats['samples']} samples)"
+            )
+        if report['server']:
+            self.stdout.write(
+                f"server    {report['server']['cpu_percent']}% CPU, {report['server']['peak_rss_mb']} MB peak RSS"
+            )
+        if messages['errors']:
+            self.stdout.write(self.style.WARNING(f"errors    {messages['errors']}"))
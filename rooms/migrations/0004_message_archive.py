@@ -0,0 +1,40 @@
+# Generated by Django 5.2.5 on 2026-10-19 08:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rooms', '0003_roomdeletionjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='message_retention_days',
+            field=models.PositiveIntegerField(blank=True, help_text='Move chat messages older than this many days to the archive. Leave blank to use the site default.', null=True),
+        ),
+        migrations.CreateModel(
+            name='MessageArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('part', models.PositiveIntegerField(default=0)),
+                ('path', models.CharField(max_length=255)),
+                ('codec', models.CharField(max_length=10)),
+                ('message_count', models.PositiveIntegerField()),
+                ('user_counts', models.JSONField(blank=True, default=dict)),
+                ('size_bytes', models.PositiveIntegerField()),
+                ('first_created_at', models.DateTimeField()),
+                ('last_created_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='message_archives', to='rooms.room')),
+            ],
+            options={
+                'ordering': ['-day', '-part'],
+                'unique_together': {('room', 'day', 'part')},
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-19 08:08
+
+import rooms.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rooms', '0004_message_archive'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='message',
+            name='id',
+            field=models.UUIDField(default=rooms.models.uuid7, editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', 'created_at'], name='message_room_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='participant',
+            index=models.Index(condition=models.Q(('is_online', True)), fields=['room'], name='participant_room_online_idx'),
+        ),
+    ]
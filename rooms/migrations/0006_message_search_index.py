@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    from rooms.search import create_search_index
+    create_search_index(schema_editor)
+
+
+def drop_search_index(apps, schema_editor):
+    from rooms.search import drop_search_index
+    drop_search_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rooms', '0005_message_participant_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.5 on 2026-10-19 08:36
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rooms', '0006_message_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videosyncdata',
+            name='drift_ms',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='videosyncdata',
+            name='latency_ms',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='videosyncdata',
+            name='position',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='videosyncdata',
+            name='created_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+        migrations.CreateModel(
+            name='RoomSyncSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period_start', models.DateTimeField()),
+                ('samples', models.PositiveIntegerField(default=0)),
+                ('latency_p50', models.FloatField(blank=True, null=True)),
+                ('latency_p95', models.FloatField(blank=True, null=True)),
+                ('latency_p99', models.FloatField(blank=True, null=True)),
+                ('drift_p50', models.FloatField(blank=True, null=True)),
+                ('drift_p95', models.FloatField(blank=True, null=True)),
+                ('drift_p99', models.FloatField(blank=True, null=True)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sync_summaries', to='rooms.room')),
+            ],
+            options={
+                'verbose_name_plural': 'room sync summaries',
+                'ordering': ['-period_start'],
+                'unique_together': {('room', 'period_start')},
+            },
+        ),
+    ]
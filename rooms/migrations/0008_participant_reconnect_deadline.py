@@ -0,0 +1,24 @@
+# Generated by Django 5.2.5 on 2026-10-19 09:46
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rooms', '0007_sync_telemetry'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='participant',
+            name='reconnect_deadline',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='participant',
+            index=models.Index(condition=models.Q(('reconnect_deadline__isnull', False)), fields=['reconnect_deadline'], name='participant_reconnect_idx'),
+        ),
+    ]
@@ -1,11 +1,29 @@
 from django.db import models
+from django.db.models import Q
 from django.conf import settings
+import os
+import time
 import uuid
 import secrets
 import string
 from django.utils import timezone
 from django.contrib.auth.hashers import make_password, check_password
 
+VIDEO_STATE_FIELDS = ['current_video_url', 'video_state', 'video_timestamp', 'last_video_update']
+# Actions that set video_state. A sync or seek only moves the position, so
+# the room keeps playing (or stays paused) afterwards.
+VIDEO_STATE_ACTIONS = ('play', 'pause', 'load')
+
+
+def uuid7():
+    # RFC 9562 UUIDv7: a 48-bit millisecond timestamp followed by random bits,
+    # so new keys land at the right-hand edge of the primary key index.
+    value = (time.time_ns() // 1_000_000) << 80 | int.from_bytes(os.urandom(10), 'big')
+    value = value & ~(0xF << 76) | (0x7 << 76)
+    value = value & ~(0x3 << 62) | (0x2 << 62)
+    return uuid.UUID(int=value)
+
+
 class Room(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     name = models.CharField(max_length=100)
@@ -25,6 +43,10 @@ class Room(models.Model):
     last_video_update = models.DateTimeField(blank=True, null=True)
     deleted_at = models.DateTimeField(blank=True, null=True)
     banned_words = models.JSONField(default=list, blank=True)
+    message_retention_days = models.PositiveIntegerField(
+        blank=True, null=True,
+        help_text='Move chat messages older than this many days to the archive. Leave blank to use the site default.'
+    )
     
     def __str__(self):
         return self.name
@@ -94,18 +116,9 @@ class Room(models.Model):
         
         return True, "Can join"
     
-    def hard_delete(self):
-        try:
-            self.participants.all().delete()
-            self.messages.all().delete()
-            self.screen_sessions.all().delete()
-            
-            super().delete()
-            return True
-        except Exception as e:
-            print(f"Error hard deleting room {self.id}: {e}")
-            return False
-
+    def hard_delete(self, requested_by=None):
+        from .deletion import enqueue_room_deletion
+        return enqueue_room_deletion(self, requested_by)
     
     def can_be_deleted_by(self, user):
         return self.creator == user or user.is_staff
@@ -125,15 +138,27 @@ class Room(models.Model):
         if url and url != self.current_video_url:
             self.current_video_url = url
         
-        valid_actions = ['play', 'pause', 'load', 'sync']
-        if action in valid_actions:
+        if action in VIDEO_STATE_ACTIONS:
             self.video_state = action
         
         if timestamp >= 0:
             self.video_timestamp = timestamp
         
         self.last_video_update = timezone.now()
-        self.save()
+        self.save(update_fields=VIDEO_STATE_FIELDS)
+    
+    async def aupdate_video_state(self, action, timestamp, url=None):
+        if url and url != self.current_video_url:
+            self.current_video_url = url
+        
+        if action in VIDEO_STATE_ACTIONS:
+            self.video_state = action
+        
+        if timestamp >= 0:
+            self.video_timestamp = timestamp
+        
+        self.last_video_update = timezone.now()
+        await self.asave(update_fields=VIDEO_STATE_FIELDS)
     
     def get_participants_info(self):
         return [
@@ -150,12 +175,12 @@ class Room(models.Model):
     def add_banned_word(self, word):
         if word.lower() not in self.banned_words:
             self.banned_words.append(word.lower())
-            self.save()
+            self.save(update_fields=['banned_words'])
     
     def remove_banned_word(self, word):
         if word.lower() in self.banned_words:
             self.banned_words.remove(word.lower())
-            self.save()
+            self.save(update_fields=['banned_words'])
     
     def contains_banned_words(self, message):
         if not self.banned_words:
@@ -179,32 +204,55 @@ class Participant(models.Model):
     is_banned = models.BooleanField(default=False)
     banned_at = models.DateTimeField(null=True, blank=True)
     banned_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='banned_users')
+    # Set when a drained or moved client is told to reconnect elsewhere; the
+    # participant goes offline if it hasn't reconnected by then.
+    reconnect_deadline = models.DateTimeField(null=True, blank=True)
     
     class Meta:
         unique_together = ('room', 'user')
+        indexes = [
+            models.Index(fields=['room'], condition=Q(is_online=True), name='participant_room_online_idx'),
+            models.Index(
+                fields=['reconnect_deadline'],
+                condition=Q(reconnect_deadline__isnull=False),
+                name='participant_reconnect_idx',
+            ),
+        ]
     
     def __str__(self):
         return f"{self.user.username} in {self.room.name}"
     
     def set_online(self):
         self.is_online = True
-        self.save()
+        self.save(update_fields=['is_online'])
     
     def set_offline(self):
         self.is_online = False
-        self.save()
+        self.save(update_fields=['is_online'])
 
     def mute(self, duration_minutes, muted_by):
         self.is_muted = True
         self.muted_until = timezone.now() + timezone.timedelta(minutes=duration_minutes)
         self.muted_by = muted_by
-        self.save()
+        self.save(update_fields=['is_muted', 'muted_until', 'muted_by'])
+    
+    async def amute(self, duration_minutes, muted_by):
+        self.is_muted = True
+        self.muted_until = timezone.now() + timezone.timedelta(minutes=duration_minutes)
+        self.muted_by = muted_by
+        await self.asave(update_fields=['is_muted', 'muted_until', 'muted_by'])
     
     def unmute(self):
         self.is_muted = False
         self.muted_until = None
         self.muted_by = None
-        self.save()
+        self.save(update_fields=['is_muted', 'muted_until', 'muted_by'])
+    
+    async def aunmute(self):
+        self.is_muted = False
+        self.muted_until = None
+        self.muted_by = None
+        await self.asave(update_fields=['is_muted', 'muted_until', 'muted_by'])
     
     def is_currently_muted(self):
         from django.utils import timezone
@@ -216,17 +264,39 @@ class Participant(models.Model):
         return True
 
     def ban(self, banned_by):
+        # rooms_joined follows saves of is_banned, so a repeat ban must not save.
+        if self.is_banned:
+            return
         self.is_online = False
         self.is_banned = True
         self.banned_at = timezone.now()
         self.banned_by = banned_by
-        self.save()
+        self.save(update_fields=['is_online', 'is_banned', 'banned_at', 'banned_by'])
+    
+    async def aban(self, banned_by):
+        if self.is_banned:
+            return
+        self.is_online = False
+        self.is_banned = True
+        self.banned_at = timezone.now()
+        self.banned_by = banned_by
+        await self.asave(update_fields=['is_online', 'is_banned', 'banned_at', 'banned_by'])
     
     def unban(self):
+        if not self.is_banned:
+            return
         self.is_banned = False
         self.banned_at = None
         self.banned_by = None
-        self.save()
+        self.save(update_fields=['is_banned', 'banned_at', 'banned_by'])
+    
+    async def aunban(self):
+        if not self.is_banned:
+            return
+        self.is_banned = False
+        self.banned_at = None
+        self.banned_by = None
+        await self.asave(update_fields=['is_banned', 'banned_at', 'banned_by'])
 
 class Message(models.Model):
     MESSAGE_TYPES = (
@@ -235,7 +305,7 @@ class Message(models.Model):
         ('event', 'Room Event'),
     )
     
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False)
     room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='messages')
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     message = models.TextField()
@@ -244,6 +314,9 @@ class Message(models.Model):
     
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['room', 'created_at'], name='message_room_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username}: {self.message[:20]}..."
@@ -258,6 +331,27 @@ class Message(models.Model):
             'created_at': self.created_at.isoformat(),
         }
 
+
+class MessageArchive(models.Model):
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='message_archives')
+    day = models.DateField()
+    part = models.PositiveIntegerField(default=0)
+    path = models.CharField(max_length=255)
+    codec = models.CharField(max_length=10)
+    message_count = models.PositiveIntegerField()
+    user_counts = models.JSONField(default=dict, blank=True)
+    size_bytes = models.PositiveIntegerField()
+    first_created_at = models.DateTimeField()
+    last_created_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        unique_together = ('room', 'day', 'part')
+        ordering = ['-day', '-part']
+    
+    def __str__(self):
+        return f"{self.room_id} {self.day} part {self.part} ({self.message_count} messages)"
+
 class ScreenSession(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='screen_sessions')
@@ -275,15 +369,66 @@ class ScreenSession(models.Model):
         self.save()
 
 class VideoSyncData(models.Model):
+    # One row per sync event, written in batches by rooms.telemetry and
+    # rolled up into RoomSyncSummary. Timestamps are epoch seconds.
     room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='sync_data')
     action = models.CharField(max_length=20)
     client_timestamp = models.FloatField()
     server_timestamp = models.FloatField()
+    position = models.FloatField(blank=True, null=True)
+    latency_ms = models.FloatField(blank=True, null=True)
+    drift_ms = models.FloatField(blank=True, null=True)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Set when the event is recorded, not when its batch is written.
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
     
     class Meta:
         ordering = ['-created_at']
     
     def __str__(self):
-        return f"{self.user.username} {self.action} at {self.client_timestamp}"
\ No newline at end of file
+        return f"{self.user.username} {self.action} at {self.client_timestamp}"
+
+class RoomSyncSummary(models.Model):
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='sync_summaries')
+    period_start = models.DateTimeField()
+    samples = models.PositiveIntegerField(default=0)
+    latency_p50 = models.FloatField(blank=True, null=True)
+    latency_p95 = models.FloatField(blank=True, null=True)
+    latency_p99 = models.FloatField(blank=True, null=True)
+    drift_p50 = models.FloatField(blank=True, null=True)
+    drift_p95 = models.FloatField(blank=True, null=True)
+    drift_p99 = models.FloatField(blank=True, null=True)
+    
+    class Meta:
+        unique_together = ('room', 'period_start')
+        ordering = ['-period_start']
+        verbose_name_plural = 'room sync summaries'
+    
+    def __str__(self):
+        return f"{self.room_id} {self.period_start:%Y-%m-%d %H:00} ({self.samples} samples)"
+
+class RoomDeletionJob(models.Model):
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+    
+    room_id = models.UUIDField(db_index=True)
+    room_name = models.CharField(max_length=100)
+    requested_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='room_deletion_jobs')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    stage = models.CharField(max_length=30, blank=True)
+    deleted_counts = models.JSONField(default=dict, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        ordering = ['created_at']
+    
+    def __str__(self):
+        return f"Delete {self.room_name} ({self.status})"
@@ -0,0 +1,75 @@
+import logging
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils import timezone
+from .caching import bump_room_state_version, bump_directory_version
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RECONNECT_GRACE = 60
+DEFAULT_SWEEP_INTERVAL = 30
+SWEEP_LOCK_KEY = 'room_presence_sweep'
+
+
+def get_sweep_interval():
+    return getattr(settings, 'ROOM_PRESENCE_SWEEP_INTERVAL', DEFAULT_SWEEP_INTERVAL)
+
+
+def expect_reconnect(room_id, user_id):
+    # The client was told to reconnect to another worker, which clears the
+    # deadline when it arrives; until then the participant stays online.
+    from .models import Participant
+
+    grace = getattr(settings, 'ROOM_RECONNECT_GRACE', DEFAULT_RECONNECT_GRACE)
+    return Participant.objects.filter(room_id=room_id, user_id=user_id, is_online=True).update(
+        reconnect_deadline=timezone.now() + timezone.timedelta(seconds=grace)
+    )
+
+
+def expire_reconnects(now=None, connected=()):
+    """
+    Takes offline every participant whose reconnect deadline has passed, and
+    the users among them who aren't online in any other room. Participants
+    still in `connected`, as (room_id, user_id) pairs, only lose the deadline.
+    Returns (room_id, user_id, username) for each taken offline, so their
+    rooms can be told.
+    """
+    from .models import Participant
+
+    now = now or timezone.now()
+    connected = {(str(room_id), user_id) for room_id, user_id in connected}
+    expired = []
+    live = []
+    for row in Participant.objects.filter(is_online=True, reconnect_deadline__lt=now).values_list(
+        'pk', 'room_id', 'user_id', 'user__username'
+    ):
+        (live if (str(row[1]), row[2]) in connected else expired).append(row)
+    if live:
+        Participant.objects.filter(pk__in=[pk for pk, *_ in live]).update(reconnect_deadline=None)
+    if not expired:
+        return []
+
+    # A participant that reconnected since the read has no deadline left.
+    Participant.objects.filter(pk__in=[pk for pk, *_ in expired], reconnect_deadline__lt=now).update(
+        is_online=False, reconnect_deadline=None
+    )
+    user_ids = {user_id for _, _, user_id, _ in expired}
+    still_online = Participant.objects.filter(user_id__in=user_ids, is_online=True).values_list('user_id', flat=True)
+    get_user_model().objects.filter(id__in=user_ids - set(still_online)).update(is_online=False)
+
+    # update() skips the model signals, so invalidate the cached views here.
+    room_ids = {room_id for _, room_id, _, _ in expired}
+    for room_id in room_ids:
+        bump_room_state_version(room_id)
+    bump_directory_version()
+    logger.info(f"Took {len(expired)} participants that never reconnected offline in {len(room_ids)} rooms")
+    return [(room_id, user_id, username) for _, room_id, user_id, username in expired]
+
+
+def sweep_presence(connected=()):
+    # Every live room actor asks for a sweep; one per interval runs, across
+    # all workers sharing the cache.
+    if not cache.add(SWEEP_LOCK_KEY, True, timeout=get_sweep_interval()):
+        return []
+    return expire_reconnects(connected=connected)
@@ -0,0 +1,214 @@
+import logging
+import re
+from django.db import connections, router
+from django.db.models import Q
+from django.utils.html import escape
+
+logger = logging.getLogger(__name__)
+
+SEARCH_CONFIG = 'english'
+FTS_TABLE = 'rooms_message_fts'
+
+# Highlight markers are control characters that can't appear in a chat
+# message, so the text can be HTML-escaped before they become <mark> tags.
+MARK_START = '\x02'
+MARK_END = '\x03'
+
+_sqlite_fts5_available = {}
+
+
+# Index setup, run by migrations. On SQLite the FTS5 table follows
+# rooms_message's rowids; a migration that rebuilds rooms_message (or a
+# VACUUM) must call rebuild_search_index() afterwards.
+
+POSTGRES_INDEX_SQL = [
+    f"CREATE INDEX IF NOT EXISTS message_search_idx ON rooms_message USING gin (to_tsvector('{SEARCH_CONFIG}', message))",
+]
+POSTGRES_DROP_SQL = [
+    "DROP INDEX IF EXISTS message_search_idx",
+]
+
+SQLITE_INDEX_SQL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    f"message, content='rooms_message', content_rowid='rowid', tokenize='porter unicode61')",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON rooms_message BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, message) VALUES (new.rowid, new.message); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON rooms_message BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, message) VALUES ('delete', old.rowid, old.message); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update AFTER UPDATE OF message ON rooms_message BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, message) VALUES ('delete', old.rowid, old.message); "
+    f"INSERT INTO {FTS_TABLE}(rowid, message) VALUES (new.rowid, new.message); END",
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+SQLITE_DROP_SQL = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_insert",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_delete",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_update",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+
+def sqlite_fts5_available(connection):
+    if connection.alias not in _sqlite_fts5_available:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+            _sqlite_fts5_available[connection.alias] = bool(cursor.fetchone()[0])
+    return _sqlite_fts5_available[connection.alias]
+
+
+def create_search_index(schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        statements = POSTGRES_INDEX_SQL
+    elif connection.vendor == 'sqlite' and sqlite_fts5_available(connection):
+        statements = SQLITE_INDEX_SQL
+    else:
+        logger.warning(f"No full-text index for {connection.vendor}; message search will scan")
+        return
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(schema_editor):
+    connection = schema_editor.connection
+    statements = {'postgresql': POSTGRES_DROP_SQL, 'sqlite': SQLITE_DROP_SQL}.get(connection.vendor, [])
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def rebuild_search_index(using='default'):
+    connection = connections[using]
+    if connection.vendor == 'sqlite' and sqlite_fts5_available(connection):
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+# Queries
+
+def sqlite_match_expression(query):
+    # Every word must match, the last one as a prefix, so results narrow as
+    # the user types. Quoting each term keeps FTS5 operators out of user input.
+    terms = re.findall(r'\w+', query)
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def _before_clause(before, before_id):
+    # Pages are keyed by (created_at, id) like room history, so messages
+    # sharing the timestamp at the end of a page are not skipped.
+    if not before:
+        return '', []
+    if before_id is None:
+        return 'AND m.created_at < %s', [before]
+    return 'AND (m.created_at < %s OR (m.created_at = %s AND m.id < %s))', [before, before, before_id]
+
+
+def _search_postgresql(connection, room_pk, query, before, before_id, limit):
+    # The config is inlined so the WHERE clause matches message_search_idx.
+    # Headlines are built in the outer query so only the returned page pays
+    # for them.
+    older, older_params = _before_clause(before, before_id)
+    sql = f"""
+        SELECT page.id, ts_headline('{SEARCH_CONFIG}', page.message, page.query, %s)
+        FROM (
+            SELECT m.id, m.message, m.created_at, q.query
+            FROM rooms_message m, websearch_to_tsquery('{SEARCH_CONFIG}', %s) AS q(query)
+            WHERE m.room_id = %s
+              AND to_tsvector('{SEARCH_CONFIG}', m.message) @@ q.query
+              {older}
+            ORDER BY m.created_at DESC, m.id DESC
+            LIMIT %s
+        ) page
+        ORDER BY page.created_at DESC, page.id DESC
+    """
+    params = [f'HighlightAll=true, StartSel={MARK_START}, StopSel={MARK_END}', query, room_pk]
+    params += older_params
+    params += [limit]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def _search_sqlite(connection, room_pk, query, before, before_id, limit):
+    match = sqlite_match_expression(query)
+    if match is None:
+        return []
+    # Ordered like the other backends rather than by FTS rowid: seeded or
+    # imported messages aren't inserted in created_at order.
+    older, older_params = _before_clause(before, before_id)
+    sql = f"""
+        SELECT m.id, highlight({FTS_TABLE}, 0, %s, %s)
+        FROM {FTS_TABLE}
+        JOIN rooms_message m ON m.rowid = {FTS_TABLE}.rowid
+        WHERE {FTS_TABLE} MATCH %s
+          AND m.room_id = %s
+          {older}
+        ORDER BY m.created_at DESC, m.id DESC
+        LIMIT %s
+    """
+    params = [MARK_START, MARK_END, match, room_pk]
+    params += older_params
+    params += [limit]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def _search_fallback(room, query, before, before_id, limit):
+    from .models import Message
+
+    messages = Message.objects.filter(room=room, message__icontains=query).order_by('-created_at', '-id')
+    if before:
+        older = Q(created_at__lt=before)
+        if before_id is not None:
+            older |= Q(created_at=before, id__lt=before_id)
+        messages = messages.filter(older)
+    pattern = re.compile(re.escape(query), re.IGNORECASE)
+    return [
+        (pk, pattern.sub(lambda match: f'{MARK_START}{match.group(0)}{MARK_END}', message))
+        for pk, message in messages.values_list('pk', 'message')[:limit]
+    ]
+
+
+def render_highlight(text):
+    return escape(text).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+
+
+def search_messages(room, query, before=None, before_id=None, limit=20):
+    """
+    Newest-first full-text search over a room's messages, paged by the
+    (created_at, id) of the last result. Each result is Message.to_dict()
+    plus 'highlight': the HTML-escaped message with matching words wrapped
+    in <mark>.
+    """
+    from .models import Room, Message
+
+    query = query.strip()
+    if not query:
+        return []
+
+    using = router.db_for_read(Message)
+    connection = connections[using]
+    room_pk = Room._meta.pk.get_db_prep_value(room.pk, connection)
+    if before:
+        before = Message._meta.get_field('created_at').get_db_prep_value(before, connection)
+    if before_id is not None:
+        before_id = Message._meta.pk.get_db_prep_value(before_id, connection)
+
+    if connection.vendor == 'postgresql':
+        rows = _search_postgresql(connection, room_pk, query, before, before_id, limit)
+    elif connection.vendor == 'sqlite' and sqlite_fts5_available(connection):
+        rows = _search_sqlite(connection, room_pk, query, before, before_id, limit)
+    else:
+        rows = _search_fallback(room, query, before, before_id, limit)
+
+    messages = Message.objects.using(using).select_related('user').in_bulk([pk for pk, _ in rows])
+    results = []
+    for pk, highlighted in rows:
+        message = messages.get(Message._meta.pk.to_python(pk))
+        if message is not None:
+            results.append({**message.to_dict(), 'highlight': render_highlight(highlighted)})
+    return results
@@ -0,0 +1,118 @@
+from collections import Counter
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+from users.models import UserStats
+from .models import Room, Participant, Message, MessageArchive, VIDEO_STATE_FIELDS
+from .caching import bump_room_state_version, bump_room_settings_version, bump_directory_version
+
+# Room fields that never show up in the room directory; saves limited to
+# these must not invalidate the cached listings.
+NON_DIRECTORY_ROOM_FIELDS = frozenset(VIDEO_STATE_FIELDS + ['banned_words'])
+
+
+def is_direct_delete(instance, origin):
+    # Rows removed by a room's cascade are accounted for in bulk by
+    # room_pre_delete, so per-row receivers only handle direct deletes.
+    return origin is instance or getattr(origin, 'model', None) is type(instance)
+
+
+@receiver(post_save, sender=Room)
+@receiver(post_delete, sender=Room)
+def room_changed(sender, instance, update_fields=None, **kwargs):
+    bump_room_state_version(instance.id)
+    if not update_fields or not update_fields <= frozenset(VIDEO_STATE_FIELDS):
+        bump_room_settings_version(instance.id)
+    if not update_fields or not update_fields <= NON_DIRECTORY_ROOM_FIELDS:
+        bump_directory_version()
+
+
+@receiver(post_save, sender=Participant)
+@receiver(post_delete, sender=Participant)
+def participant_changed(sender, instance, created=False, update_fields=None, **kwargs):
+    bump_room_state_version(instance.room_id)
+    if created or not update_fields or 'is_online' in update_fields:
+        bump_directory_version()
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_delete, sender=Message)
+def message_changed(sender, instance, **kwargs):
+    bump_room_state_version(instance.room_id)
+
+
+def joined_participants(room):
+    # The memberships a room adds to rooms_joined; inactive rooms add none.
+    return room.participants.filter(is_banned=False).exclude(user_id=room.creator_id)
+
+
+def counts_as_joined(participant):
+    room = participant.room
+    return room.is_active and not participant.is_banned and room.creator_id != participant.user_id
+
+
+@receiver(post_save, sender=Room)
+def room_saved_stats(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        if instance.is_active:
+            UserStats.adjust(instance.creator_id, rooms_created=1)
+    elif update_fields and 'is_active' in update_fields:
+        # Soft-deleting (or restoring) a room takes it off the profile
+        # lists of its creator and members.
+        delta = 1 if instance.is_active else -1
+        UserStats.adjust(instance.creator_id, rooms_created=delta)
+        joined_user_ids = joined_participants(instance).values_list('user_id', flat=True)
+        UserStats.objects.filter(user_id__in=list(joined_user_ids)).update(rooms_joined=F('rooms_joined') + delta)
+
+
+@receiver(pre_delete, sender=Room)
+def room_pre_delete_stats(sender, instance, **kwargs):
+    if instance.is_active:
+        UserStats.adjust(instance.creator_id, rooms_created=-1)
+        joined_user_ids = joined_participants(instance).values_list('user_id', flat=True)
+        UserStats.objects.filter(user_id__in=list(joined_user_ids)).update(rooms_joined=F('rooms_joined') - 1)
+    
+    message_counts = instance.messages.values_list('user_id').annotate(total=Count('pk')).order_by()
+    UserStats.adjust_many({user_id: -total for user_id, total in message_counts}, 'total_messages')
+    
+    archived_counts = Counter()
+    for user_counts in instance.message_archives.values_list('user_counts', flat=True):
+        archived_counts.update({int(user_id): -total for user_id, total in user_counts.items()})
+    UserStats.adjust_many(archived_counts, 'total_messages', 'archived_messages')
+
+
+@receiver(post_save, sender=Participant)
+def participant_saved_stats(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        if counts_as_joined(instance):
+            UserStats.adjust(instance.user_id, rooms_joined=1)
+    elif update_fields and 'is_banned' in update_fields:
+        # ban() and unban() only save when the flag actually changes.
+        room = instance.room
+        if room.is_active and room.creator_id != instance.user_id:
+            UserStats.adjust(instance.user_id, rooms_joined=-1 if instance.is_banned else 1)
+
+
+@receiver(post_delete, sender=Participant)
+def participant_deleted_stats(sender, instance, origin=None, **kwargs):
+    if is_direct_delete(instance, origin) and counts_as_joined(instance):
+        UserStats.adjust(instance.user_id, rooms_joined=-1)
+
+
+@receiver(post_save, sender=Message)
+def message_created_stats(sender, instance, created, **kwargs):
+    if created:
+        UserStats.adjust(instance.user_id, total_messages=1)
+
+
+@receiver(post_delete, sender=Message)
+def message_deleted_stats(sender, instance, origin=None, **kwargs):
+    if is_direct_delete(instance, origin):
+        UserStats.adjust(instance.user_id, total_messages=-1)
+
+
+@receiver(post_delete, sender=MessageArchive)
+def message_archive_deleted(sender, instance, **kwargs):
+    from .archive import delete_archive_files
+    transaction.on_commit(lambda: delete_archive_files([instance.path]))
@@ -0,0 +1,322 @@
+import random
+import uuid
+from bisect import bisect
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+from itertools import accumulate
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection, models, transaction
+from django.utils import timezone
+from .caching import bump_directory_version
+from .models import Room, Participant, Message, VideoSyncData
+
+DEFAULT_PREFIX = 'synthetic_'
+DEFAULT_BATCH_SIZE = 5000
+# Exponent of the Zipf distribution of room popularity: the room of rank r
+# gets a share proportional to 1 / r ** skew.
+DEFAULT_SKEW = 1.1
+# Chat within a room is skewed the same way: a few members write most of it.
+AUTHOR_SKEW = 1.0
+
+WORDS = (
+    'the', 'this', 'that', 'scene', 'part', 'again', 'wait', 'lol', 'haha', 'no', 'way', 'rewind', 'pause', 'play',
+    'skip', 'intro', 'ending', 'sound', 'is', 'off', 'lagging', 'for', 'me', 'you', 'who', 'what', 'why', 'best',
+    'worst', 'episode', 'season', 'movie', 'trailer', 'music', 'song', 'love', 'hate', 'same', 'omg', 'ok', 'back',
+    'brb', 'snacks', 'everyone', 'ready', 'start', 'now', 'later', 'tomorrow', 'night', 'watch', 'next', 'one',
+)
+ROOM_TOPICS = (
+    'Movie night', 'Anime club', 'Study stream', 'Music videos', 'Speedruns', 'Documentaries', 'Cooking',
+    'Esports finals', 'Late show', 'Retro games', 'Watch party', 'Book club', 'Lo-fi', 'Film school', 'Trivia',
+)
+SYNC_ACTIONS = ('play', 'pause', 'seek', 'sync', 'drift_report')
+SYNC_ACTION_WEIGHTS = (15, 15, 10, 20, 40)
+
+
+def zipf_weights(count, skew):
+    return [1 / rank ** skew for rank in range(1, count + 1)]
+
+
+def apportion(total, weights, cap=None):
+    """
+    Splits `total` into integer shares proportional to `weights` by largest
+    remainder. Shares above `cap` are held at it and the excess goes to the
+    others, so they add up to `total` unless every share is capped.
+    """
+    shares = [0] * len(weights)
+    open_shares = list(range(len(weights)))
+    remaining = total
+    while open_shares and remaining > 0:
+        weight_sum = sum(weights[i] for i in open_shares) or 1
+        exact = {i: remaining * weights[i] / weight_sum for i in open_shares}
+        over = {i for i in open_shares if cap is not None and exact[i] > cap}
+        if over:
+            for i in over:
+                shares[i] = cap
+            remaining -= cap * len(over)
+            open_shares = [i for i in open_shares if i not in over]
+            continue
+        for i in open_shares:
+            shares[i] = int(exact[i])
+        by_remainder = sorted(open_shares, key=lambda i: shares[i] - exact[i])
+        for i in by_remainder[:remaining - sum(shares[i] for i in open_shares)]:
+            shares[i] += 1
+        break
+    return shares
+
+
+def spread(rng, start, end, count):
+    # `count` increasing times between start and end, one in each of
+    # `count` equal slices.
+    span = (end - start).total_seconds()
+    for i in range(count):
+        yield start + timedelta(seconds=span * (i + rng.random()) / count)
+
+
+@contextmanager
+def explicit_timestamps(*fields):
+    # bulk_create runs pre_save, which would overwrite the generated
+    # auto_now_add values with the current time.
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class DatasetGenerator:
+    """
+    Bulk-generates users, rooms, participants, messages and sync telemetry
+    for scale testing. Room popularity follows a Zipf distribution, so a few
+    rooms are huge and most are small; participants, messages and sync
+    events are spread over rooms in proportion to it. Given the same seed
+    and `until`, every run produces the same rows, ids included.
+
+    Rows are written with bulk_create in batches of `batch_size`, or with
+    COPY on PostgreSQL (method='copy', the default there).
+    """
+
+    def __init__(self, users=1000, rooms=200, participants=None, messages=100000, sync_events=20000, days=90,
+                 until=None, skew=DEFAULT_SKEW, seed=0, batch_size=DEFAULT_BATCH_SIZE, method=None,
+                 prefix=DEFAULT_PREFIX, progress=None):
+        self.users = users
+        self.rooms = rooms
+        self.participants = participants if participants is not None else users * 3
+        self.messages = messages
+        self.sync_events = sync_events
+        self.until = until or datetime.combine(timezone.now().date(), time.min, tzinfo=timezone.get_current_timezone())
+        self.start = self.until - timedelta(days=days)
+        self.skew = skew
+        self.seed = seed
+        self.batch_size = batch_size
+        self.method = method or ('copy' if connection.vendor == 'postgresql' else 'bulk')
+        if self.method == 'copy' and connection.vendor != 'postgresql':
+            raise ValueError('COPY is only available on PostgreSQL')
+        self.prefix = prefix
+        self.progress = progress or (lambda message: None)
+        self.rng = random.Random(seed)
+        self.counts = {}
+
+    def uuid4(self):
+        return uuid.UUID(int=self.rng.getrandbits(128), version=4)
+
+    def uuid7(self, at):
+        # Same layout as models.uuid7, with the timestamp of `at`.
+        value = int(at.timestamp() * 1000) << 80 | self.rng.getrandbits(80)
+        value = value & ~(0xF << 76) | (0x7 << 76)
+        value = value & ~(0x3 << 62) | (0x2 << 62)
+        return uuid.UUID(int=value)
+
+    def sentence(self, low=2, high=14):
+        return ' '.join(self.rng.choices(WORDS, k=self.rng.randint(low, high)))
+
+    # Writing
+
+    def write(self, model, objects):
+        written = 0
+        batch = []
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) >= self.batch_size:
+                written += self.write_batch(model, batch)
+                batch = []
+        if batch:
+            written += self.write_batch(model, batch)
+        self.counts[model._meta.model_name] = self.counts.get(model._meta.model_name, 0) + written
+        return written
+
+    def write_batch(self, model, batch):
+        with transaction.atomic():
+            if self.method == 'copy':
+                self.copy(model, batch)
+            else:
+                model.objects.bulk_create(batch)
+        return len(batch)
+
+    def copy(self, model, batch):
+        # Database-generated ids are left to their sequence.
+        fields = [
+            field for field in model._meta.concrete_fields
+            if not (field.primary_key and isinstance(field, models.AutoField))
+        ]
+        columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+        with connection.cursor() as cursor:
+            with cursor.copy(f'COPY {connection.ops.quote_name(model._meta.db_table)} ({columns}) FROM STDIN') as copy:
+                for obj in batch:
+                    copy.write_row([field.get_db_prep_save(getattr(obj, field.attname), connection) for field in fields])
+
+    # Generation
+
+    def run(self):
+        User = get_user_model()
+        if User.objects.filter(username__startswith=self.prefix).exists():
+            raise ValueError(f"Users named {self.prefix}* already exist; use a fresh database or another prefix")
+
+        with explicit_timestamps(
+            Room._meta.get_field('created_at'), Participant._meta.get_field('joined_at'),
+            Message._meta.get_field('created_at'),
+        ):
+            user_ids = self.generate_users(User)
+            rooms = self.generate_rooms(user_ids)
+            members = self.generate_participants(rooms, user_ids)
+            self.generate_messages(rooms, members)
+            self.generate_sync_events(rooms, members)
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        bump_directory_version()
+        return self.counts
+
+    def generate_users(self, User):
+        self.progress(f"Users: {self.users}")
+        joined = list(spread(self.rng, self.start - timedelta(days=365), self.until, self.users))
+
+        def users():
+            for i, date_joined in enumerate(joined):
+                username = f'{self.prefix}{i}'
+                yield User(
+                    username=username, email=f'{username}@example.com', password='!', date_joined=date_joined,
+                    last_activity=date_joined + (self.until - date_joined) * self.rng.random(),
+                    bio=self.sentence() if self.rng.random() < 0.2 else '',
+                )
+
+        self.write(User, users())
+        # Ids come from the database, in insertion order.
+        ids = dict(User.objects.filter(username__startswith=self.prefix).values_list('username', 'id'))
+        return [ids[f'{self.prefix}{i}'] for i in range(self.users)]
+
+    def generate_rooms(self, user_ids):
+        self.progress(f"Rooms: {self.rooms}")
+        weights = zipf_weights(self.rooms, self.skew)
+        # Popularity is independent of age and of where a room sits in the
+        # id order.
+        self.rng.shuffle(weights)
+        sizes = apportion(self.participants, weights, cap=len(user_ids))
+        password = make_password('synthetic')
+        rooms = []
+        for i, (weight, size, created_at) in enumerate(zip(weights, sizes, spread(self.rng, self.start, self.until, self.rooms))):
+            is_private = self.rng.random() < 0.1
+            room = Room(
+                id=self.uuid4(),
+                name=f'{self.rng.choice(ROOM_TOPICS)} {i}',
+                description=self.sentence(4, 20) if self.rng.random() < 0.6 else '',
+                creator_id=user_ids[self.rng.randrange(len(user_ids))],
+                created_at=created_at,
+                is_private=is_private,
+                password=password if is_private else None,
+                max_users=max(10, size),
+                is_active=self.rng.random() < 0.95,
+                current_video_url=f'https://www.youtube.com/watch?v={self.uuid4().hex[:11]}' if self.rng.random() < 0.7 else None,
+                video_state=self.rng.choice(('play', 'pause')),
+                video_timestamp=round(self.rng.uniform(0, 7200), 1),
+                banned_words=self.rng.sample(WORDS, self.rng.randint(1, 5)) if self.rng.random() < 0.1 else [],
+            )
+            room.weight = weight
+            room.size = size
+            rooms.append(room)
+        self.write(Room, iter(rooms))
+        return rooms
+
+    def generate_participants(self, rooms, user_ids):
+        self.progress(f"Participants: {sum(room.size for room in rooms)}")
+        creator_index = {user_id: i for i, user_id in enumerate(user_ids)}
+        members = {}
+
+        def participants():
+            for room in rooms:
+                # The creator is always a member, and a moderator.
+                chosen = self.rng.sample(range(len(user_ids)), room.size)
+                creator = creator_index[room.creator_id]
+                if creator not in chosen:
+                    chosen[0] = creator
+                members[room.id] = [user_ids[i] for i in chosen]
+                online_rate = 0.3 if room.is_active else 0
+                for user_id, joined_at in zip(members[room.id], spread(self.rng, room.created_at, self.until, room.size)):
+                    is_banned = user_id != room.creator_id and self.rng.random() < 0.01
+                    is_muted = not is_banned and self.rng.random() < 0.02
+                    yield Participant(
+                        room_id=room.id, user_id=user_id, joined_at=joined_at,
+                        is_online=not is_banned and self.rng.random() < online_rate,
+                        is_moderator=user_id == room.creator_id or self.rng.random() < 0.02,
+                        is_muted=is_muted,
+                        muted_until=self.until + timedelta(minutes=self.rng.randint(5, 60)) if is_muted else None,
+                        is_banned=is_banned,
+                        banned_at=joined_at + (self.until - joined_at) * self.rng.random() if is_banned else None,
+                        banned_by_id=room.creator_id if is_banned else None,
+                    )
+
+        self.write(Participant, participants())
+        return members
+
+    def member_picker(self, members):
+        cum_weights = list(accumulate(zipf_weights(len(members), AUTHOR_SKEW)))
+        total = cum_weights[-1]
+        return lambda: members[bisect(cum_weights, self.rng.random() * total)]
+
+    def generate_messages(self, rooms, members):
+        self.progress(f"Messages: {self.messages}")
+        counts = apportion(self.messages, [room.weight for room in rooms])
+
+        def messages():
+            for room, count in zip(rooms, counts):
+                if not count:
+                    continue
+                author = self.member_picker(members[room.id])
+                for created_at in spread(self.rng, room.created_at, self.until, count):
+                    kind = 'text' if self.rng.random() < 0.97 else self.rng.choice(('system', 'event'))
+                    yield Message(
+                        id=self.uuid7(created_at), room_id=room.id, user_id=author(),
+                        message=self.sentence(1, 30), message_type=kind, created_at=created_at,
+                    )
+
+        self.write(Message, messages())
+
+    def generate_sync_events(self, rooms, members):
+        self.progress(f"Sync events: {self.sync_events}")
+        counts = apportion(self.sync_events, [room.weight for room in rooms])
+
+        def events():
+            for room, count in zip(rooms, counts):
+                if not count:
+                    continue
+                member = self.member_picker(members[room.id])
+                position = self.rng.uniform(0, 3600)
+                for created_at in spread(self.rng, room.created_at, self.until, count):
+                    action = self.rng.choices(SYNC_ACTIONS, SYNC_ACTION_WEIGHTS)[0]
+                    position = self.rng.uniform(0, 7200) if action == 'seek' else position + self.rng.uniform(0, 30)
+                    server_timestamp = created_at.timestamp()
+                    # Latency is log-normal around ~40 ms; drift mostly
+                    # within a few hundred ms with the occasional outlier.
+                    latency_ms = self.rng.lognormvariate(3.7, 0.6) if action != 'drift_report' else None
+                    drift_ms = self.rng.gauss(0, 150) * (5 if self.rng.random() < 0.02 else 1)
+                    yield VideoSyncData(
+                        room_id=room.id, user_id=member(), action=action,
+                        client_timestamp=server_timestamp - (latency_ms or 0) / 1000,
+                        server_timestamp=server_timestamp, position=round(position, 3),
+                        latency_ms=latency_ms, drift_ms=drift_ms if action != 'seek' else None,
+                        created_at=created_at,
+                    )
+
+        self.write(VideoSyncData, events())
@@ -0,0 +1,197 @@
+import logging
+import math
+import time
+from collections import defaultdict
+from datetime import timedelta
+from threading import Lock
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_FLUSH_INTERVAL = 5
+DEFAULT_MAX_BUFFER = 10000
+DEFAULT_RETENTION_HOURS = 24
+DEFAULT_ROLLUP_LOOKBACK_HOURS = 6
+PRUNE_CHUNK_SIZE = 5000
+PERCENTILES = (50, 95, 99)
+
+# Actions where the reported position should match the room clock; a seek
+# or a new video moves it on purpose.
+DRIFT_ACTIONS = ('play', 'pause', 'sync')
+
+
+def clock_position(clock, at):
+    # Where playback should be at server time `at` by a room_clock() dict.
+    if clock['state'] == 'play' and clock['updated_at']:
+        return clock['position'] + (at - clock['updated_at'])
+    return clock['position']
+
+
+class SyncEventIngester:
+    """
+    Buffers VideoSyncData rows in memory and writes them with one
+    bulk_create per batch, so recording an event costs the consumer nothing
+    on the database. A batch is due once batch_size events are buffered or
+    the oldest one has waited flush_interval seconds. When the database is
+    unavailable the buffer keeps only the newest max_buffer events.
+    """
+
+    def __init__(self, batch_size=None, flush_interval=None, max_buffer=None):
+        self.batch_size = batch_size or getattr(settings, 'SYNC_INGEST_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+        self.flush_interval = flush_interval or getattr(settings, 'SYNC_INGEST_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL)
+        self.max_buffer = max_buffer or DEFAULT_MAX_BUFFER
+        self._buffer = []
+        self._oldest = None
+        self._lock = Lock()
+        self.dropped = 0
+
+    def record(self, **fields):
+        from .models import VideoSyncData
+
+        with self._lock:
+            if not self._buffer:
+                self._oldest = time.monotonic()
+            self._buffer.append(VideoSyncData(created_at=timezone.now(), **fields))
+            if len(self._buffer) > self.max_buffer:
+                overflow = len(self._buffer) - self.max_buffer
+                del self._buffer[:overflow]
+                self.dropped += overflow
+
+    def pending(self):
+        return len(self._buffer)
+
+    def flush_due(self):
+        if not self._buffer:
+            return False
+        return len(self._buffer) >= self.batch_size or time.monotonic() - self._oldest >= self.flush_interval
+
+    def flush(self):
+        from .models import VideoSyncData
+
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+            self._oldest = None
+        if not batch:
+            return 0
+
+        try:
+            VideoSyncData.objects.bulk_create(batch, batch_size=self.batch_size)
+        except Exception:
+            logger.exception(f"Could not write {len(batch)} sync events; keeping them for the next flush")
+            with self._lock:
+                self._buffer[:0] = batch[-self.max_buffer:]
+                self._oldest = time.monotonic()
+            return 0
+        return len(batch)
+
+
+ingester = SyncEventIngester()
+
+
+def percentile(sorted_values, pct):
+    # Nearest-rank percentile of an already sorted list.
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(values):
+    values = sorted(values)
+    return {pct: percentile(values, pct) for pct in PERCENTILES}
+
+
+def get_retention_hours():
+    return getattr(settings, 'SYNC_DATA_RETENTION_HOURS', DEFAULT_RETENTION_HOURS)
+
+
+def rollup_start(current_hour):
+    # Events reach the table up to a flush (or a database outage) late, so
+    # the last few finished hours are summarized again on every run. Hours
+    # before the newest summary are covered too, e.g. after the rollup was
+    # down for longer than the lookback.
+    from .models import RoomSyncSummary
+
+    lookback = getattr(settings, 'SYNC_ROLLUP_LOOKBACK_HOURS', DEFAULT_ROLLUP_LOOKBACK_HOURS)
+    start = current_hour - timedelta(hours=lookback)
+    last_summary = RoomSyncSummary.objects.aggregate(last=Max('period_start'))['last']
+    if last_summary is None:
+        return None
+    return min(start, last_summary)
+
+
+def rollup_sync_data(now=None):
+    """
+    Summarizes raw sync events into hourly per-room RoomSyncSummary rows.
+    Only finished hours are summarized, and the ones since rollup_start()
+    are rewritten from all their events, so re-running it is safe and
+    events flushed late are counted. Returns the number of summaries
+    written.
+    """
+    from .models import VideoSyncData, RoomSyncSummary
+
+    now = now or timezone.now()
+    current_hour = now.replace(minute=0, second=0, microsecond=0)
+    events = VideoSyncData.objects.filter(created_at__lt=current_hour)
+    start = rollup_start(current_hour)
+    if start:
+        events = events.filter(created_at__gte=start)
+
+    buckets = defaultdict(lambda: {'samples': 0, 'latency': [], 'drift': []})
+    rows = events.order_by().values_list('room_id', 'created_at', 'latency_ms', 'drift_ms')
+    for room_id, created_at, latency_ms, drift_ms in rows.iterator(chunk_size=PRUNE_CHUNK_SIZE):
+        bucket = buckets[room_id, created_at.replace(minute=0, second=0, microsecond=0)]
+        bucket['samples'] += 1
+        if latency_ms is not None:
+            bucket['latency'].append(latency_ms)
+        if drift_ms is not None:
+            bucket['drift'].append(abs(drift_ms))
+
+    summaries = []
+    for (room_id, period_start), bucket in buckets.items():
+        latency = summarize(bucket['latency'])
+        drift = summarize(bucket['drift'])
+        summaries.append(RoomSyncSummary(
+            room_id=room_id,
+            period_start=period_start,
+            samples=bucket['samples'],
+            latency_p50=latency[50], latency_p95=latency[95], latency_p99=latency[99],
+            drift_p50=drift[50], drift_p95=drift[95], drift_p99=drift[99],
+        ))
+
+    RoomSyncSummary.objects.bulk_create(
+        summaries,
+        update_conflicts=True,
+        unique_fields=['room', 'period_start'],
+        update_fields=[
+            'samples', 'latency_p50', 'latency_p95', 'latency_p99', 'drift_p50', 'drift_p95', 'drift_p99',
+        ],
+    )
+    return len(summaries)
+
+
+def prune_sync_data(now=None, chunk_size=PRUNE_CHUNK_SIZE):
+    # Only hours the rollup no longer rescans are pruned, so raw events are
+    # never dropped before they were rolled up.
+    from .models import VideoSyncData
+
+    now = now or timezone.now()
+    start = rollup_start(now.replace(minute=0, second=0, microsecond=0))
+    if start is None:
+        return 0
+    cutoff = min(now - timedelta(hours=get_retention_hours()), start)
+
+    deleted = 0
+    while True:
+        pks = list(
+            VideoSyncData.objects.filter(created_at__lt=cutoff).order_by().values_list('pk', flat=True)[:chunk_size]
+        )
+        if not pks:
+            return deleted
+        with transaction.atomic():
+            chunk = VideoSyncData.objects.filter(pk__in=pks)
+            deleted += chunk._raw_delete(chunk.db)
@@ -1,3 +1,1401 @@
-from django.test import TestCase
+import asyncio
+import json
+import shutil
+import tempfile
+import time
+import uuid
+from collections import Counter
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime
+from io import StringIO
+from unittest.mock import patch
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.exceptions import ChannelFull
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, router
+from django.db.models import Count, F
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from users.models import UserStats
+from .archive import archive_room_messages, get_archive_storage, get_room_history, read_archive
+from .caching import get_cached_room
+from .clock import ClockModel
+from .workers import HashRing, RoomRouter, pin_room, room_router, ROOM_MOVED_CLOSE_CODE
+from .deletion import claimable_jobs, process_room_deletion, settle_chunk, STALE_JOB_AFTER
+from .drain import worker_drain, SERVICE_RESTART_CLOSE_CODE
+from .presence import SWEEP_LOCK_KEY
+from .loadtest import LoadTest
+from .synthetic import DatasetGenerator
+from .actors import room_actors, ActorStopped, RoomActor
+from .search import search_messages
+from .telemetry import SyncEventIngester, ingester as sync_events, rollup_sync_data, prune_sync_data
+from .models import (
+    Room, Participant, Message, MessageArchive, ScreenSession, VideoSyncData, RoomSyncSummary, RoomDeletionJob, uuid7,
+)
+from .routing import websocket_urlpatterns
+from syncstream_project.cache import TwoTierCache
+from syncstream_project.channel_layer import LocalChannelLayer
+from syncstream_project.db_pool import configure_pool
+from syncstream_project.db_routers import (
+    PRIMARY_PIN_COOKIE, PrimaryPinningMiddleware, prefer_replica, replica_cache_timeout,
+)
 
-# Create your tests here.
+User = get_user_model()
+
+MEMBER_COUNT = 10
+MESSAGE_COUNT = 30
+
+
+class QueryBudgetMixin:
+    """
+    Pins the number of queries a code path may run. The fixtures hold enough
+    participants and messages that a per-row query blows the budget.
+    """
+
+    def _check_budget(self, context, budget):
+        executed = len(context.captured_queries)
+        if executed > budget:
+            queries = '\n'.join(
+                f"{i}. {query['sql']}" for i, query in enumerate(context.captured_queries, start=1)
+            )
+            self.fail(f"{executed} queries executed, budget is {budget}:\n{queries}")
+
+    @contextmanager
+    def assertMaxQueries(self, budget, using=DEFAULT_DB_ALIAS):
+        with CaptureQueriesContext(connections[using]) as context:
+            yield context
+        self._check_budget(context, budget)
+
+    @asynccontextmanager
+    async def assertMaxQueriesAsync(self, budget, using=DEFAULT_DB_ALIAS):
+        # Consumer queries run on the sync thread, so capture that thread's
+        # connection rather than the event loop's.
+        context = await sync_to_async(lambda: CaptureQueriesContext(connections[using]))()
+        await sync_to_async(context.__enter__)()
+        try:
+            yield context
+        finally:
+            await sync_to_async(context.__exit__)(None, None, None)
+        self._check_budget(context, budget)
+
+
+class RoomFixtureMixin:
+    @classmethod
+    def setUpTestData(cls):
+        cls.creator = User.objects.create_user('creator', password='pass')
+        cls.members = [User.objects.create_user(f'member{i}', password='pass') for i in range(MEMBER_COUNT)]
+
+        cls.room = Room.objects.create(name='Public room', creator=cls.creator, max_users=50)
+        cls.private_room = Room.objects.create(name='Private room', creator=cls.creator, is_private=True, password=make_password('secret'), max_users=50)
+
+        for room in (cls.room, cls.private_room):
+            Participant.objects.create(room=room, user=cls.creator, is_online=True)
+            for i, member in enumerate(cls.members):
+                Participant.objects.create(room=room, user=member, is_online=i % 2 == 0)
+
+        for i in range(MESSAGE_COUNT):
+            Message.objects.create(room=cls.room, user=cls.members[i % MEMBER_COUNT], message=f'message {i}')
+
+    def setUp(self):
+        cache.clear()
+        # Keep the activity middleware from adding its periodic write.
+        User.objects.update(is_online=True, last_activity=timezone.now())
+
+
+class RoomViewQueryBudgetTests(QueryBudgetMixin, RoomFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.creator)
+
+    def test_home_anonymous(self):
+        self.client.logout()
+        with self.assertMaxQueries(1):
+            response = self.client.get(reverse('home'))
+        self.assertEqual(response.status_code, 200)
+        with self.assertMaxQueries(0):
+            self.client.get(reverse('home'))
+
+    def test_home_authenticated(self):
+        with self.assertMaxQueries(3):
+            response = self.client.get(reverse('home'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_room_list(self):
+        with self.assertMaxQueries(4):
+            response = self.client.get(reverse('rooms:room_list'), {'sort': 'most_popular'})
+        self.assertEqual(response.status_code, 200)
+        with self.assertMaxQueries(2):
+            self.client.get(reverse('rooms:room_list'), {'sort': 'most_popular'})
+
+    def test_room_detail(self):
+        with self.assertMaxQueries(8):
+            response = self.client.get(reverse('rooms:room_detail', args=[self.room.id]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_room_detail_private_with_password(self):
+        self.client.force_login(self.members[0])
+        with self.assertMaxQueries(9):
+            response = self.client.get(reverse('rooms:room_detail', args=[self.private_room.id]), {'password': 'secret'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_join_by_password(self):
+        self.client.force_login(self.members[1])
+        with self.assertMaxQueries(5):
+            response = self.client.post(reverse('rooms:join_by_password'), {
+                'room_id': str(self.private_room.id),
+                'password': 'secret',
+            })
+        self.assertEqual(response.status_code, 302)
+
+    def test_create_room(self):
+        with self.assertMaxQueries(2):
+            self.client.get(reverse('rooms:create_room'))
+        with self.assertMaxQueries(4):
+            response = self.client.post(reverse('rooms:create_room'), {
+                'name': 'New room',
+                'description': '',
+                'max_users': 10,
+                'allow_chat': 'on',
+                'allow_screen_share': 'on',
+            })
+        self.assertEqual(response.status_code, 302)
+
+    def test_edit_room(self):
+        with self.assertMaxQueries(3):
+            self.client.get(reverse('rooms:edit_room', args=[self.room.id]))
+        with self.assertMaxQueries(4):
+            response = self.client.post(reverse('rooms:edit_room', args=[self.room.id]), {
+                'name': 'Renamed room',
+                'description': '',
+                'max_users': 50,
+                'allow_chat': 'on',
+            })
+        self.assertEqual(response.status_code, 302)
+
+    def test_delete_room(self):
+        with self.assertMaxQueries(18):
+            response = self.client.post(reverse('rooms:delete_room', args=[self.room.id]))
+        self.assertEqual(response.status_code, 302)
+
+    def test_leave_room(self):
+        self.client.force_login(self.members[0])
+        with self.assertMaxQueries(5):
+            response = self.client.post(reverse('rooms:leave_room', args=[self.room.id]))
+        self.assertEqual(response.status_code, 302)
+
+    def test_user_rooms(self):
+        Room.objects.create(name='Other room', creator=self.members[0])
+        for room in Room.objects.exclude(creator=self.creator):
+            Participant.objects.create(room=room, user=self.creator, is_online=True)
+        with self.assertMaxQueries(4):
+            response = self.client.get(reverse('rooms:user_rooms'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_youre_banned(self):
+        with self.assertMaxQueries(2):
+            self.client.get(reverse('rooms:youre_banned'), {'room_name': 'Public room', 'banned_by': 'creator'})
+
+    def test_room_state_api(self):
+        url = reverse('rooms:room_state_api', args=[self.room.id])
+        with self.assertMaxQueries(5):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        with self.assertMaxQueries(2):
+            self.client.get(url)
+        with self.assertMaxQueries(2):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_room_history_api(self):
+        url = reverse('rooms:room_history_api', args=[self.room.id])
+        with self.assertMaxQueries(4):
+            response = self.client.get(url, {'limit': 20})
+        self.assertEqual(len(response.json()['messages']), 20)
+
+    def test_room_search_api(self):
+        url = reverse('rooms:room_search_api', args=[self.room.id])
+        with self.assertMaxQueries(5):
+            response = self.client.get(url, {'q': 'message', 'limit': 20})
+        self.assertEqual(len(response.json()['results']), 20)
+
+    def test_update_video_state_api(self):
+        with self.assertMaxQueries(6):
+            response = self.client.post(
+                reverse('rooms:update_video_state_api', args=[self.room.id]),
+                json.dumps({'action': 'play', 'timestamp': 12}),
+                content_type='application/json',
+            )
+        self.assertEqual(response.status_code, 200)
+
+    def test_delete_message(self):
+        message = self.room.messages.first()
+        with self.assertMaxQueries(6):
+            response = self.client.post(reverse('rooms:delete_message', args=[self.room.id, message.id]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_moderation(self):
+        target = self.members[0]
+        for name, data, budget in [
+            ('rooms:mute_user', {'duration': 5}, 6),
+            ('rooms:unmute_user', {}, 6),
+            ('rooms:ban_user', {}, 7),
+            ('rooms:unban_user', {}, 7),
+            ('rooms:kick_user', {}, 8),
+        ]:
+            with self.subTest(name):
+                with self.assertMaxQueries(budget):
+                    response = self.client.post(reverse(name, args=[self.room.id, target.id]), data)
+                self.assertEqual(response.status_code, 200)
+
+    def test_bulk_moderation(self):
+        user_ids = ','.join(str(member.id) for member in self.members)
+        for action, budget in [('mute', 8), ('unmute', 8), ('ban', 9), ('unban', 9), ('kick', 9)]:
+            with self.subTest(action):
+                with self.assertMaxQueries(budget):
+                    response = self.client.post(
+                        reverse('rooms:bulk_moderate_users', args=[self.room.id]),
+                        {'action': action, 'user_ids': user_ids, 'duration': 5},
+                    )
+                self.assertEqual(response.status_code, 200)
+
+    def test_banned_words(self):
+        with self.assertMaxQueries(4):
+            self.client.post(reverse('rooms:add_banned_word', args=[self.room.id]), {'word': 'spoiler'})
+        with self.assertMaxQueries(3):
+            self.client.get(reverse('rooms:get_banned_words', args=[self.room.id]))
+        with self.assertMaxQueries(4):
+            self.client.post(reverse('rooms:remove_banned_word', args=[self.room.id]), {'word': 'spoiler'})
+
+
+@override_settings(ROOM_ACTOR_IDLE_TIMEOUT=0)
+class RoomConsumerQueryBudgetTests(QueryBudgetMixin, RoomFixtureMixin, TestCase):
+    async def connect(self, user, room=None):
+        room = room or self.room
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/room/{room.id}/')
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.receive_json_from()
+        return communicator
+
+    async def test_connect_and_disconnect(self):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/room/{self.room.id}/')
+        communicator.scope['user'] = self.members[0]
+        async with self.assertMaxQueriesAsync(6):
+            connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.receive_json_from()
+        async with self.assertMaxQueriesAsync(3):
+            await communicator.disconnect()
+
+    async def test_connect_private_room(self):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/room/{self.private_room.id}/')
+        communicator.scope['user'] = self.members[0]
+        async with self.assertMaxQueriesAsync(7):
+            connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.disconnect()
+
+    async def test_chat_message(self):
+        communicator = await self.connect(self.members[0])
+        async with self.assertMaxQueriesAsync(3):
+            await communicator.send_json_to({'type': 'chat_message', 'message': 'hello'})
+            response = await communicator.receive_json_from()
+        self.assertEqual(response['type'], 'chat_message')
+        # Room settings now come from the cache.
+        async with self.assertMaxQueriesAsync(2):
+            await communicator.send_json_to({'type': 'chat_message', 'message': 'again'})
+            response = await communicator.receive_json_from()
+        self.assertEqual(response['type'], 'chat_message')
+        await communicator.disconnect()
+
+    async def test_video_control(self):
+        communicator = await self.connect(self.creator)
+        # The room actor holds the clock; the snapshot is saved later.
+        async with self.assertMaxQueriesAsync(0):
+            await communicator.send_json_to({'type': 'video_control', 'action': 'play', 'timestamp': 3})
+            response = await communicator.receive_json_from()
+        self.assertEqual(response['type'], 'video_control')
+        self.assertEqual(sync_events.pending(), 1)
+        await communicator.disconnect()
+        self.assertEqual(sync_events.pending(), 0)
+        self.assertEqual(await VideoSyncData.objects.filter(room=self.room, action='play').acount(), 1)
+        room = await Room.objects.aget(id=self.room.id)
+        self.assertEqual((room.video_state, room.video_timestamp), ('play', 3))
+
+    async def test_screen_share(self):
+        communicator = await self.connect(self.creator)
+        async with self.assertMaxQueriesAsync(3):
+            await communicator.send_json_to({'type': 'screen_share', 'action': 'start'})
+            response = await communicator.receive_json_from()
+        self.assertEqual(response['type'], 'screen_share_started')
+        async with self.assertMaxQueriesAsync(2):
+            await communicator.send_json_to({'type': 'screen_share', 'action': 'stop'})
+            response = await communicator.receive_json_from()
+        self.assertEqual(response['type'], 'screen_share_ended')
+        await communicator.disconnect()
+
+    async def test_typing(self):
+        communicator = await self.connect(self.members[0])
+        async with self.assertMaxQueriesAsync(0):
+            await communicator.send_json_to({'type': 'typing_start'})
+            response = await communicator.receive_json_from()
+        self.assertTrue(response['is_typing'])
+        async with self.assertMaxQueriesAsync(0):
+            await communicator.send_json_to({'type': 'typing_stop'})
+            response = await communicator.receive_json_from()
+        self.assertFalse(response['is_typing'])
+        await communicator.disconnect()
+
+    async def test_ping_and_signalling(self):
+        communicator = await self.connect(self.members[0])
+        async with self.assertMaxQueriesAsync(0):
+            await communicator.send_json_to({'type': 'ping', 'client_time': 1})
+            self.assertEqual((await communicator.receive_json_from())['type'], 'pong')
+            await communicator.send_json_to({'type': 'webrtc_signal', 'data': {'kind': 'offer'}})
+            self.assertEqual((await communicator.receive_json_from())['type'], 'webrtc_signal')
+        await communicator.disconnect()
+
+    async def test_ping_estimates_clock_offset(self):
+        await sync_to_async(self.room.update_video_state)('play', 100)
+        started = (await Room.objects.aget(id=self.room.id)).last_video_update.timestamp()
+        communicator = await self.connect(self.members[0])
+        # This client's clock runs 5 s behind the server.
+        client_now = lambda: (time.time() - 5) * 1000
+        sent = client_now()
+        await communicator.send_json_to({'type': 'ping', 'client_time': sent})
+        pong = await communicator.receive_json_from()
+        self.assertIsNone(pong['clock_offset'])
+        
+        previous = {'client_time': sent, 'received_at': client_now()}
+        await communicator.send_json_to({'type': 'ping', 'client_time': client_now(), 'previous': previous})
+        pong = await communicator.receive_json_from()
+        self.assertEqual(pong['clock_samples'], 1)
+        self.assertAlmostEqual(pong['clock_offset'], 5, delta=0.5)
+        
+        # Reports are timed through the offset, so a client in sync on its
+        # own clock isn't corrected by 5 s.
+        await communicator.send_json_to({
+            'type': 'drift_report', 'position': 100 + time.time() - started, 'playing': True, 'client_time': client_now(),
+        })
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+    async def test_drift_report_corrects_only_the_drifting_client(self):
+        await sync_to_async(self.room.update_video_state)('play', 100)
+        drifting = await self.connect(self.members[0])
+        other = await self.connect(self.members[1])
+        await drifting.receive_json_from()
+        
+        def report(position):
+            return {'type': 'drift_report', 'position': position, 'playing': True, 'client_time': time.time() * 1000}
+        
+        async with self.assertMaxQueriesAsync(0):
+            await drifting.send_json_to(report(100.1))
+            self.assertTrue(await drifting.receive_nothing())
+            
+            await drifting.send_json_to(report(80))
+            correction = await drifting.receive_json_from()
+            self.assertEqual(correction['type'], 'sync_correction')
+            self.assertEqual(correction['state'], 'play')
+            self.assertAlmostEqual(correction['timestamp'], 100.3, delta=0.5)
+            self.assertAlmostEqual(correction['drift'], -20, delta=0.5)
+            
+            # No repeat while the correction is being applied.
+            await drifting.send_json_to(report(80))
+            self.assertTrue(await drifting.receive_nothing())
+        self.assertTrue(await other.receive_nothing())
+        self.assertEqual(sync_events.pending(), 2)
+        await drifting.disconnect()
+        await other.disconnect()
+
+    async def test_room_actor_announces_each_user_once(self):
+        first = await self.connect(self.members[0])
+        second = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/room/{self.room.id}/')
+        second.scope['user'] = self.members[0]
+        connected, _ = await second.connect()
+        self.assertTrue(connected)
+        self.assertTrue(await first.receive_nothing())
+        
+        await second.disconnect()
+        self.assertTrue(await first.receive_nothing())
+        await first.disconnect()
+
+    async def moderate(self, view, user):
+        await self.async_client.aforce_login(self.creator)
+        response = await self.async_client.post(reverse(f'rooms:{view}', args=[self.room.id, user.id]), {'duration': 5})
+        self.assertEqual(response.status_code, 200)
+
+    async def test_room_actor_follows_mutes_from_views(self):
+        communicator = await self.connect(self.members[0])
+        await self.moderate('mute_user', self.members[0])
+        self.assertEqual((await communicator.receive_json_from())['type'], 'user_muted')
+        
+        async with self.assertMaxQueriesAsync(0):
+            await communicator.send_json_to({'type': 'chat_message', 'message': 'hello'})
+            response = await communicator.receive_json_from()
+            await communicator.send_json_to({'type': 'typing_start'})
+            self.assertTrue(await communicator.receive_nothing())
+        self.assertEqual(response['type'], 'error')
+        
+        await self.moderate('unmute_user', self.members[0])
+        self.assertEqual((await communicator.receive_json_from())['type'], 'user_unmuted')
+        await communicator.send_json_to({'type': 'chat_message', 'message': 'hello'})
+        self.assertEqual((await communicator.receive_json_from())['type'], 'chat_message')
+        await communicator.disconnect()
+
+    async def test_room_actor_unmutes_user_muted_when_it_loaded(self):
+        participant = await Participant.objects.aget(room=self.room, user=self.members[0])
+        await participant.amute(5, self.creator)
+        communicator = await self.connect(self.members[0])
+        await communicator.send_json_to({'type': 'chat_message', 'message': 'hello'})
+        self.assertEqual((await communicator.receive_json_from())['type'], 'error')
+        
+        await self.moderate('unmute_user', self.members[0])
+        self.assertEqual((await communicator.receive_json_from())['type'], 'user_unmuted')
+        await communicator.send_json_to({'type': 'chat_message', 'message': 'hello'})
+        self.assertEqual((await communicator.receive_json_from())['type'], 'chat_message')
+        await communicator.disconnect()
+
+    async def test_consumer_replaces_a_crashed_room_actor(self):
+        communicator = await self.connect(self.members[0])
+        actor = room_actors.get(self.room.id)
+        with patch.object(actor, 'next_timeout', side_effect=RuntimeError('boom')), self.assertLogs('rooms.actors', 'ERROR'):
+            actor.tell('save')
+            await asyncio.wait([actor.task])
+        self.assertIsNone(room_actors.get(self.room.id))
+        
+        await communicator.send_json_to({'type': 'chat_message', 'message': 'hello'})
+        self.assertEqual((await communicator.receive_json_from())['type'], 'chat_message')
+        replacement = room_actors.get(self.room.id)
+        self.assertIsNot(replacement, actor)
+        self.assertIn(self.members[0].id, replacement.connections)
+        
+        await communicator.send_json_to({'type': 'video_control', 'action': 'play', 'timestamp': 3})
+        self.assertEqual((await communicator.receive_json_from())['type'], 'video_control')
+        with patch.object(RoomActor, 'ask', side_effect=ActorStopped('stopped')):
+            await communicator.send_json_to({'type': 'video_control', 'action': 'pause', 'timestamp': 4})
+            response = await communicator.receive_json_from()
+        self.assertEqual(response, {'type': 'error', 'message': 'Video change was not applied', 'action': 'pause'})
+        await communicator.disconnect()
+
+    async def test_group_event_handlers(self):
+        communicator = await self.connect(self.members[0])
+        user = {'user_id': 1, 'username': 'someone'}
+        events = [
+            {'type': 'user_joined', **user},
+            {'type': 'user_left', **user},
+            {'type': 'message_deleted', 'message_id': 'x', 'deleted_by': 'creator', 'message_content': 'hi', 'message_author': 'someone'},
+            {'type': 'banned_word_added', 'word': 'spoiler', 'added_by': 'creator'},
+            {'type': 'banned_word_removed', 'word': 'spoiler', 'removed_by': 'creator'},
+            {'type': 'user_kicked', **user, 'kicked_by': 'creator'},
+            {'type': 'user_muted', **user, 'muted_by': 'creator', 'duration': 5, 'muted_until': None},
+            {'type': 'user_unmuted', **user, 'unmuted_by': 'creator'},
+            {'type': 'user_banned', **user, 'banned_by': 'creator'},
+            {'type': 'user_unbanned', **user, 'unbanned_by': 'creator'},
+            {'type': 'users_moderated', 'action': 'mute', 'users': [user], 'moderated_by': 'creator', 'duration': 5, 'muted_until': None},
+        ]
+        channel_layer = get_channel_layer()
+        async with self.assertMaxQueriesAsync(0):
+            for event in events:
+                await channel_layer.group_send(f'room_{self.room.id}', event)
+                self.assertEqual((await communicator.receive_json_from())['type'], event['type'])
+        await communicator.disconnect()
+
+
+@override_settings(DATABASE_READ_REPLICAS=['replica'], DATABASE_REPLICA_LAG=3)
+class ReplicaRoutingTests(SimpleTestCase):
+    def request(self, view, method='get', cookies=None):
+        request = getattr(RequestFactory(), method)('/')
+        request.user = AnonymousUser()
+        request.COOKIES.update(cookies or {})
+        return PrimaryPinningMiddleware(view)(request)
+
+    @staticmethod
+    def read_alias(request, model=Room):
+        return HttpResponse(router.db_for_read(model))
+
+    def test_reads_stay_on_primary_without_hint(self):
+        self.assertEqual(self.request(self.read_alias).content, b'default')
+
+    def test_hinted_view_reads_from_replica(self):
+        response = self.request(prefer_replica(self.read_alias))
+        self.assertEqual(response.content, b'replica')
+        self.assertNotIn(PRIMARY_PIN_COOKIE, response.cookies)
+
+    def test_sessions_always_read_from_primary(self):
+        view = prefer_replica(lambda request: self.read_alias(request, Session))
+        self.assertEqual(self.request(view).content, b'default')
+
+    def test_unsafe_methods_read_from_primary(self):
+        self.assertEqual(self.request(prefer_replica(self.read_alias), method='post').content, b'default')
+
+    def test_reads_after_write_stick_to_primary(self):
+        @prefer_replica
+        def view(request):
+            before = router.db_for_read(Room)
+            router.db_for_write(Room)
+            return HttpResponse(f'{before} {router.db_for_read(Room)}')
+
+        response = self.request(view)
+        self.assertEqual(response.content, b'replica default')
+        self.assertEqual(response.cookies[PRIMARY_PIN_COOKIE]['max-age'], 3)
+
+        response = self.request(prefer_replica(self.read_alias), cookies={PRIMARY_PIN_COOKIE: '1'})
+        self.assertEqual(response.content, b'default')
+
+    def test_pinning_does_not_leak_between_requests(self):
+        self.request(prefer_replica(lambda request: HttpResponse(router.db_for_write(Room))))
+        self.assertEqual(self.request(prefer_replica(self.read_alias)).content, b'replica')
+
+    def test_replica_cache_timeout(self):
+        view = prefer_replica(lambda request: HttpResponse(replica_cache_timeout(300)))
+        self.assertEqual(self.request(view).content, b'3')
+        self.assertEqual(self.request(lambda request: HttpResponse(replica_cache_timeout(300))).content, b'300')
+
+    @override_settings(DATABASE_READ_REPLICAS=[])
+    def test_no_replica_configured(self):
+        self.assertEqual(self.request(prefer_replica(self.read_alias)).content, b'default')
+
+
+class DatabasePoolTests(TestCase):
+    def test_configure_pool_for_postgresql(self):
+        database = configure_pool({
+            'ENGINE': 'django.db.backends.postgresql',
+            'CONN_MAX_AGE': 600,
+            'OPTIONS': {'sslmode': 'require'},
+        }, 'default')
+        
+        self.assertEqual(database['CONN_MAX_AGE'], 0)
+        self.assertEqual(database['OPTIONS']['sslmode'], 'require')
+        self.assertEqual(database['OPTIONS']['pool']['name'], 'default')
+        self.assertLessEqual(database['OPTIONS']['pool']['min_size'], database['OPTIONS']['pool']['max_size'])
+
+    def test_configure_pool_ignores_other_engines(self):
+        database = configure_pool({'ENGINE': 'django.db.backends.sqlite3', 'CONN_MAX_AGE': 600}, 'default')
+        self.assertEqual(database, {'ENGINE': 'django.db.backends.sqlite3', 'CONN_MAX_AGE': 600})
+
+    def test_pool_stats_are_staff_only(self):
+        user = User.objects.create_user('member', password='pass')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(reverse('rooms:db_pool_stats_api')).status_code, 403)
+        
+        User.objects.filter(pk=user.pk).update(is_staff=True)
+        response = self.client.get(reverse('rooms:db_pool_stats_api'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'pools': {}})
+
+
+class TwoTierCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = TwoTierCache(self.id(), {
+            'OPTIONS': {
+                'SHARED_BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCAL_TIMEOUT': 60,
+                'LOCAL_MAX_ENTRIES': 2,
+            },
+        })
+        self.addCleanup(self.cache.clear)
+
+    def test_reads_are_served_from_local_tier(self):
+        self.cache.set('room_settings', {'allow_chat': True})
+        self.cache._shared.delete('room_settings')
+        
+        self.assertEqual(self.cache.get('room_settings'), {'allow_chat': True})
+        self.assertEqual(self.cache.get('missing', 'default'), 'default')
+        stats = self.cache.stats()
+        self.assertEqual((stats['local_hits'], stats['shared_hits'], stats['misses']), (1, 0, 1))
+
+    def test_version_keys_always_read_shared_tier(self):
+        self.cache.set('room_1_state_version', 1)
+        self.cache._shared.incr('room_1_state_version')
+        self.assertEqual(self.cache.get('room_1_state_version'), 2)
+
+    def test_local_tier_is_bounded_lru(self):
+        for key in ('a', 'b', 'c'):
+            self.cache.set(key, key)
+        
+        stats = self.cache.stats()
+        self.assertEqual((stats['local_entries'], stats['local_evictions']), (2, 1))
+        self.assertEqual(self.cache.get_many(['a', 'b', 'c']), {'a': 'a', 'b': 'b', 'c': 'c'})
+        self.assertEqual(self.cache.stats()['shared_hits'], 1)
+
+    def test_local_copies_are_not_shared_with_callers(self):
+        self.cache.set('typing', {'1': 'alice'})
+        self.cache.get('typing')['2'] = 'bob'
+        self.assertEqual(self.cache.get('typing'), {'1': 'alice'})
+
+    def test_writes_and_deletes_evict_local_copy(self):
+        self.cache.set('key', 1)
+        self.cache.delete('key')
+        self.assertIsNone(self.cache.get('key'))
+        self.assertTrue(self.cache.add('key', 1))
+        self.assertFalse(self.cache.add('key', 2))
+        self.assertEqual(self.cache.get('key'), 1)
+        self.assertEqual(self.cache.incr('key'), 2)
+        self.assertEqual(self.cache.get('key'), 2)
+
+
+class LocalChannelLayerTests(SimpleTestCase):
+    async def test_group_send_shares_one_message_with_every_member(self):
+        layer = LocalChannelLayer()
+        channels = [await layer.new_channel() for _ in range(3)]
+        for channel in channels:
+            await layer.group_add('room_1', channel)
+        await layer.group_discard('room_1', channels[2])
+        
+        waiting = asyncio.ensure_future(layer.receive(channels[0]))
+        await asyncio.sleep(0)
+        message = {'type': 'video_control', 'action': 'play'}
+        await layer.group_send('room_1', message)
+        self.assertIs(await waiting, message)
+        self.assertIs(await layer.receive(channels[1]), message)
+        self.assertEqual(layer.memberships, {channels[0]: {'room_1'}, channels[1]: {'room_1'}})
+    
+    async def test_full_channels_follow_drop_policy(self):
+        for policy, kept in (('drop_oldest', [2, 3]), ('drop_newest', [1, 2])):
+            layer = LocalChannelLayer(capacity=2, drop_policy=policy)
+            await layer.group_add('room_1', 'viewer')
+            for i in (1, 2, 3):
+                await layer.group_send('room_1', {'type': 'tick', 'i': i})
+            self.assertEqual([(await layer.receive('viewer'))['i'] for _ in kept], kept)
+            self.assertEqual(layer.dropped, 1)
+        
+        with self.assertRaises(ChannelFull):
+            for i in (1, 2, 3):
+                await layer.send('viewer', {'type': 'tick', 'i': i})
+    
+    async def test_unread_channels_expire_out_of_groups(self):
+        layer = LocalChannelLayer(expiry=10)
+        await layer.group_add('room_1', 'gone')
+        await layer.group_add('room_1', 'reading')
+        await layer.group_send('room_1', {'type': 'tick'})
+        await layer.receive('reading')
+        
+        layer._sweep(time.time() + 11)
+        self.assertEqual(layer.groups, {'room_1': {'reading': layer.groups['room_1']['reading']}})
+        self.assertNotIn('gone', layer.channels)
+        self.assertEqual(layer.expired, 1)
+    
+    def test_group_send_from_another_thread_wakes_receiver(self):
+        layer = LocalChannelLayer()
+        
+        async def receive_while_a_view_sends():
+            await layer.group_add('room_1', 'viewer')
+            waiting = asyncio.ensure_future(layer.receive('viewer'))
+            await asyncio.sleep(0)
+            # Sync views send from a worker thread on an event loop of their own.
+            await asyncio.get_running_loop().run_in_executor(None, asyncio.run, layer.group_send('room_1', {'type': 'tick'}))
+            return await asyncio.wait_for(waiting, 1)
+        
+        self.assertEqual(async_to_sync(receive_while_a_view_sends)(), {'type': 'tick'})
+
+
+class CachedRoomTests(TestCase):
+    def test_settings_changes_invalidate_cached_room(self):
+        creator = User.objects.create_user('creator', password='pass')
+        room = Room.objects.create(name='Cached', creator=creator, banned_words=['spoiler'])
+        self.assertTrue(get_cached_room(room.id).contains_banned_words('no spoilers'))
+        
+        room.video_state = 'play'
+        room.save(update_fields=['video_state'])
+        with self.assertNumQueries(0):
+            self.assertTrue(get_cached_room(room.id).allow_chat)
+        
+        room.allow_chat = False
+        room.save(update_fields=['allow_chat'])
+        self.assertFalse(get_cached_room(room.id).allow_chat)
+
+
+class MessageSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.creator = User.objects.create_user('creator', password='pass')
+        cls.member = User.objects.create_user('member', password='pass')
+        cls.room = Room.objects.create(name='Search room', creator=cls.creator, is_private=True, max_users=50)
+        cls.other_room = Room.objects.create(name='Other room', creator=cls.creator)
+        Participant.objects.create(room=cls.room, user=cls.member)
+        
+        now = timezone.now()
+        texts = ['Watching the trailer now', '<b>trailers</b> are better', 'pause please', 'Who picked this trailer?']
+        for i, text in enumerate(texts):
+            Message.objects.create(room=cls.room, user=cls.member, message=text, created_at=now + timezone.timedelta(seconds=i))
+        Message.objects.create(room=cls.other_room, user=cls.member, message='trailer in another room')
+
+    def test_search_is_ranked_newest_first_and_highlighted(self):
+        results = search_messages(self.room, 'trailer')
+        self.assertEqual([r['message'] for r in results], [
+            'Who picked this trailer?', '<b>trailers</b> are better', 'Watching the trailer now',
+        ])
+        self.assertEqual(results[0]['highlight'], 'Who picked this <mark>trailer</mark>?')
+        self.assertEqual(results[1]['highlight'], '&lt;b&gt;<mark>trailers</mark>&lt;/b&gt; are better')
+
+    def test_search_ignores_query_syntax(self):
+        self.assertEqual(len(search_messages(self.room, '"pause* (')), 1)
+        self.assertEqual(search_messages(self.room, '*'), [])
+
+    def test_deleted_and_edited_messages_follow_the_index(self):
+        message = Message.objects.get(message='pause please')
+        message.message = 'play please'
+        message.save(update_fields=['message'])
+        self.assertEqual(search_messages(self.room, 'pause'), [])
+        self.assertEqual(len(search_messages(self.room, 'play')), 1)
+        
+        message.delete()
+        self.assertEqual(search_messages(self.room, 'play'), [])
+
+    def test_search_api_pages_and_checks_access(self):
+        url = reverse('rooms:room_search_api', args=[self.room.id])
+        self.client.force_login(self.member)
+        
+        first = self.client.get(url, {'q': 'trailer', 'limit': 2}).json()
+        self.assertEqual(len(first['results']), 2)
+        second = self.client.get(url, {'q': 'trailer', 'limit': 2, 'before': first['next_before']}).json()
+        self.assertEqual([r['message'] for r in second['results']], ['Watching the trailer now'])
+        self.assertIsNone(second['next_before'])
+        
+        self.assertEqual(self.client.get(url).status_code, 400)
+        self.client.force_login(User.objects.create_user('outsider', password='pass'))
+        self.assertEqual(self.client.get(url, {'q': 'trailer'}).status_code, 403)
+
+    
+    def test_search_pages_through_tied_timestamps(self):
+        tied = timezone.now() + timezone.timedelta(minutes=1)
+        for i in range(5):
+            Message.objects.create(room=self.room, user=self.member, message=f'encore {i}', created_at=tied)
+        url = reverse('rooms:room_search_api', args=[self.room.id])
+        self.client.force_login(self.member)
+        
+        for fts5 in (True, False):
+            with patch('rooms.search.sqlite_fts5_available', return_value=fts5):
+                seen, params = [], {'q': 'encore', 'limit': 2}
+                while True:
+                    page = self.client.get(url, params).json()
+                    seen += [r['message'] for r in page['results']]
+                    if page['next_before'] is None:
+                        break
+                    params.update(before=page['next_before'], before_id=page['next_before_id'])
+                self.assertEqual(sorted(seen), [f'encore {i}' for i in range(5)])
+        self.assertEqual(self.client.get(url, {'q': 'encore', 'before_id': 'nope', 'before': tied.isoformat()}).status_code, 400)
+
+class SyncTelemetryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('viewer', password='pass')
+        cls.room = Room.objects.create(name='Telemetry room', creator=cls.user)
+
+    def record(self, ingester, created_at, latency_ms, drift_ms=None):
+        ingester.record(
+            room_id=self.room.id, user_id=self.user.id, action='sync',
+            client_timestamp=0, server_timestamp=0, latency_ms=latency_ms, drift_ms=drift_ms,
+        )
+        ingester._buffer[-1].created_at = created_at
+
+    def test_ingester_writes_in_batches(self):
+        ingester = SyncEventIngester(batch_size=3, flush_interval=60)
+        now = timezone.now()
+        for latency in (10, 20):
+            self.record(ingester, now, latency)
+        self.assertFalse(ingester.flush_due())
+        self.record(ingester, now, 30)
+        self.assertTrue(ingester.flush_due())
+        
+        with self.assertNumQueries(1):
+            self.assertEqual(ingester.flush(), 3)
+        self.assertEqual(ingester.pending(), 0)
+        self.assertEqual(VideoSyncData.objects.count(), 3)
+
+    def test_ingester_keeps_newest_events_when_full(self):
+        ingester = SyncEventIngester(batch_size=100, flush_interval=60, max_buffer=2)
+        for latency in (1, 2, 3):
+            self.record(ingester, timezone.now(), latency)
+        self.assertEqual([event.latency_ms for event in ingester._buffer], [2, 3])
+        self.assertEqual(ingester.dropped, 1)
+
+    def test_rollup_and_prune(self):
+        ingester = SyncEventIngester(batch_size=1000, flush_interval=60)
+        now = timezone.now().replace(minute=30)
+        old_hour = now - timezone.timedelta(hours=30)
+        for i in range(1, 101):
+            self.record(ingester, old_hour, latency_ms=i, drift_ms=-i)
+        self.record(ingester, old_hour + timezone.timedelta(hours=1), latency_ms=5)
+        self.record(ingester, now, latency_ms=5)
+        ingester.flush()
+        
+        self.assertEqual(rollup_sync_data(now=now), 2)
+        summary = RoomSyncSummary.objects.order_by('period_start').first()
+        self.assertEqual(summary.samples, 100)
+        self.assertEqual((summary.latency_p50, summary.latency_p95, summary.latency_p99), (50, 95, 99))
+        self.assertEqual(summary.drift_p99, 99)
+        
+        # Re-running only recomputes the newest summarized hour.
+        self.assertEqual(rollup_sync_data(now=now), 1)
+        self.assertEqual(RoomSyncSummary.objects.count(), 2)
+        
+        # Raw events of the newest summarized hour stay for the next rollup.
+        self.assertEqual(prune_sync_data(now=now, chunk_size=30), 100)
+        self.assertEqual(VideoSyncData.objects.count(), 2)
+
+    @override_settings(SYNC_DATA_RETENTION_HOURS=1, SYNC_ROLLUP_LOOKBACK_HOURS=6)
+    def test_rollup_counts_events_flushed_late(self):
+        ingester = SyncEventIngester(batch_size=1000, flush_interval=60)
+        now = timezone.now().replace(minute=30)
+        self.record(ingester, now - timezone.timedelta(hours=1), latency_ms=10)
+        ingester.flush()
+        self.assertEqual(rollup_sync_data(now=now), 1)
+        
+        # An earlier hour's event arrives after the later hour was summarized.
+        self.record(ingester, now - timezone.timedelta(hours=3), latency_ms=20)
+        ingester.flush()
+        self.assertEqual(prune_sync_data(now=now), 0)
+        self.assertEqual(rollup_sync_data(now=now), 2)
+        self.assertEqual(
+            list(RoomSyncSummary.objects.order_by('period_start').values_list('samples', 'latency_p50')),
+            [(1, 20), (1, 10)],
+        )
+
+
+class MessageIdTests(SimpleTestCase):
+    def test_uuid7_ids_are_time_ordered(self):
+        ids = []
+        for _ in range(5):
+            ids.append(uuid7())
+            time.sleep(0.002)
+        self.assertEqual(sorted(ids), ids)
+        self.assertEqual({(value.version, value.variant) for value in ids}, {(7, uuid.RFC_4122)})
+        # The first 48 bits are the creation time in milliseconds.
+        self.assertAlmostEqual(ids[-1].int >> 80, time.time() * 1000, delta=1000)
+
+
+class ClockModelTests(SimpleTestCase):
+    def test_offset_from_lowest_rtt_sample(self):
+        clock = ClockModel()
+        self.assertIsNone(clock.estimate(now=100))
+        # Server clock is 2 s ahead; the second sample was queued for 0.4 s
+        # on the way back, which skews its offset.
+        clock.add_sample(10.0, 12.05, 12.06, 10.11, now=100)
+        clock.add_sample(20.0, 22.05, 22.06, 20.51, now=100)
+        offset, rtt = clock.estimate(now=100)
+        self.assertAlmostEqual(offset, 2.0)
+        self.assertAlmostEqual(rtt, 0.1)
+        self.assertAlmostEqual(clock.to_server_time(30.0, now=100), 32.0)
+
+    def test_pong_completes_pending_ping(self):
+        clock = ClockModel()
+        clock.ping_received(10.0, 12.05, 12.06)
+        self.assertIsNone(clock.pong_acknowledged(11.0, 11.2, now=100))
+        rtt, offset = clock.pong_acknowledged(10.0, 10.11, now=100)
+        self.assertAlmostEqual(offset, 2.0)
+        self.assertIsNone(clock.pong_acknowledged(10.0, 10.11, now=100))
+
+    def test_rejects_impossible_samples_and_expires_old_ones(self):
+        clock = ClockModel(window_seconds=60)
+        self.assertIsNone(clock.add_sample(10.0, 12.0, 12.5, 10.1, now=100))
+        clock.add_sample(10.0, 12.05, 12.06, 10.11, now=100)
+        self.assertIsNotNone(clock.estimate(now=150))
+        self.assertIsNone(clock.estimate(now=161))
+        self.assertEqual(clock.as_dict(now=161), {'clock_offset': None, 'rtt': None, 'clock_samples': 0})
+
+
+WORKERS = {'a': 'ws://worker-a', 'b': 'ws://worker-b', 'c': 'ws://worker-c'}
+
+
+@override_settings(ROOM_WORKERS=WORKERS, ROOM_WORKER_ID='a', ROOM_WORKER_HEARTBEAT_INTERVAL=3600)
+class RoomRoutingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def beat_as(self, worker_id):
+        with self.settings(ROOM_WORKER_ID=worker_id):
+            RoomRouter().beat({'worker_id': worker_id}, [])
+
+    def test_ring_moves_only_a_new_workers_share(self):
+        rooms = [f'room-{i}' for i in range(3000)]
+        before = HashRing(['a', 'b', 'c'])
+        after = HashRing(['a', 'b', 'c', 'd'])
+        moved = [room for room in rooms if before.node_for(room) != after.node_for(room)]
+        self.assertTrue(all(after.node_for(room) == 'd' for room in moved))
+        self.assertLess(len(moved), len(rooms) * 0.35)
+        self.assertEqual(HashRing(['c', 'b', 'a']).node_for('room-1'), before.node_for('room-1'))
+
+    def test_ring_holds_only_live_workers_and_honours_pins(self):
+        self.beat_as('b')
+        router = RoomRouter()
+        local = router.beat({'worker_id': 'a'}, ['room-1', 'room-2'])
+        self.assertEqual(router.ring.nodes, {'a', 'b'})
+        self.assertEqual(sorted(local), sorted(room for room in ['room-1', 'room-2'] if router.owner(room) == 'b'))
+        
+        pin_room('room-1', 'b')
+        self.assertEqual(router.owner('room-1', router.get_pin('room-1')), 'b')
+        # A pin to a worker without a heartbeat is ignored.
+        self.assertEqual(router.owner('room-1', 'c'), router.ring.node_for('room-1'))
+
+    @override_settings(ROOM_WORKERS={})
+    def test_everything_is_local_without_workers(self):
+        self.assertTrue(RoomRouter().is_local('room-1', 'b'))
+
+    async def test_consumer_sends_client_to_owner(self):
+        user = await User.objects.acreate_user('viewer', password='pass')
+        room = await Room.objects.acreate(name='Routed', creator=user)
+        await sync_to_async(self.beat_as)('b')
+        await sync_to_async(pin_room)(room.id, 'b')
+        
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/room/{room.id}/')
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(
+            await communicator.receive_json_from(),
+            {'type': 'room_moved', 'worker_id': 'b', 'url': 'ws://worker-b'},
+        )
+        self.assertEqual((await communicator.receive_output())['code'], ROOM_MOVED_CLOSE_CODE)
+        await room_router.stop()
+        self.assertFalse(await Participant.objects.filter(room=room, user=user).aexists())
+
+    @override_settings(ROOM_ACTOR_IDLE_TIMEOUT=0)
+    async def test_handoff_saves_state_and_moves_clients(self):
+        user = await User.objects.acreate_user('viewer', password='pass')
+        room = await Room.objects.acreate(name='Routed', creator=user)
+        await sync_to_async(pin_room)(room.id, 'a')
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/room/{room.id}/')
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual((await communicator.receive_json_from())['type'], 'user_joined')
+        await communicator.send_json_to({'type': 'video_control', 'action': 'play', 'timestamp': 7})
+        self.assertEqual((await communicator.receive_json_from())['type'], 'video_control')
+        
+        # Worker b comes up and the room is moved to it.
+        await sync_to_async(self.beat_as)('b')
+        await sync_to_async(pin_room)(room.id, 'b')
+        await room_router.abeat()
+        self.assertEqual((await communicator.receive_json_from())['type'], 'room_moved')
+        self.assertEqual((await communicator.receive_output())['code'], ROOM_MOVED_CLOSE_CODE)
+        await communicator.disconnect()
+        await room_router.stop()
+        
+        room = await Room.objects.aget(id=room.id)
+        self.assertEqual((room.video_state, room.video_timestamp), ('play', 7))
+        self.assertTrue((await Participant.objects.aget(room=room, user=user)).is_online)
+
+    def test_workers_api(self):
+        user = User.objects.create_user('ops', password='pass')
+        room = Room.objects.create(name='Hot', creator=user)
+        self.client.force_login(user)
+        url = reverse('rooms:room_workers_api')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        
+        User.objects.filter(pk=user.pk).update(is_staff=True)
+        self.beat_as('b')
+        workers = self.client.get(url).json()['workers']
+        self.assertEqual(workers['b']['worker_id'], 'b')
+        self.assertIsNone(workers['c'])
+        
+        response = self.client.post(url, {'room_id': str(room.id), 'worker_id': 'c'}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(RoomRouter().get_pin(room.id), 'c')
+        response = self.client.post(url, {'room_id': str(room.id), 'worker_id': 'z'}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(ROOM_ACTOR_IDLE_TIMEOUT=0, ROOM_WORKERS={})
+    async def test_health_reports_this_workers_rooms(self):
+        user = await User.objects.acreate_user('viewer', password='pass')
+        room = await Room.objects.acreate(name='Watched', creator=user)
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/room/{room.id}/')
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        
+        response = await self.async_client.get(reverse('health'))
+        self.assertEqual(response.status_code, 200)
+        health = response.json()
+        self.assertEqual((health['status'], health['worker_id']), ('ok', 'a'))
+        self.assertEqual((health['rooms'], health['connections']), (1, 1))
+        await communicator.disconnect()
+
+
+@override_settings(ROOM_ACTOR_IDLE_TIMEOUT=0, ROOM_ACTOR_SNAPSHOT_INTERVAL=3600)
+class WorkerDrainTests(TestCase):
+    def setUp(self):
+        self.addCleanup(setattr, worker_drain, 'draining', False)
+
+    async def connect(self, user, room):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/room/{room.id}/')
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def receive_type(self, communicator, message_type):
+        while True:
+            message = await communicator.receive_json_from()
+            if message['type'] == message_type:
+                return message
+
+    async def test_drain_saves_state_and_closes_clients_in_waves(self):
+        creator = await User.objects.acreate_user('creator', password='pass')
+        viewer = await User.objects.acreate_user('viewer', password='pass')
+        room = await Room.objects.acreate(name='Draining', creator=creator)
+        first = await self.connect(creator, room)
+        second = await self.connect(viewer, room)
+        await first.send_json_to({'type': 'video_control', 'action': 'play', 'timestamp': 42})
+        await self.receive_type(first, 'video_control')
+        
+        await worker_drain.drain(waves=2, interval=0)
+        hints = [(await self.receive_type(client, 'reconnect'))['retry_in'] for client in (first, second)]
+        self.assertTrue(all(hint >= 0 for hint in hints))
+        for client in (first, second):
+            self.assertEqual((await client.receive_output())['code'], SERVICE_RESTART_CLOSE_CODE)
+            await client.disconnect()
+        
+        room = await Room.objects.aget(id=room.id)
+        self.assertEqual((room.video_state, room.video_timestamp), ('play', 42))
+        # Drained clients are reconnecting, so they stay online until their
+        # reconnect deadline.
+        self.assertEqual(
+            await Participant.objects.filter(room=room, is_online=True, reconnect_deadline__isnull=False).acount(), 2
+        )
+        self.assertFalse(worker_drain.consumers)
+
+    @override_settings(ROOM_PRESENCE_SWEEP_INTERVAL=0.05)
+    async def test_clients_that_never_reconnect_are_swept_offline(self):
+        cache.delete(SWEEP_LOCK_KEY)
+        creator = await User.objects.acreate_user('creator', password='pass')
+        viewer = await User.objects.acreate_user('viewer', password='pass')
+        room = await Room.objects.acreate(name='Draining', creator=creator)
+        clients = [await self.connect(creator, room), await self.connect(viewer, room)]
+        await worker_drain.drain(waves=1, interval=0)
+        worker_drain.draining = False
+        for client in clients:
+            await client.disconnect()
+        
+        # Only the creator comes back; the viewer's deadline passes.
+        returned = await self.connect(creator, room)
+        self.assertIsNone((await Participant.objects.aget(room=room, user=creator)).reconnect_deadline)
+        await Participant.objects.filter(user=viewer).aupdate(
+            reconnect_deadline=timezone.now() - timezone.timedelta(seconds=1)
+        )
+        
+        left = await self.receive_type(returned, 'user_left')
+        self.assertEqual(left['username'], 'viewer')
+        viewer_participant = await Participant.objects.aget(room=room, user=viewer)
+        self.assertEqual((viewer_participant.is_online, viewer_participant.reconnect_deadline), (False, None))
+        self.assertFalse((await User.objects.aget(pk=viewer.pk)).is_online)
+        self.assertTrue(await Participant.objects.filter(room=room, user=creator, is_online=True).aexists())
+        await returned.disconnect()
+
+    async def test_tab_refused_while_draining_leaves_the_open_tab_online(self):
+        cache.delete(SWEEP_LOCK_KEY)
+        user = await User.objects.acreate_user('viewer', password='pass')
+        room = await Room.objects.acreate(name='Draining', creator=user)
+        first = await self.connect(user, room)
+        worker_drain.draining = True
+        
+        second = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/room/{room.id}/')
+        second.scope['user'] = user
+        connected, code = await second.connect()
+        self.assertEqual((connected, code), (False, SERVICE_RESTART_CLOSE_CODE))
+        await second.disconnect()
+        worker_drain.draining = False
+        participant = await Participant.objects.aget(room=room, user=user)
+        self.assertEqual((participant.is_online, participant.reconnect_deadline), (True, None))
+        
+        # A deadline left behind anyway doesn't take a connected user offline.
+        await Participant.objects.filter(pk=participant.pk).aupdate(
+            reconnect_deadline=timezone.now() - timezone.timedelta(seconds=1)
+        )
+        await room_actors.get(room.id).sweep_presence()
+        participant = await Participant.objects.aget(pk=participant.pk)
+        self.assertEqual((participant.is_online, participant.reconnect_deadline), (True, None))
+        await first.disconnect()
+
+    async def test_draining_worker_refuses_handshakes(self):
+        user = await User.objects.acreate_user('viewer', password='pass')
+        room = await Room.objects.acreate(name='Draining', creator=user)
+        worker_drain.draining = True
+        
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/room/{room.id}/')
+        communicator.scope['user'] = user
+        connected, code = await communicator.connect()
+        self.assertEqual((connected, code), (False, SERVICE_RESTART_CLOSE_CODE))
+        self.assertFalse(await Participant.objects.filter(room=room).aexists())
+        
+        response = await self.async_client.get(reverse('health'))
+        self.assertEqual((response.status_code, response.json()['status']), (503, 'draining'))
+
+
+class ServeCommandTests(SimpleTestCase):
+    def test_several_workers_need_a_shared_channel_layer(self):
+        with self.assertRaisesMessage(CommandError, 'need a shared channel layer'):
+            call_command('serve', workers=2)
+
+
+class LoadTestTests(TestCase):
+    async def test_in_process_run_reports_fanout_and_pings(self):
+        load_test = LoadTest(clients=4, rooms=2, duration=0.5, rate=20, mix={'chat': 1, 'ping': 1}, seed=1)
+        await sync_to_async(load_test.setup)()
+        self.assertEqual(await Room.objects.filter(name__startswith='Load test room').acount(), 2)
+        
+        report = await load_test.run()
+        self.assertEqual((report['connect']['connected'], report['connect']['failed']), (4, 0))
+        self.assertGreater(report['messages']['sent']['chat'], 0)
+        self.assertEqual(report['messages']['sent']['video_control'], 0)
+        # Each chat reaches the one other member of its room.
+        self.assertGreater(report['fanout_ms']['samples'], 0)
+        self.assertGreater(report['ping_rtt_ms']['samples'], 0)
+        self.assertFalse(report['messages']['errors'])
+        
+        await sync_to_async(load_test.teardown)()
+        self.assertFalse(await User.objects.filter(username__startswith='loadtest_').aexists())
+
+
+class DatasetGeneratorTests(TestCase):
+    until = timezone.make_aware(datetime(2024, 6, 1))
+    
+    def generate(self):
+        return DatasetGenerator(users=60, rooms=12, messages=500, sync_events=100, seed=7, until=self.until).run()
+
+    def test_generates_requested_counts_with_skew(self):
+        counts = self.generate()
+        self.assertEqual(
+            counts, {'customuser': 60, 'room': 12, 'participant': 180, 'message': 500, 'videosyncdata': 100}
+        )
+        sizes = sorted(Room.objects.annotate(n=Count('participants')).values_list('n', flat=True))
+        self.assertGreater(sizes[-1], 5 * sizes[len(sizes) // 2])
+        # Every creator is a moderating member of their room.
+        self.assertFalse(Room.objects.exclude(participants__user=F('creator'), participants__is_moderator=True).exists())
+        self.assertFalse(Message.objects.filter(created_at__gte=self.until).exists())
+
+    def test_same_seed_generates_the_same_rows(self):
+        self.generate()
+        first = list(Message.objects.order_by('id').values_list('id', 'room_id', 'message', 'user__username'))
+        User.objects.filter(username__startswith='synthetic_').delete()
+        
+        self.generate()
+        self.assertEqual(list(Message.objects.order_by('id').values_list('id', 'room_id', 'message', 'user__username')), first)
+
+
+class MessageArchiveTests(TestCase):
+    def setUp(self):
+        archive_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive_root)
+        settings_override = override_settings(MESSAGE_ARCHIVE_ROOT=archive_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+        
+        self.creator = User.objects.create_user('creator', password='pass')
+        self.member = User.objects.create_user('member', password='pass')
+        self.room = Room.objects.create(name='Archived', creator=self.creator)
+        Participant.objects.create(room=self.room, user=self.member)
+        
+        # Ties on purpose: five messages share one old timestamp and three
+        # share a recent one, so pages and parts split inside them.
+        today = timezone.make_aware(datetime.combine(timezone.localdate(), datetime.min.time()))
+        self.cutoff = today - timezone.timedelta(days=1)
+        times = [today - timezone.timedelta(days=3, hours=-1)] * 5 + [today - timezone.timedelta(days=2)] * 2
+        times += [timezone.now()] * 3
+        for i, created_at in enumerate(times):
+            message = Message.objects.create(room=self.room, user=(self.creator, self.member)[i % 2], message=f'message {i}')
+            Message.objects.filter(pk=message.pk).update(created_at=created_at)
+        self.newest_first = list(
+            Message.objects.filter(room=self.room).order_by('-created_at', '-id').values_list('id', flat=True)
+        )
+        UserStats.rebuild([self.creator.pk, self.member.pk])
+
+    def stats(self, user):
+        return UserStats.objects.values_list('total_messages', 'archived_messages').get(user=user)
+
+    def test_archive_moves_finished_days_into_parts(self):
+        self.assertEqual(archive_room_messages(self.room, cutoff=self.cutoff, part_size=3), 7)
+        archives = list(self.room.message_archives.order_by('day', 'part'))
+        self.assertEqual([(archive.part, archive.message_count) for archive in archives], [(0, 3), (1, 2), (0, 2)])
+        user_counts = Counter()
+        for archive in archives:
+            user_counts.update(archive.user_counts)
+        self.assertEqual(user_counts, {str(self.creator.pk): 4, str(self.member.pk): 3})
+        self.assertEqual(Message.objects.filter(room=self.room).count(), 3)
+        
+        archived_ids = [json.loads(line)['id'] for archive in archives for line in read_archive(archive)]
+        self.assertEqual(archived_ids, [str(pk) for pk in reversed(self.newest_first[3:])])
+        # Nothing left to archive.
+        self.assertEqual(archive_room_messages(self.room, cutoff=self.cutoff, part_size=3), 0)
+
+    def test_archived_messages_stay_in_user_stats(self):
+        archive_room_messages(self.room, cutoff=self.cutoff, part_size=3)
+        self.assertEqual(self.stats(self.creator), (5, 4))
+        self.assertEqual(self.stats(self.member), (5, 3))
+        
+        UserStats.rebuild([self.creator.pk, self.member.pk])
+        self.assertEqual(self.stats(self.creator), (5, 4))
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            Room.objects.get(pk=self.room.pk).delete()
+        self.assertEqual(self.stats(self.creator), (0, 0))
+        self.assertEqual(self.stats(self.member), (0, 0))
+        self.assertEqual(get_archive_storage().listdir(f'rooms/{self.room.id}')[1], [])
+
+    def test_history_pages_across_both_tiers_without_gaps(self):
+        archive_room_messages(self.room, cutoff=self.cutoff, part_size=3)
+        self.client.force_login(self.member)
+        url = reverse('rooms:room_history_api', args=[self.room.id])
+        
+        seen = []
+        params = {'limit': 2}
+        while True:
+            page = self.client.get(url, params).json()
+            seen += [message['id'] for message in page['messages']]
+            if not page['next_before']:
+                break
+            params.update(before=page['next_before'], before_id=page['next_before_id'])
+        self.assertEqual(seen, [str(pk) for pk in self.newest_first])
+        
+        response = self.client.get(url, {'before': timezone.now().isoformat(), 'before_id': 'nope'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_only_small_parts_are_cached(self):
+        archive_room_messages(self.room, cutoff=self.cutoff, part_size=3)
+        first, second = self.room.message_archives.order_by('day', 'part')[:2]
+        get_room_history(self.room, limit=10)
+        self.assertIsNotNone(cache.get(f'message_archive_blob_{first.pk}'))
+        
+        cache.clear()
+        with patch('rooms.archive.ARCHIVE_CACHE_MAX_BYTES', 0):
+            self.assertEqual(len(read_archive(second)), 2)
+        self.assertIsNone(cache.get(f'message_archive_blob_{second.pk}'))
+
+
+class RoomDeletionTests(TestCase):
+    def setUp(self):
+        archive_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive_root)
+        settings_override = override_settings(MESSAGE_ARCHIVE_ROOT=archive_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        
+        self.creator = User.objects.create_user('creator', password='pass')
+        self.members = [User.objects.create_user(f'member{i}', password='pass') for i in range(2)]
+        self.users = [self.creator, *self.members]
+        # Activity in another room, which the deletion must leave counted.
+        other_room = Room.objects.create(name='Other room', creator=self.members[0])
+        Participant.objects.create(room=other_room, user=self.creator)
+        Message.objects.create(room=other_room, user=self.creator, message='elsewhere')
+        UserStats.rebuild([user.pk for user in self.users])
+        self.stats_before = self.stats()
+        
+        self.room = Room.objects.create(name='Doomed', creator=self.creator)
+        for user in self.users:
+            Participant.objects.create(room=self.room, user=user)
+        for i in range(7):
+            Message.objects.create(room=self.room, user=self.users[i % 3], message=f'message {i}')
+        old = timezone.now() - timezone.timedelta(days=3)
+        Message.objects.filter(message__in=['message 0', 'message 1', 'message 2']).update(created_at=old)
+        archive_room_messages(self.room, cutoff=timezone.now() - timezone.timedelta(days=1))
+        ScreenSession.objects.create(room=self.room, user=self.creator)
+        VideoSyncData.objects.create(room=self.room, user=self.creator, action='play', client_timestamp=0, server_timestamp=0)
+        self.archive_path = MessageArchive.objects.get(room=self.room).path
+        self.job = self.room.hard_delete(self.creator)
+
+    def stats(self):
+        rows = UserStats.objects.filter(user__in=self.users).values_list(
+            'user_id', 'total_messages', 'rooms_created', 'rooms_joined', 'archived_messages'
+        )
+        return {user_id: counts for user_id, *counts in rows}
+
+    def assert_room_gone(self):
+        self.assertFalse(Room.objects.filter(id=self.room.id).exists())
+        for model in (Participant, Message, MessageArchive, ScreenSession, VideoSyncData):
+            self.assertFalse(model.objects.filter(room_id=self.room.id).exists(), model.__name__)
+        self.assertFalse(get_archive_storage().exists(self.archive_path))
+        self.assertEqual(self.stats(), self.stats_before)
+
+    def test_deletes_in_chunks_and_restores_user_stats(self):
+        with patch('rooms.deletion.settle_chunk', wraps=settle_chunk) as settle, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(process_room_deletion(self.job.pk, chunk_size=2))
+        self.assertEqual([call.args[0] for call in settle.call_args_list], [
+            'participants', 'participants', 'messages', 'messages', 'message_archives', 'screen_sessions', 'sync_data',
+        ])
+        
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.stage, self.job.attempts), ('done', '', 1))
+        self.assertEqual(self.job.deleted_counts, {
+            'participants': 3, 'messages': 4, 'message_archives': 1, 'screen_sessions': 1, 'sync_data': 1, 'room': 1,
+        })
+        self.assert_room_gone()
+
+    def test_failed_job_resumes_where_it_stopped(self):
+        message_chunks = []
+        
+        def fail_on_second_message_chunk(stage, *args):
+            if stage == 'messages':
+                message_chunks.append(args)
+                if len(message_chunks) == 2:
+                    raise RuntimeError('connection lost')
+            settle_chunk(stage, *args)
+        
+        with patch('rooms.deletion.settle_chunk', side_effect=fail_on_second_message_chunk), \
+                self.assertLogs('rooms.deletion', 'ERROR'):
+            self.assertFalse(process_room_deletion(self.job.pk, chunk_size=2))
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.stage, self.job.last_error), ('failed', 'messages', 'connection lost'))
+        self.assertEqual(self.job.deleted_counts, {'participants': 3, 'messages': 2})
+        self.assertEqual(Message.objects.filter(room_id=self.room.id).count(), 2)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(process_room_deletion(self.job.pk, chunk_size=2))
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.attempts, self.job.last_error), ('done', 2, ''))
+        self.assertEqual(self.job.deleted_counts['messages'], 4)
+        self.assert_room_gone()
+
+    def test_rolled_back_chunk_keeps_its_archive_files(self):
+        def fail_after_settling_archives(stage, *args):
+            settle_chunk(stage, *args)
+            if stage == 'message_archives':
+                raise RuntimeError('connection lost')
+        
+        with patch('rooms.deletion.settle_chunk', side_effect=fail_after_settling_archives), \
+                self.assertLogs('rooms.deletion', 'ERROR'), self.captureOnCommitCallbacks(execute=True):
+            self.assertFalse(process_room_deletion(self.job.pk))
+        self.assertTrue(MessageArchive.objects.filter(room_id=self.room.id).exists())
+        self.assertTrue(get_archive_storage().exists(self.archive_path))
+
+    def test_claims_pending_failed_and_stale_jobs(self):
+        self.assertEqual(list(claimable_jobs()), [self.job])
+        RoomDeletionJob.objects.filter(pk=self.job.pk).update(status='failed')
+        self.assertEqual(list(claimable_jobs()), [self.job])
+        
+        # A running job is left to its worker until it stops making progress.
+        RoomDeletionJob.objects.filter(pk=self.job.pk).update(status='running', updated_at=timezone.now())
+        self.assertFalse(process_room_deletion(self.job.pk))
+        self.assertTrue(Room.objects.filter(id=self.room.id).exists())
+        
+        stale = timezone.now() - STALE_JOB_AFTER - timezone.timedelta(minutes=1)
+        RoomDeletionJob.objects.filter(pk=self.job.pk).update(updated_at=stale)
+        self.assertTrue(process_room_deletion(self.job.pk))
+        self.assertFalse(claimable_jobs().exists())
+        self.assertFalse(process_room_deletion(self.job.pk))
+
+    def test_process_room_deletions_command(self):
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('process_room_deletions', chunk_size=2, stdout=out)
+        self.assertIn(f'Finished deletion job {self.job.pk}', out.getvalue())
+        self.assert_room_gone()
+        
+        out = StringIO()
+        call_command('process_room_deletions', stdout=out)
+        self.assertEqual(out.getvalue(), '')
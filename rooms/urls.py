@@ -13,7 +13,12 @@ urlpatterns = [
     path('<uuid:room_id>/edit/', views.edit_room, name='edit_room'),
     path('<uuid:room_id>/delete/', views.delete_room, name='delete_room'),
     path('<uuid:room_id>/leave/', views.leave_room, name='leave_room'),
+    path('api/db-pool/', views.db_pool_stats_api, name='db_pool_stats_api'),
+    path('api/cache/', views.cache_stats_api, name='cache_stats_api'),
+    path('api/workers/', views.room_workers_api, name='room_workers_api'),
     path('api/<uuid:room_id>/state/', views.room_state_api, name='room_state_api'),
+    path('api/<uuid:room_id>/history/', views.room_history_api, name='room_history_api'),
+    path('api/<uuid:room_id>/search/', views.room_search_api, name='room_search_api'),
     path('api/<uuid:room_id>/video-state/', views.update_video_state_api, name='update_video_state_api'),
     path('<uuid:room_id>/messages/<uuid:message_id>/delete/', views.delete_message, name='delete_message'),    
     path('<uuid:room_id>/users/<int:user_id>/mute/', views.mute_user, name='mute_user'),
@@ -24,4 +29,5 @@ urlpatterns = [
     path('<uuid:room_id>/users/<int:user_id>/kick/', views.kick_user, name='kick_user'),
     path('<uuid:room_id>/users/<int:user_id>/ban/', views.ban_user, name='ban_user'),
     path('<uuid:room_id>/users/<int:user_id>/unban/', views.unban_user, name='unban_user'),
+    path('<uuid:room_id>/users/bulk-moderate/', views.bulk_moderate_users, name='bulk_moderate_users'),
 ]
\ No newline at end of file
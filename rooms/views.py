@@ -1,10 +1,22 @@
-from django.shortcuts import render, get_object_or_404, redirect
+from django.shortcuts import render, get_object_or_404, aget_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse, HttpResponseForbidden
 from django.views.decorators.http import require_http_methods, require_POST
 from django.contrib import messages
 from .models import Room, Participant, Message
+from users.models import UserStats
 from .forms import RoomForm
+from .caching import (
+    get_room_state_snapshot, get_directory_version, get_home_rooms, annotate_room_counts,
+    bump_room_state_version, bump_directory_version, DIRECTORY_CACHE_TIMEOUT,
+)
+from .events import dispatch_group_events, send_group_events
+from .archive import get_room_history
+from .search import search_messages
+from .workers import get_workers, get_worker_loads, pin_room, worker_health
+from syncstream_project.db_routers import prefer_replica, replica_cache_timeout
+from syncstream_project.db_pool import get_pool_stats
+from syncstream_project.cache import get_cache_stats
 import json
 import logging
 from django.views.decorators.csrf import csrf_exempt
@@ -13,17 +25,40 @@ from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 from django.contrib.auth import get_user_model
 from uuid import UUID
-from django.db.models import Q, Count
+from django.db import transaction
+from django.core.exceptions import ValidationError
+from django.db.models import Q, F
 from django.core.paginator import Paginator
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.functional import SimpleLazyObject
+from django.utils.dateparse import parse_datetime
 import traceback
 
 logger = logging.getLogger(__name__)
 
 User = get_user_model()
 
+ROOM_STATE_PUBLIC_MAX_AGE = 2
+DIRECTORY_PUBLIC_MAX_AGE = 30
+BULK_MODERATION_ACTIONS = ('mute', 'unmute', 'kick', 'ban', 'unban')
+MAX_BULK_MODERATION_USERS = 200
+MAX_HISTORY_PAGE_SIZE = 100
+MAX_SEARCH_PAGE_SIZE = 50
+MAX_SEARCH_QUERY_LENGTH = 200
+
+def cache_for_anonymous(request, response):
+    if not request.user.is_authenticated and not len(messages.get_messages(request)):
+        patch_cache_control(response, public=True, max_age=DIRECTORY_PUBLIC_MAX_AGE)
+    return response
+
+@prefer_replica
 def home(request):
-    rooms = Room.objects.filter(is_active=True, is_private=False)
-    return render(request, 'rooms/home.html', {'rooms': rooms})
+    response = render(request, 'rooms/home.html', {
+        'rooms': SimpleLazyObject(get_home_rooms),
+        'directory_version': get_directory_version(),
+        'directory_cache_timeout': replica_cache_timeout(DIRECTORY_CACHE_TIMEOUT),
+    })
+    return cache_for_anonymous(request, response)
 
 
 def youre_banned(request):
@@ -35,13 +70,14 @@ def youre_banned(request):
         'banned_by': banned_by
     })
 
+@prefer_replica
 def room_list(request):
     search_query = request.GET.get('q', '')
     privacy_filter = request.GET.get('privacy', 'all')
     sort_by = request.GET.get('sort', 'newest')
     page_number = request.GET.get('page', 1)
     
-    rooms = Room.objects.filter(is_active=True)
+    rooms = annotate_room_counts(Room.objects.filter(is_active=True))
     
     if search_query:
         rooms = rooms.filter(
@@ -60,22 +96,28 @@ def room_list(request):
     elif sort_by == 'oldest':
         rooms = rooms.order_by('created_at')
     elif sort_by == 'most_popular':
-        rooms = rooms.annotate(participant_count=Count('participants')).order_by('-participant_count')
+        rooms = rooms.order_by('-participant_count')
     elif sort_by == 'most_active':
-        rooms = rooms.annotate(online_count=Count('participants', filter=Q(participants__is_online=True))).order_by('-online_count')
+        rooms = rooms.order_by('-online_count')
     
     paginator = Paginator(rooms, 12)
-    page_obj = paginator.get_page(page_number)
+    # The results are rendered inside a fragment cache, so only hit the
+    # database when that fragment actually has to be rebuilt.
+    page_obj = SimpleLazyObject(lambda: paginator.get_page(page_number))
     
     context = {
         'rooms': page_obj,
         'search_query': search_query,
         'privacy_filter': privacy_filter,
         'sort_by': sort_by,
+        'page_number': page_number,
         'page_obj': page_obj,
+        'directory_version': get_directory_version(),
+        'directory_cache_timeout': replica_cache_timeout(DIRECTORY_CACHE_TIMEOUT),
     }
     
-    return render(request, 'rooms/room_list.html', context)
+    response = render(request, 'rooms/room_list.html', context)
+    return cache_for_anonymous(request, response)
 
 @login_required
 def join_by_password(request):
@@ -95,7 +137,7 @@ def join_by_password(request):
                 
                 if not created:
                     participant.is_online = True
-                    participant.save()
+                    participant.save(update_fields=['is_online'])
                 
                 messages.success(request, f'Successfully joined room "{room.name}"')
                 return redirect('rooms:room_detail', room_id=room.id)
@@ -110,7 +152,7 @@ def join_by_password(request):
 
 @login_required
 def room_detail(request, room_id):
-    room = get_object_or_404(Room, id=room_id)
+    room = get_object_or_404(Room.objects.select_related('creator'), id=room_id)
     
     if not room.is_active:
         if room.creator == request.user:
@@ -154,9 +196,10 @@ def room_detail(request, room_id):
     
     if not created:
         participant.is_online = True
-        participant.save()
+        participant.save(update_fields=['is_online'])
     
-    messages_list = Message.objects.filter(room=room).order_by('created_at')[:50]
+    messages_list = Message.objects.filter(room=room).select_related('user').order_by('created_at')[:50]
+    participants = list(room.participants.select_related('user'))
     
     invite_info = None
     if room.creator == request.user:
@@ -165,6 +208,8 @@ def room_detail(request, room_id):
     return render(request, 'rooms/room_detail.html', {
         'room': room,
         'messages': messages_list,
+        'participants': participants,
+        'online_count': sum(1 for p in participants if p.is_online),
         'user': request.user,
         'invite_info': invite_info,
         'isRoomCreator': room.creator == request.user,
@@ -244,8 +289,8 @@ def delete_room(request, room_id):
         
         if permanent:
             room_name = room.name
-            room.hard_delete()
-            messages.success(request, f'Room "{room_name}" has been permanently deleted!')
+            room.hard_delete(request.user)
+            messages.success(request, f'Room "{room_name}" is being permanently deleted!')
         else:
             room_name = room.name
             room.delete()
@@ -263,7 +308,7 @@ def leave_room(request, room_id):
     try:
         participant = Participant.objects.get(room=room, user=request.user)
         participant.is_online = False
-        participant.save()
+        participant.save(update_fields=['is_online'])
         messages.info(request, f'You left the room "{room.name}"')
     except Participant.DoesNotExist:
         pass
@@ -272,13 +317,12 @@ def leave_room(request, room_id):
 
 @login_required
 def user_rooms(request):
-    created_rooms = Room.objects.filter(creator=request.user)
+    created_rooms = annotate_room_counts(Room.objects.filter(creator=request.user, is_active=True))
     
-    participant_rooms = Room.objects.filter(
-        participants__user=request.user, 
-        participants__is_online=True,
+    participant_rooms = annotate_room_counts(Room.objects.filter(
+        id__in=Participant.objects.filter(user=request.user, is_online=True).values('room_id'),
         is_active=True
-    ).exclude(creator=request.user).distinct()
+    ).exclude(creator=request.user))
     
     return render(request, 'rooms/user_rooms.html', {
         'created_rooms': created_rooms,
@@ -287,54 +331,168 @@ def user_rooms(request):
 
 @csrf_exempt
 @require_http_methods(["GET"])
+@prefer_replica
 def room_state_api(request, room_id):
     try:
-        room = Room.objects.get(id=room_id, is_active=True)
+        snapshot = get_room_state_snapshot(room_id)
+        if snapshot is None:
+            return JsonResponse({'error': 'Room not found'}, status=404)
         
-        if room.is_private and not request.user.is_authenticated:
+        is_private = snapshot['room']['is_private']
+        if is_private and not request.user.is_authenticated:
             return JsonResponse({'error': 'Authentication required'}, status=401)
         
-        if room.is_private and room.password and not request.user.is_authenticated:
-            return JsonResponse({'error': 'Password required'}, status=403)
-        
-        data = {
-            'room': {
-                'id': str(room.id),
-                'name': room.name,
-                'creator': room.creator.username,
-                'video_state': room.get_video_state(),
-                'participants_count': room.participants.count(),
-                'online_count': room.get_online_users_count(),
-                'is_private': room.is_private
-            },
-            'participants': room.get_participants_info(),
-            'messages': [
-                {
-                    'id': str(msg.id),
-                    'user': msg.user.username,
-                    'message': msg.message,
-                    'type': msg.message_type,
-                    'timestamp': msg.created_at.isoformat()
-                }
-                for msg in room.messages.all().order_by('-created_at')[:20]
-            ]
-        }
+        etag = f'"{room_id}-{snapshot["version"]}"'
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = JsonResponse(snapshot)
         
-        return JsonResponse(data)
+        response.headers['ETag'] = etag
+        if is_private:
+            patch_cache_control(response, private=True, no_cache=True)
+        else:
+            patch_cache_control(response, public=True, max_age=ROOM_STATE_PUBLIC_MAX_AGE)
+        return response
         
-    except Room.DoesNotExist:
-        return JsonResponse({'error': 'Room not found'}, status=404)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+def can_read_messages(room, user):
+    if not room.is_private or room.creator_id == user.id:
+        return True
+    return Participant.objects.filter(room=room, user=user, is_banned=False).exists()
+
+@require_http_methods(["GET"])
+@login_required
+@prefer_replica
+def room_history_api(request, room_id):
+    room = get_object_or_404(Room, id=room_id, is_active=True)
+    
+    if not can_read_messages(room, request.user):
+        return JsonResponse({'error': 'Not a participant'}, status=403)
+    
+    before = None
+    if request.GET.get('before'):
+        before = parse_datetime(request.GET['before'])
+        if before is None:
+            return JsonResponse({'error': 'Invalid before timestamp'}, status=400)
+    
+    before_id = None
+    if request.GET.get('before_id'):
+        try:
+            before_id = UUID(request.GET['before_id'])
+        except ValueError:
+            return JsonResponse({'error': 'Invalid before_id'}, status=400)
+    
+    try:
+        limit = min(int(request.GET.get('limit', 50)), MAX_HISTORY_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid limit'}, status=400)
+    
+    history = get_room_history(room, before=before, before_id=before_id, limit=limit)
+    last = history[-1] if len(history) == limit else None
+    
+    return JsonResponse({
+        'messages': history,
+        'next_before': last and last['created_at'],
+        'next_before_id': last and last['id'],
+    })
+
+@require_http_methods(["GET"])
+@login_required
+@prefer_replica
+def room_search_api(request, room_id):
+    room = get_object_or_404(Room, id=room_id, is_active=True)
+    
+    if not can_read_messages(room, request.user):
+        return JsonResponse({'error': 'Not a participant'}, status=403)
+    
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return JsonResponse({'error': 'Missing search query'}, status=400)
+    if len(query) > MAX_SEARCH_QUERY_LENGTH:
+        return JsonResponse({'error': 'Search query too long'}, status=400)
+    
+    before = None
+    if request.GET.get('before'):
+        before = parse_datetime(request.GET['before'])
+        if before is None:
+            return JsonResponse({'error': 'Invalid before timestamp'}, status=400)
+    
+    before_id = None
+    if request.GET.get('before_id'):
+        try:
+            before_id = UUID(request.GET['before_id'])
+        except ValueError:
+            return JsonResponse({'error': 'Invalid before_id'}, status=400)
+    
+    try:
+        limit = min(int(request.GET.get('limit', 20)), MAX_SEARCH_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid limit'}, status=400)
+    
+    results = search_messages(room, query, before=before, before_id=before_id, limit=limit)
+    last = results[-1] if len(results) == limit else None
+    
+    return JsonResponse({
+        'results': results,
+        'next_before': last and last['created_at'],
+        'next_before_id': last and last['id'],
+    })
+
+@require_http_methods(["GET"])
+@login_required
+def db_pool_stats_api(request):
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Staff only'}, status=403)
+    
+    return JsonResponse({'pools': get_pool_stats()})
+
+@require_http_methods(["GET"])
+@login_required
+def cache_stats_api(request):
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Staff only'}, status=403)
+    
+    return JsonResponse({'caches': get_cache_stats()})
+
+@require_http_methods(["GET", "POST"])
+@login_required
+def room_workers_api(request):
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Staff only'}, status=403)
+    
+    if request.method == 'POST':
+        try:
+            data = json.loads(request.body)
+            room = Room.objects.get(id=data.get('room_id'))
+        except (json.JSONDecodeError, ValidationError, Room.DoesNotExist):
+            return JsonResponse({'error': 'Unknown room'}, status=400)
+        worker_id = data.get('worker_id')
+        if worker_id is not None and worker_id not in get_workers():
+            return JsonResponse({'error': 'Unknown worker'}, status=400)
+        pin_room(room.id, worker_id)
+        return JsonResponse({'status': 'success', 'room_id': str(room.id), 'worker_id': worker_id})
+    
+    return JsonResponse({'workers': get_worker_loads()})
+
+@require_http_methods(["GET"])
+async def health(request):
+    # Unauthenticated liveness check for the process supervisor and load
+    # balancer; async so it runs on the loop that owns the room actors. A
+    # draining worker answers 503 so no new traffic is sent to it.
+    health = worker_health()
+    return JsonResponse(health, status=503 if health['status'] == 'draining' else 200)
+
 @csrf_exempt
 @require_http_methods(["POST"])
 @login_required
-def update_video_state_api(request, room_id):
+async def update_video_state_api(request, room_id):
     try:
-        room = Room.objects.get(id=room_id, is_active=True)
+        user = await request.auser()
+        room = await Room.objects.aget(id=room_id, is_active=True)
         
-        if not room.participants.filter(user=request.user, is_online=True).exists():
+        if not await room.participants.filter(user=user, is_online=True).aexists():
             return JsonResponse({'error': 'Not a participant'}, status=403)
         
         data = json.loads(request.body)
@@ -342,7 +500,7 @@ def update_video_state_api(request, room_id):
         timestamp = data.get('timestamp', 0)
         url = data.get('url')
         
-        room.update_video_state(action, timestamp, url)
+        await room.aupdate_video_state(action, timestamp, url)
         
         return JsonResponse({'status': 'success', 'state': room.get_video_state()})
         
@@ -357,8 +515,8 @@ def delete_message(request, room_id, message_id):
     print(f"DEBUG: Delete message called - room: {room_id}, message: {message_id}, user: {request.user.username}")
     
     try:
-        room = get_object_or_404(Room, id=room_id)
-        message = get_object_or_404(Message, id=message_id, room=room)
+        room = get_object_or_404(Room.objects.select_related('creator'), id=room_id)
+        message = get_object_or_404(Message.objects.select_related('user'), id=message_id, room=room)
         
         print(f"DEBUG: Found message - {message.id} by {message.user.username}")
         
@@ -403,30 +561,27 @@ def delete_message(request, room_id, message_id):
     
 @require_POST
 @login_required
-def mute_user(request, room_id, user_id):
+async def mute_user(request, room_id, user_id):
     try:
-        room = get_object_or_404(Room, id=room_id)
-        target_user = get_object_or_404(User, id=user_id)
-        participant = get_object_or_404(Participant, room=room, user=target_user)
+        user = await request.auser()
+        room = await aget_object_or_404(Room, id=room_id)
+        participant = await aget_object_or_404(Participant.objects.select_related('user'), room=room, user_id=user_id)
+        target_user = participant.user
         
-        if request.user != room.creator:
+        if user.id != room.creator_id:
             return JsonResponse({'error': 'Only room creators can mute users'}, status=403)
         
         duration = int(request.POST.get('duration', 5))
         
-        participant.mute(duration, request.user)
-    
-        from channels.layers import get_channel_layer
-        from asgiref.sync import async_to_sync
+        await participant.amute(duration, user)
         
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
+        await get_channel_layer().group_send(
             f'room_{room_id}',
             {
                 'type': 'user_muted',
                 'user_id': str(target_user.id),
                 'username': target_user.username,
-                'muted_by': request.user.username,
+                'muted_by': user.username,
                 'duration': duration,
                 'muted_until': participant.muted_until.isoformat() if participant.muted_until else None
             }
@@ -439,28 +594,25 @@ def mute_user(request, room_id, user_id):
 
 @require_POST
 @login_required
-def unmute_user(request, room_id, user_id):
+async def unmute_user(request, room_id, user_id):
     try:
-        room = get_object_or_404(Room, id=room_id)
-        target_user = get_object_or_404(User, id=user_id)
-        participant = get_object_or_404(Participant, room=room, user=target_user)
+        user = await request.auser()
+        room = await aget_object_or_404(Room, id=room_id)
+        participant = await aget_object_or_404(Participant.objects.select_related('user'), room=room, user_id=user_id)
+        target_user = participant.user
         
-        if request.user != room.creator:
+        if user.id != room.creator_id:
             return JsonResponse({'error': 'Only room creators can unmute users'}, status=403)
         
-        participant.unmute()
+        await participant.aunmute()
         
-        from channels.layers import get_channel_layer
-        from asgiref.sync import async_to_sync
-        
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
+        await get_channel_layer().group_send(
             f'room_{room_id}',
             {
                 'type': 'user_unmuted',
                 'user_id': str(target_user.id),
                 'username': target_user.username,
-                'unmuted_by': request.user.username
+                'unmuted_by': user.username
             }
         )
         
@@ -546,41 +698,36 @@ def get_banned_words(request, room_id):
 
 @require_POST
 @login_required
-def kick_user(request, room_id, user_id):
+async def kick_user(request, room_id, user_id):
     try:
-        room = get_object_or_404(Room, id=room_id)
-        target_user = get_object_or_404(User, id=user_id)
-        participant = get_object_or_404(Participant, room=room, user=target_user)
+        user = await request.auser()
+        room = await aget_object_or_404(Room, id=room_id)
+        participant = await aget_object_or_404(Participant.objects.select_related('user'), room=room, user_id=user_id)
+        target_user = participant.user
         
-        if request.user != room.creator:
+        if user.id != room.creator_id:
             return JsonResponse({'error': 'Only room creators can kick users'}, status=403)
         
-        if target_user == request.user:
+        if target_user.id == user.id:
             return JsonResponse({'error': 'Cannot kick yourself'}, status=400)
         
-        participant.delete()
+        await participant.adelete()
         
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            f'room_{room_id}',
-            {
+        await send_group_events([
+            (f'room_{room_id}', {
                 'type': 'user_kicked',
                 'user_id': str(target_user.id),
                 'username': target_user.username,
-                'kicked_by': request.user.username
-            }
-        )
-        
-        async_to_sync(channel_layer.group_send)(
-            f"user_{target_user.id}",
-            {
+                'kicked_by': user.username
+            }),
+            (f"user_{target_user.id}", {
                 'type': 'you_were_kicked',
                 'room_id': str(room_id),
                 'room_name': room.name,
-                'kicked_by': request.user.username,
+                'kicked_by': user.username,
                 'redirect_url': '/'
-            }
-        )
+            }),
+        ])
         
         return JsonResponse({'success': True})
         
@@ -590,41 +737,36 @@ def kick_user(request, room_id, user_id):
 
 @require_POST
 @login_required
-def ban_user(request, room_id, user_id):
+async def ban_user(request, room_id, user_id):
     try:
-        room = get_object_or_404(Room, id=room_id)
-        target_user = get_object_or_404(User, id=user_id)
-        participant = get_object_or_404(Participant, room=room, user=target_user)
+        user = await request.auser()
+        room = await aget_object_or_404(Room, id=room_id)
+        participant = await aget_object_or_404(Participant.objects.select_related('user', 'room'), room=room, user_id=user_id)
+        target_user = participant.user
         
-        if request.user != room.creator:
+        if user.id != room.creator_id:
             return JsonResponse({'error': 'Only room creators can ban users'}, status=403)
         
-        if target_user == request.user:
+        if target_user.id == user.id:
             return JsonResponse({'error': 'Cannot ban yourself'}, status=400)
         
-        participant.ban(request.user)
+        await participant.aban(user)
         
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            f'room_{room_id}',
-            {
+        await send_group_events([
+            (f'room_{room_id}', {
                 'type': 'user_banned',
                 'user_id': str(target_user.id),
                 'username': target_user.username,
-                'banned_by': request.user.username
-            }
-        )
-        
-        async_to_sync(channel_layer.group_send)(
-            f"user_{target_user.id}",
-            {
+                'banned_by': user.username
+            }),
+            (f"user_{target_user.id}", {
                 'type': 'you_were_banned',
                 'room_id': str(room_id),
                 'room_name': room.name,
-                'banned_by': request.user.username,
-                'redirect_url': f'/youre-banned/?room_name={room.name}&banned_by={request.user.username}'
-            }
-        )
+                'banned_by': user.username,
+                'redirect_url': f'/youre-banned/?room_name={room.name}&banned_by={user.username}'
+            }),
+        ])
         
         return JsonResponse({'success': True})
         
@@ -634,28 +776,28 @@ def ban_user(request, room_id, user_id):
 
 @require_POST
 @login_required
-def unban_user(request, room_id, user_id):
+async def unban_user(request, room_id, user_id):
     try:
-        room = get_object_or_404(Room, id=room_id)
-        target_user = get_object_or_404(User, id=user_id)
-        participant = get_object_or_404(Participant, room=room, user=target_user)
+        user = await request.auser()
+        room = await aget_object_or_404(Room, id=room_id)
+        participant = await aget_object_or_404(Participant.objects.select_related('user', 'room'), room=room, user_id=user_id)
+        target_user = participant.user
         
-        if request.user != room.creator:
+        if user.id != room.creator_id:
             return JsonResponse({'error': 'Only room creators can unban users'}, status=403)
         
         if not participant.is_banned:
             return JsonResponse({'error': 'User is not banned'}, status=400)
         
-        participant.unban()
+        await participant.aunban()
         
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
+        await get_channel_layer().group_send(
             f'room_{room_id}',
             {
                 'type': 'user_unbanned',
                 'user_id': str(target_user.id),
                 'username': target_user.username,
-                'unbanned_by': request.user.username
+                'unbanned_by': user.username
             }
         )
         
@@ -663,4 +805,116 @@ def unban_user(request, room_id, user_id):
         
     except Exception as e:
         logger.error(f"Error unbanning user: {str(e)}")
-        return JsonResponse({'error': 'Internal server error'}, status=500)
\ No newline at end of file
+        return JsonResponse({'error': 'Internal server error'}, status=500)
+
+@require_POST
+@login_required
+def bulk_moderate_users(request, room_id):
+    try:
+        room = get_object_or_404(Room, id=room_id)
+        
+        if request.user != room.creator:
+            return JsonResponse({'error': 'Only room creators can moderate users'}, status=403)
+        
+        action = request.POST.get('action')
+        if action not in BULK_MODERATION_ACTIONS:
+            return JsonResponse({'error': f'Invalid action: {action}'}, status=400)
+        
+        try:
+            user_ids = {
+                int(user_id)
+                for value in request.POST.getlist('user_ids')
+                for user_id in value.split(',')
+                if user_id.strip()
+            }
+            duration = int(request.POST.get('duration', 5))
+        except ValueError:
+            return JsonResponse({'error': 'Invalid user ids or duration'}, status=400)
+        
+        user_ids.discard(request.user.id)
+        if not user_ids:
+            return JsonResponse({'error': 'No users to moderate'}, status=400)
+        if len(user_ids) > MAX_BULK_MODERATION_USERS:
+            return JsonResponse({'error': f'Too many users (max {MAX_BULK_MODERATION_USERS})'}, status=400)
+        
+        now = timezone.now()
+        muted_until = now + timezone.timedelta(minutes=duration)
+        
+        with transaction.atomic():
+            participants = Participant.objects.filter(room=room, user_id__in=user_ids)
+            if action == 'unban':
+                participants = participants.filter(is_banned=True)
+            rows = list(participants.values_list('user_id', 'user__username', 'is_banned'))
+            targets = [(user_id, username) for user_id, username, _ in rows]
+            participants = Participant.objects.filter(room=room, user_id__in=[user_id for user_id, _ in targets])
+            # update() and the raw delete skip the model signals, so the
+            # joined counters are settled for the whole batch here. Banned
+            # members and inactive rooms are not counted.
+            joined = UserStats.objects.filter(
+                user_id__in=[user_id for user_id, _, is_banned in rows if not is_banned] if room.is_active else []
+            )
+            
+            if action == 'mute':
+                participants.update(is_muted=True, muted_until=muted_until, muted_by=request.user)
+            elif action == 'unmute':
+                participants.update(is_muted=False, muted_until=None, muted_by=None)
+            elif action == 'kick':
+                participants._raw_delete(participants.db)
+                joined.update(rooms_joined=F('rooms_joined') - 1)
+            elif action == 'ban':
+                participants.update(is_online=False, is_banned=True, banned_at=now, banned_by=request.user)
+                joined.update(rooms_joined=F('rooms_joined') - 1)
+            elif action == 'unban':
+                participants.update(is_banned=False, banned_at=None, banned_by=None)
+                if room.is_active:
+                    UserStats.objects.filter(user_id__in=[user_id for user_id, _ in targets]).update(
+                        rooms_joined=F('rooms_joined') + 1
+                    )
+        
+        if not targets:
+            return JsonResponse({'success': True, 'user_ids': []})
+        
+        # update() skips model signals, so invalidate the cached views here.
+        bump_room_state_version(room.id)
+        if action in ('kick', 'ban'):
+            bump_directory_version()
+        
+        room_event = {
+            'type': 'users_moderated',
+            'action': action,
+            'users': [{'user_id': str(user_id), 'username': username} for user_id, username in targets],
+            'moderated_by': request.user.username,
+            'duration': duration if action == 'mute' else None,
+            'muted_until': muted_until.isoformat() if action == 'mute' else None,
+        }
+        events = [(f'room_{room_id}', room_event)]
+        
+        if action == 'kick':
+            events += [
+                (f"user_{user_id}", {
+                    'type': 'you_were_kicked',
+                    'room_id': str(room_id),
+                    'room_name': room.name,
+                    'kicked_by': request.user.username,
+                    'redirect_url': '/'
+                })
+                for user_id, _ in targets
+            ]
+        elif action == 'ban':
+            events += [
+                (f"user_{user_id}", {
+                    'type': 'you_were_banned',
+                    'room_id': str(room_id),
+                    'room_name': room.name,
+                    'banned_by': request.user.username,
+                })
+                for user_id, _ in targets
+            ]
+        
+        dispatch_group_events(events)
+        
+        return JsonResponse({'success': True, 'user_ids': [user_id for user_id, _ in targets]})
+        
+    except Exception as e:
+        logger.error(f"Error in bulk moderation: {str(e)}")
+        return JsonResponse({'error': 'Internal server error'}, status=500)
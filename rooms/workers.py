@@ -0,0 +1,242 @@
+import asyncio
+import bisect
+import hashlib
+import logging
+import os
+import time
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VNODES = 64
+DEFAULT_HEARTBEAT_INTERVAL = 5
+DEFAULT_WORKER_TTL = 15
+PIN_TIMEOUT = 6 * 3600
+HOT_ROOMS_REPORTED = 10
+
+STARTED_AT = time.time()
+
+# Close code sent with a room_moved message; the client reconnects to the
+# worker named in it right away.
+ROOM_MOVED_CLOSE_CODE = 4010
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """
+    Consistent hash ring with virtual nodes. Adding or removing a worker
+    only moves the rooms whose closest point belonged to it, about 1/N of
+    them, instead of reshuffling everything the way modulo hashing would.
+    """
+
+    def __init__(self, nodes=(), vnodes=DEFAULT_VNODES):
+        self.vnodes = vnodes
+        self.nodes = frozenset(nodes)
+        points = sorted((_hash(f'{node}#{i}'), node) for node in self.nodes for i in range(vnodes))
+        self._keys = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, key):
+        if not self._keys:
+            return None
+        index = bisect.bisect(self._keys, _hash(str(key))) % len(self._keys)
+        return self._nodes[index]
+
+
+def get_workers():
+    # ROOM_WORKERS maps worker ids to the base WebSocket URL clients use to
+    # reach them, e.g. {'0': 'ws://10.0.0.5:8001', '1': 'ws://10.0.0.5:8002'}.
+    return getattr(settings, 'ROOM_WORKERS', None) or {}
+
+
+def get_worker_id():
+    return getattr(settings, 'ROOM_WORKER_ID', None)
+
+
+def routing_enabled():
+    return bool(get_workers()) and get_worker_id() in get_workers()
+
+
+def _heartbeat_key(worker_id):
+    return f'room_worker_{worker_id}_heartbeat'
+
+
+def _pin_key(room_id):
+    return f'room_{room_id}_worker'
+
+
+def pin_room(room_id, worker_id, timeout=PIN_TIMEOUT):
+    # Moves one room off the ring, e.g. a hot room onto a quiet worker.
+    if worker_id is None:
+        cache.delete(_pin_key(room_id))
+    else:
+        cache.set(_pin_key(room_id), str(worker_id), timeout=timeout)
+
+
+def get_worker_loads():
+    workers = get_workers()
+    loads = cache.get_many([_heartbeat_key(worker_id) for worker_id in workers])
+    return {
+        worker_id: loads.get(_heartbeat_key(worker_id))
+        for worker_id in workers
+    }
+
+
+def worker_health():
+    # What /healthz/ reports for this process. Read on the event loop, where
+    # the actors live.
+    from .actors import room_actors
+    from .drain import worker_drain
+
+    stats = room_actors.stats()
+    return {
+        'status': 'draining' if worker_drain.draining else 'ok',
+        'worker_id': get_worker_id(),
+        'pid': os.getpid(),
+        'uptime': round(time.time() - STARTED_AT, 1),
+        'rooms': stats['actors'],
+        'connections': stats['members'],
+        'inbox': stats['inbox'],
+    }
+
+
+class RoomRouter:
+    """
+    Decides which worker process owns each room, so a room's actor and its
+    group fanout stay in one process. Workers are listed in ROOM_WORKERS;
+    the ring holds the ones with a fresh heartbeat, so a worker joining or
+    dying moves only its share of rooms. Rooms can be pinned to a worker to
+    rebalance hot rooms by hand.
+
+    When ROOM_WORKERS is not set every room is served locally.
+    """
+
+    def __init__(self):
+        self.ring = HashRing()
+        self.task = None
+        self.beats = 0
+
+    def worker_url(self, worker_id):
+        return get_workers().get(worker_id)
+
+    def owner(self, room_id, pinned=None):
+        if not routing_enabled():
+            return get_worker_id()
+        if pinned is not None and pinned in self.ring.nodes:
+            return pinned
+        return self.ring.node_for(room_id) or get_worker_id()
+
+    def is_local(self, room_id, pinned=None):
+        return not routing_enabled() or self.owner(room_id, pinned) == get_worker_id()
+
+    def get_pin(self, room_id):
+        return cache.get(_pin_key(room_id)) if routing_enabled() else None
+
+    def get_pins(self, room_ids):
+        if not routing_enabled() or not room_ids:
+            return {}
+        pins = cache.get_many([_pin_key(room_id) for room_id in room_ids])
+        return {room_id: pins.get(_pin_key(room_id)) for room_id in room_ids}
+
+    # Heartbeat
+
+    def load(self):
+        # Read on the event loop, where the actors live.
+        from .actors import room_actors
+
+        stats = room_actors.stats()
+        hot = sorted(stats['rooms'], key=lambda room: room['members'], reverse=True)[:HOT_ROOMS_REPORTED]
+        return {
+            'worker_id': get_worker_id(),
+            'url': self.worker_url(get_worker_id()),
+            'rooms': stats['actors'],
+            'connections': stats['members'],
+            'inbox': stats['inbox'],
+            'hot_rooms': [{'room_id': room['room_id'], 'connections': room['members']} for room in hot],
+            'updated_at': time.time(),
+        }
+
+    def beat(self, load, local_rooms):
+        # Publishes this worker's load and rebuilds the ring from the
+        # workers whose heartbeat hasn't expired. Returns the local rooms
+        # this worker no longer owns.
+        ttl = getattr(settings, 'ROOM_WORKER_TTL', DEFAULT_WORKER_TTL)
+        cache.set(_heartbeat_key(get_worker_id()), load, timeout=ttl)
+        live = {worker_id for worker_id, load in get_worker_loads().items() if load is not None}
+        live.add(get_worker_id())
+        if live != self.ring.nodes:
+            logger.info(f"Room ring now has workers {sorted(live)}")
+            self.ring = HashRing(live, vnodes=getattr(settings, 'ROOM_RING_VNODES', DEFAULT_VNODES))
+        self.beats += 1
+
+        pins = self.get_pins(local_rooms)
+        return [room_id for room_id in local_rooms if not self.is_local(room_id, pins.get(room_id))]
+
+    async def abeat(self):
+        from .actors import room_actors
+
+        moved = await sync_to_async(self.beat)(self.load(), room_actors.room_ids())
+        for room_id in moved:
+            await self.hand_off(room_id)
+
+    async def ensure_started(self):
+        if not routing_enabled():
+            return
+        loop = asyncio.get_running_loop()
+        if self.task is not None and not self.task.done() and self.task.get_loop() is loop:
+            return
+        await self.abeat()
+        self.task = loop.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+        self.task = None
+
+    async def run(self):
+        interval = getattr(settings, 'ROOM_WORKER_HEARTBEAT_INTERVAL', DEFAULT_HEARTBEAT_INTERVAL)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.abeat()
+            except Exception as e:
+                logger.error(f"Room worker heartbeat failed: {str(e)}")
+
+    async def redirect_for(self, room_id):
+        # None when this worker owns the room, else (worker_id, url) of the
+        # worker that does.
+        if not routing_enabled():
+            return None
+        await self.ensure_started()
+        pin = await sync_to_async(self.get_pin)(room_id)
+        owner = self.owner(room_id, pin)
+        if owner == get_worker_id():
+            return None
+        return owner, self.worker_url(owner)
+
+    async def hand_off(self, room_id):
+        # The actor saves its snapshot before clients are told to move, so
+        # the new owner loads the latest state when they reconnect.
+        from .actors import room_actors
+
+        actor = room_actors.get(room_id)
+        if actor is not None:
+            actor.stopping = True
+            room_actors.retire(actor)
+            await actor.stop()
+        owner = self.owner(room_id, await sync_to_async(self.get_pin)(room_id))
+        logger.info(f"Handing room {room_id} off to worker {owner}")
+        await get_channel_layer().group_send(f'room_{room_id}', {
+            'type': 'room_moved',
+            'worker_id': owner,
+            'url': self.worker_url(owner),
+        })
+
+
+room_router = RoomRouter()
@@ -2,6 +2,13 @@ let roomSocket = null;
 let reconnectAttempts = 0;
 const maxReconnectAttempts = 5;
 let videoLatency = 0;
+let clockOffset = null;
+let lastPong = null;
+let suppressBroadcastUntil = 0;
+let wsBase = null;
+let roomMoves = 0;
+let reconnectAt = null;
+const driftReportInterval = 5000;
 let isSyncing = false;
 let player;
 let isPlaying = false;
@@ -114,10 +121,10 @@ function onPlayerReady() {
 function onPlayerStateChange(event) {
     if (event.data == YT.PlayerState.PLAYING) {
         isPlaying = true;
-        sendVideoControl('play', player.getCurrentTime());
+        if (!isApplyingRemoteChange()) sendVideoControl('play', player.getCurrentTime());
     } else if (event.data == YT.PlayerState.PAUSED) {
         isPlaying = false;
-        sendVideoControl('pause', player.getCurrentTime());
+        if (!isApplyingRemoteChange()) sendVideoControl('pause', player.getCurrentTime());
     }
     
     if (event.data == YT.PlayerState.PLAYING) {
@@ -151,14 +158,19 @@ function onPlayerError(event) {
 
 function connectWebSocket() {
     const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-    const wsUrl = `${protocol}//${window.location.host}/ws/room/${roomId}/`;
+    // wsBase is set when the server moves this room to another worker.
+    const wsUrl = `${wsBase || `${protocol}//${window.location.host}`}/ws/room/${roomId}/`;
     
     roomSocket = new WebSocket(wsUrl);
 
     roomSocket.onopen = function(e) {
         reconnectAttempts = 0;
+        clockOffset = null;
+        lastPong = null;
         updateChatIndicator('connected', 'Connected');
         showNotification('Connected to room', 'success');
+        // A short burst gives the server a few clock samples right away.
+        for (let i = 0; i < 4; i++) setTimeout(calculateLatency, i * 500);
     };
 
     roomSocket.onmessage = function(e) {
@@ -214,6 +226,15 @@ async function handleWebSocketMessage(data) {
         case 'pong':
             handlePingPong(data);
             break;
+        case 'sync_correction':
+            handleSyncCorrection(data);
+            break;
+        case 'room_moved':
+            wsBase = data.url ? data.url.replace(/\/$/, '') : null;
+            break;
+        case 'reconnect':
+            scheduleReconnect(data.retry_in);
+            break;
         case 'user_muted':
             handleUserMuted(data);
             break;
@@ -241,6 +262,9 @@ async function handleWebSocketMessage(data) {
         case 'user_unbanned':
             handleUserUnbanned(data);
             break;
+        case 'users_moderated':
+            handleUsersModerated(data);
+            break;
         default:
             showNotification('Unknown message type', 'warning');
     }
@@ -400,6 +424,20 @@ function handleUserUnbanned(data) {
     showNotification(`${data.username} was unbanned`, 'success');
 }
 
+function handleUsersModerated(data) {
+    const labels = {mute: 'muted', unmute: 'unmuted', kick: 'kicked', ban: 'permanently banned', unban: 'unbanned'};
+    const names = data.users.map(user => user.username).join(', ');
+    const verb = data.users.length === 1 ? 'was' : 'were';
+    showNotification(`${names} ${verb} ${labels[data.action]} by ${data.moderated_by}`, data.action.startsWith('un') ? 'success' : 'warning');
+    data.users.forEach(user => {
+        if (data.action === 'mute' || data.action === 'unmute') {
+            updateParticipantMuteStatus(user.user_id, data.action === 'mute');
+        } else if (data.action === 'kick' || data.action === 'ban') {
+            removeParticipantFromUI(user.user_id);
+        }
+    });
+}
+
 function handleTypingIndicator(data) {
     if (data.user_id != userId) {
         if (data.is_typing) {
@@ -482,8 +520,12 @@ function handleWebRTCSignal(data) {
 
 function handlePingPong(data) {
     if (data.type === 'pong') {
-        const roundTripTime = Date.now() - data.client_time;
+        const receivedAt = Date.now();
+        roomMoves = 0;
+        lastPong = {'client_time': data.client_time, 'received_at': receivedAt};
+        const roundTripTime = data.rtt != null ? Math.round(data.rtt * 1000) : receivedAt - data.client_time;
         videoLatency = roundTripTime / 2000;
+        if (data.clock_offset != null) clockOffset = data.clock_offset;
         updateLatencyDisplay(roundTripTime);
     }
 }
@@ -496,6 +538,16 @@ function updateLatencyDisplay(roundTripTime) {
     }
 }
 
+function scheduleReconnect(retryIn) {
+    // The worker is shutting down. Each client leaves at its own hinted
+    // time, so they don't all reconnect at once.
+    const socket = roomSocket;
+    reconnectAt = Date.now() + retryIn * 1000;
+    setTimeout(() => {
+        if (roomSocket === socket && socket.readyState === WebSocket.OPEN) socket.close(1000);
+    }, retryIn * 1000);
+}
+
 function handleDisconnection(e) {
     if (e.code === 4001) {
         showNotification('Room not found', 'error');
@@ -508,6 +560,15 @@ function handleDisconnection(e) {
         updateChatIndicator('banned', 'Banned');
     } else if (e.code === 4006 || e.code === 4007) {
         return;
+    } else if (e.code === 4012 || reconnectAt !== null) {
+        updateChatIndicator('connecting', 'Reconnecting...');
+        const delay = reconnectAt !== null ? Math.max(0, reconnectAt - Date.now()) : Math.random() * 5000;
+        reconnectAt = null;
+        setTimeout(connectWebSocket, delay);
+    } else if (e.code === 4010) {
+        // Back off in case workers briefly disagree about who owns the room.
+        updateChatIndicator('connecting', 'Reconnecting...');
+        setTimeout(connectWebSocket, Math.min(5000, 200 * roomMoves++));
     } else if (reconnectAttempts < maxReconnectAttempts) {
         updateChatIndicator('connecting', 'Reconnecting...');
         setTimeout(() => {
@@ -637,16 +698,16 @@ function loadGenericVideo(url) {
     
     videoElement.addEventListener('play', () => {
         isPlaying = true;
-        sendVideoControl('play', videoElement.currentTime);
+        if (!isApplyingRemoteChange()) sendVideoControl('play', videoElement.currentTime);
     });
     
     videoElement.addEventListener('pause', () => {
         isPlaying = false;
-        sendVideoControl('pause', videoElement.currentTime);
+        if (!isApplyingRemoteChange()) sendVideoControl('pause', videoElement.currentTime);
     });
     
     videoElement.addEventListener('seeked', () => {
-        sendVideoControl('sync', videoElement.currentTime);
+        if (!isApplyingRemoteChange()) sendVideoControl('sync', videoElement.currentTime);
     });
     
     videoElement.addEventListener('timeupdate', () => {
@@ -789,7 +850,8 @@ function sendVideoControl(action, timestamp, url = '') {
             'type': 'video_control',
             'action': action,
             'timestamp': timestamp,
-            'url': url
+            'url': url,
+            'client_time': Date.now()
         }));
     } else {
         showNotification('Not connected to room', 'warning');
@@ -798,28 +860,86 @@ function sendVideoControl(action, timestamp, url = '') {
 
 function handleVideoControl(data) {
     if (data.user_id != userId) {
-        const currentTime = Date.now() / 1000;
-        const serverTime = data.server_timestamp || 0;
-        const messageLatency = data.latency || 0;
-        const totalLatency = messageLatency + videoLatency;
-        const adjustedTimestamp = data.timestamp + totalLatency;
-
-        switch(data.action) {
-            case 'play': executeVideoAction('play', adjustedTimestamp, data.username); break;
-            case 'pause': executeVideoAction('pause', adjustedTimestamp, data.username); break;
-            case 'load':
-                videoUrlInput.value = data.url;
-                loadVideoToPlayer(data.url);
-                showNotification(`${data.username} loaded a new video`, 'info');
-                break;
-            case 'sync': executeVideoAction('sync', adjustedTimestamp, data.username); break;
+        if (data.action === 'load') {
+            videoUrlInput.value = data.url;
+            loadVideoToPlayer(data.url);
+            showNotification(`${data.username} loaded a new video`, 'info');
+            return;
+        }
+        if (data.clock_offset != null) clockOffset = data.clock_offset;
+        if (clockOffset == null || data.execute_at == null) {
+            const adjustedTimestamp = data.timestamp + (data.latency || 0) + videoLatency;
+            executeVideoAction(data.action, adjustedTimestamp, data.username);
+            return;
         }
+
+        // Every viewer changes state at the same server instant.
+        runAtServerTime(data.execute_at, () => {
+            let timestamp = data.timestamp;
+            if (data.action === 'play' || (data.action === 'sync' && isPlaying)) {
+                timestamp += Math.max(0, serverNow() - (data.action_at || data.execute_at));
+            }
+            executeVideoAction(data.action, timestamp, data.username);
+        });
     }
 }
 
+function serverNow() {
+    return Date.now() / 1000 + (clockOffset || 0);
+}
+
+function runAtServerTime(serverTime, callback) {
+    // serverTime is on the server clock; clockOffset converts it to ours.
+    const delay = (serverTime - (clockOffset || 0)) * 1000 - Date.now();
+    setTimeout(callback, Math.max(0, delay));
+}
+
+function isApplyingRemoteChange() {
+    // Player events caused by applying someone else's action must not be
+    // broadcast back to the room.
+    return Date.now() < suppressBroadcastUntil;
+}
+
+function getPlaybackPosition() {
+    if (videoType === 'youtube' && player && player.getCurrentTime) return player.getCurrentTime();
+    if (videoType === 'direct' && videoElement) return videoElement.currentTime;
+    return null;
+}
+
+function reportDrift() {
+    if (!roomSocket || roomSocket.readyState !== WebSocket.OPEN || isApplyingRemoteChange()) return;
+    const position = getPlaybackPosition();
+    if (position === null) return;
+    roomSocket.send(JSON.stringify({
+        'type': 'drift_report',
+        'position': position,
+        'playing': isPlaying,
+        'url': videoUrl,
+        'client_time': Date.now()
+    }));
+}
+
+function handleSyncCorrection(data) {
+    if (data.clock_offset != null) clockOffset = data.clock_offset;
+    runAtServerTime(data.execute_at, () => {
+        let timestamp = data.timestamp;
+        if (data.state === 'play') timestamp += Math.max(0, serverNow() - data.execute_at);
+        suppressBroadcastUntil = Date.now() + 1000;
+        if (videoType === 'youtube' && player) {
+            player.seekTo(timestamp, true);
+            if (data.state === 'play') player.playVideo(); else player.pauseVideo();
+        } else if (videoType === 'direct' && videoElement) {
+            videoElement.currentTime = timestamp;
+            if (data.state === 'play') videoElement.play(); else videoElement.pause();
+        }
+        isPlaying = data.state === 'play';
+    });
+}
+
 function executeVideoAction(action, timestamp, username) {
     if (isSyncing) return;
     isSyncing = true;
+    suppressBroadcastUntil = Date.now() + 1000;
     
     switch(action) {
         case 'play':
@@ -862,7 +982,8 @@ function calculateLatency() {
     if (roomSocket && roomSocket.readyState === WebSocket.OPEN) {
         roomSocket.send(JSON.stringify({
             'type': 'ping',
-            'client_time': startTime
+            'client_time': startTime,
+            'previous': lastPong
         }));
     }
 }
@@ -1551,8 +1672,8 @@ document.addEventListener('DOMContentLoaded', function() {
 
     connectWebSocket();
     if (chatMessages) chatMessages.scrollTop = chatMessages.scrollHeight;
-    setInterval(calculateLatency, 30000);
-    calculateLatency();
+    setInterval(calculateLatency, 10000);
+    setInterval(reportDrift, driftReportInterval);
     initializeParticipants();
 });
 
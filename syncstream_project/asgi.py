@@ -1,18 +1,26 @@
 import os
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
-import rooms.routing
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'syncstream_project.settings')
 
+# Set up Django before anything imports models (the consumers do).
 django_asgi_app = get_asgi_application()
 
-application = ProtocolTypeRouter({
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+from channels.auth import AuthMiddlewareStack  # noqa: E402
+import rooms.routing  # noqa: E402
+from rooms.drain import DrainMiddleware  # noqa: E402
+from syncstream_project.db_pool import open_pools  # noqa: E402
+
+open_pools()
+
+# On SIGTERM the worker drains its WebSocket connections before exiting
+# (rooms/drain.py).
+application = DrainMiddleware(ProtocolTypeRouter({
     "http": django_asgi_app,
     "websocket": AuthMiddlewareStack(
         URLRouter(
             rooms.routing.websocket_urlpatterns
         )
     ),
-})
\ No newline at end of file
+}))
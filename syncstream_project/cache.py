@@ -0,0 +1,213 @@
+"Two-tier cache backend: a small per-process LRU in front of a shared cache."
+
+import pickle
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.utils.module_loading import import_string
+
+DEFAULT_SHARED_BACKEND = 'django.core.cache.backends.redis.RedisCache'
+DEFAULT_LOCAL_TIMEOUT = 2
+DEFAULT_LOCAL_MAX_ENTRIES = 1000
+
+# Version counters must be read from the shared tier every time, since a
+# bump in another process is what invalidates everything keyed on them.
+# A room's playback clock changes with every play, pause and seek.
+DEFAULT_SHARED_ONLY_SUFFIXES = ('_version', '_clock')
+
+# Django creates a cache backend per thread, so the local tier is kept per
+# process and shared by name, the same way LocMemCache does it.
+_locals = {}
+_locks = {}
+_stats = {}
+
+
+class TwoTierCache(BaseCache):
+    """
+    Reads are served from a bounded in-process LRU when possible and fall
+    through to the shared backend (Redis by default) otherwise. Local entries
+    live for at most LOCAL_TIMEOUT seconds, which bounds how stale a value
+    written by another process can be. Data that must be fresh is keyed on a
+    version from the shared tier (see rooms/caching.py), so a bump anywhere
+    switches every process to a new key at once.
+
+    OPTIONS:
+        SHARED_BACKEND: dotted path of the shared cache backend.
+        SHARED_OPTIONS: OPTIONS passed on to the shared backend.
+        LOCAL_TIMEOUT: max seconds a value is kept in the local tier.
+        LOCAL_MAX_ENTRIES: size of the local LRU.
+        SHARED_ONLY_SUFFIXES: keys ending in these skip the local tier.
+    """
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        shared_backend = import_string(options.get('SHARED_BACKEND', DEFAULT_SHARED_BACKEND))
+        self._shared = shared_backend(location, {**params, 'OPTIONS': options.get('SHARED_OPTIONS', {})})
+
+        self._local_timeout = options.get('LOCAL_TIMEOUT', DEFAULT_LOCAL_TIMEOUT)
+        self._local_max_entries = options.get('LOCAL_MAX_ENTRIES', DEFAULT_LOCAL_MAX_ENTRIES)
+        self._shared_only_suffixes = tuple(options.get('SHARED_ONLY_SUFFIXES', DEFAULT_SHARED_ONLY_SUFFIXES))
+
+        # key -> (expires_at, pickled value), most recently used last.
+        self._local = _locals.setdefault(location, OrderedDict())
+        self._lock = _locks.setdefault(location, Lock())
+        self._stats = _stats.setdefault(location, {'local_hits': 0, 'shared_hits': 0, 'misses': 0, 'local_evictions': 0})
+
+    def _is_local(self, key):
+        return not key.endswith(self._shared_only_suffixes)
+
+    def _local_get(self, local_key):
+        with self._lock:
+            entry = self._local.get(local_key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._local[local_key]
+                return None
+            self._local.move_to_end(local_key)
+            self._stats['local_hits'] += 1
+        return entry
+
+    def _local_set(self, local_key, value, timeout):
+        if timeout == DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        ttl = self._local_timeout if timeout is None else min(timeout, self._local_timeout)
+        if ttl <= 0:
+            self._local_delete(local_key)
+            return
+
+        # Values are stored pickled, like LocMemCache, so callers that mutate
+        # what they got back can't change the cached copy.
+        pickled = pickle.dumps(value, self.pickle_protocol)
+        with self._lock:
+            self._local[local_key] = (time.monotonic() + ttl, pickled)
+            self._local.move_to_end(local_key)
+            while len(self._local) > self._local_max_entries:
+                self._local.popitem(last=False)
+                self._stats['local_evictions'] += 1
+
+    def _local_delete(self, local_key):
+        with self._lock:
+            self._local.pop(local_key, None)
+
+    def _count(self, stat, amount=1):
+        with self._lock:
+            self._stats[stat] += amount
+
+    def get(self, key, default=None, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        if self._is_local(key):
+            entry = self._local_get(local_key)
+            if entry is not None:
+                return pickle.loads(entry[1])
+
+        missing = object()
+        value = self._shared.get(key, missing, version=version)
+        if value is missing:
+            self._count('misses')
+            return default
+
+        self._count('shared_hits')
+        if self._is_local(key):
+            self._local_set(local_key, value, DEFAULT_TIMEOUT)
+        return value
+
+    def get_many(self, keys, version=None):
+        found = {}
+        shared_keys = []
+        for key in keys:
+            local_key = self.make_and_validate_key(key, version=version)
+            entry = self._local_get(local_key) if self._is_local(key) else None
+            if entry is None:
+                shared_keys.append(key)
+            else:
+                found[key] = pickle.loads(entry[1])
+
+        if shared_keys:
+            shared_found = self._shared.get_many(shared_keys, version=version)
+            self._count('shared_hits', len(shared_found))
+            self._count('misses', len(shared_keys) - len(shared_found))
+            for key, value in shared_found.items():
+                if self._is_local(key):
+                    self._local_set(self.make_key(key, version=version), value, DEFAULT_TIMEOUT)
+            found.update(shared_found)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        self._shared.set(key, value, timeout=timeout, version=version)
+        if self._is_local(key):
+            self._local_set(local_key, value, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self._shared.set_many(data, timeout=timeout, version=version)
+        for key, value in data.items():
+            local_key = self.make_and_validate_key(key, version=version)
+            if self._is_local(key) and key not in failed:
+                self._local_set(local_key, value, timeout)
+            else:
+                self._local_delete(local_key)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        added = self._shared.add(key, value, timeout=timeout, version=version)
+        if added and self._is_local(key):
+            self._local_set(local_key, value, timeout)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self._local_delete(self.make_and_validate_key(key, version=version))
+        return self._shared.touch(key, timeout=timeout, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        self._local_delete(self.make_and_validate_key(key, version=version))
+        return self._shared.incr(key, delta=delta, version=version)
+
+    def has_key(self, key, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        if self._is_local(key) and self._local_get(local_key) is not None:
+            return True
+        return self._shared.has_key(key, version=version)
+
+    def delete(self, key, version=None):
+        self._local_delete(self.make_and_validate_key(key, version=version))
+        return self._shared.delete(key, version=version)
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self._local_delete(self.make_and_validate_key(key, version=version))
+        self._shared.delete_many(keys, version=version)
+
+    def clear(self):
+        self.clear_local()
+        return self._shared.clear()
+
+    def clear_local(self):
+        with self._lock:
+            self._local.clear()
+
+    def close(self, **kwargs):
+        self._shared.close(**kwargs)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, local_entries=len(self._local))
+        lookups = stats['local_hits'] + stats['shared_hits'] + stats['misses']
+        stats['local_hit_rate'] = round(stats['local_hits'] / lookups, 4) if lookups else 0
+        stats['hit_rate'] = round((stats['local_hits'] + stats['shared_hits']) / lookups, 4) if lookups else 0
+        return stats
+
+
+def get_cache_stats():
+    from django.core.cache import caches
+
+    return {
+        alias: caches[alias].stats()
+        for alias in caches.settings
+        if isinstance(caches[alias], TwoTierCache)
+    }
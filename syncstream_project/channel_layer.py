@@ -0,0 +1,227 @@
+"In-process channel layer for single-node deployments."
+
+import asyncio
+import time
+import uuid
+from collections import deque
+from threading import Lock
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+DROP_POLICIES = (DROP_OLDEST, DROP_NEWEST)
+
+
+class _Channel:
+    __slots__ = ('messages', 'waiters', 'capacity')
+
+    def __init__(self, capacity):
+        # (expires_at, message), oldest first.
+        self.messages = deque()
+        self.waiters = deque()
+        self.capacity = capacity
+
+
+def _resolve(waiter, message):
+    if not waiter.done():
+        waiter.set_result(message)
+
+
+class LocalChannelLayer(BaseChannelLayer):
+    """
+    Channel layer for one process, built for large groups. Groups are dicts
+    of member channels with a reverse index per channel, so joins and leaves
+    are O(1). A message goes straight to a receiver that is already waiting
+    and is otherwise queued; group_send hands the same dict to every member
+    instead of deep-copying it per channel, so messages must be treated as
+    read-only once sent. Expired messages and memberships are swept at most
+    once per expiry period rather than on every send.
+
+    Each channel holds at most `capacity` messages (per-channel overrides in
+    `channel_capacity`, as with the other layers). A direct send() to a full
+    channel raises ChannelFull. For group_send, `drop_policy` decides what a
+    full channel loses: the oldest queued message (drop_oldest, the default,
+    since newer room events supersede older ones) or the new one
+    (drop_newest, what the in-memory and Redis layers do).
+
+    Like InMemoryChannelLayer it only works within one process; use
+    channels_redis with more than one worker.
+    """
+    extensions = ['groups', 'flush']
+
+    def __init__(self, expiry=60, group_expiry=86400, capacity=100, channel_capacity=None,
+                 drop_policy=DROP_OLDEST, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"drop_policy must be one of {', '.join(DROP_POLICIES)}")
+        self.channel_capacity = self.compile_capacities(self.channel_capacity)
+        self.group_expiry = group_expiry
+        self.drop_policy = drop_policy
+        self.channels = {}
+        # group -> {channel: joined_at}, and channel -> {groups}.
+        self.groups = {}
+        self.memberships = {}
+        self.dropped = 0
+        self.expired = 0
+        # Views call the layer through async_to_sync from other threads.
+        self._lock = Lock()
+        self._next_sweep = time.time() + expiry
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_channel_name(channel)
+        assert "__asgi_channel__" not in message
+
+        now = time.time()
+        self._maybe_sweep(now)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if not self._deliver(channel, message, now + self.expiry, loop, None):
+                raise ChannelFull(channel)
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+
+        with self._lock:
+            state = self._channel(channel)
+            now = time.time()
+            while state.messages:
+                expires_at, message = state.messages.popleft()
+                if expires_at >= now:
+                    return message
+                self.expired += 1
+            waiter = asyncio.get_running_loop().create_future()
+            state.waiters.append(waiter)
+
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in state.waiters:
+                    state.waiters.remove(waiter)
+                elif waiter.done() and not waiter.cancelled():
+                    # Delivered just as the receiver was cancelled; keep it
+                    # for the next receive.
+                    self._channel(channel).messages.appendleft((time.time() + self.expiry, waiter.result()))
+            raise
+
+    async def new_channel(self, prefix="specific."):
+        return f"{prefix}.local!{uuid.uuid4().hex[:12]}"
+
+    # Delivery
+
+    def _channel(self, name):
+        state = self.channels.get(name)
+        if state is None:
+            state = self.channels[name] = _Channel(self.get_capacity(name))
+        return state
+
+    def _deliver(self, name, message, expires_at, loop, policy):
+        # Called with the lock held. Returns False if the message was dropped.
+        state = self._channel(name)
+        while state.waiters:
+            waiter = state.waiters.popleft()
+            if waiter.done():
+                continue
+            waiter_loop = waiter.get_loop()
+            if waiter_loop is loop:
+                waiter.set_result(message)
+            elif waiter_loop.is_closed():
+                continue
+            else:
+                waiter_loop.call_soon_threadsafe(_resolve, waiter, message)
+            return True
+
+        if len(state.messages) >= state.capacity:
+            self.dropped += 1
+            if policy != DROP_OLDEST:
+                return False
+            state.messages.popleft()
+        state.messages.append((expires_at, message))
+        return True
+
+    # Expiry
+
+    def _maybe_sweep(self, now):
+        if now >= self._next_sweep:
+            self._sweep(now)
+
+    def _sweep(self, now):
+        with self._lock:
+            self._next_sweep = now + self.expiry
+            for name, state in list(self.channels.items()):
+                stale = False
+                while state.messages and state.messages[0][0] < now:
+                    state.messages.popleft()
+                    self.expired += 1
+                    stale = True
+                # Nobody has read this channel for a whole expiry period, so
+                # it stops getting group messages.
+                if stale:
+                    for group in list(self.memberships.get(name, ())):
+                        self._discard(group, name)
+                if not state.messages and not state.waiters:
+                    del self.channels[name]
+
+            cutoff = now - self.group_expiry
+            for group, members in list(self.groups.items()):
+                for name, joined_at in list(members.items()):
+                    if joined_at < cutoff:
+                        self._discard(group, name)
+
+    # Flush extension
+
+    async def flush(self):
+        with self._lock:
+            self.channels = {}
+            self.groups = {}
+            self.memberships = {}
+
+    async def close(self):
+        pass
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        with self._lock:
+            self.groups.setdefault(group, {})[channel] = time.time()
+            self.memberships.setdefault(channel, set()).add(group)
+
+    async def group_discard(self, group, channel):
+        self.require_valid_channel_name(channel)
+        self.require_valid_group_name(group)
+        with self._lock:
+            self._discard(group, channel)
+
+    def _discard(self, group, channel):
+        members = self.groups.get(group)
+        if members is not None:
+            members.pop(channel, None)
+            if not members:
+                del self.groups[group]
+        groups = self.memberships.get(channel)
+        if groups is not None:
+            groups.discard(group)
+            if not groups:
+                del self.memberships[channel]
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        self.require_valid_group_name(group)
+
+        now = time.time()
+        self._maybe_sweep(now)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            members = self.groups.get(group)
+            if not members:
+                return
+            expires_at = now + self.expiry
+            for channel in members:
+                self._deliver(channel, message, expires_at, loop, self.drop_policy)
@@ -0,0 +1,87 @@
+import logging
+import os
+from importlib.util import find_spec
+
+logger = logging.getLogger(__name__)
+
+POSTGRES_ENGINE = 'django.db.backends.postgresql'
+
+
+def pooling_available():
+    return find_spec('psycopg') is not None and find_spec('psycopg_pool') is not None
+
+
+def pool_options(alias):
+    return {
+        'name': alias,
+        'min_size': int(os.getenv('DATABASE_POOL_MIN_SIZE', 2)),
+        'max_size': int(os.getenv('DATABASE_POOL_MAX_SIZE', 10)),
+        # Longest a request may wait for a free connection before erroring.
+        'timeout': float(os.getenv('DATABASE_POOL_TIMEOUT', 10)),
+        'max_idle': float(os.getenv('DATABASE_POOL_MAX_IDLE', 600)),
+        'max_lifetime': float(os.getenv('DATABASE_POOL_MAX_LIFETIME', 3600)),
+    }
+
+
+def configure_pool(database, alias):
+    """
+    Switches a PostgreSQL DATABASES entry to Django's psycopg 3 connection
+    pool. Other engines, or installs without psycopg[pool], are left as-is.
+    """
+    if database.get('ENGINE') != POSTGRES_ENGINE:
+        return database
+    if not pooling_available():
+        logger.warning("DATABASE_POOL is enabled but psycopg[pool] is not installed; using direct connections")
+        return database
+
+    # Pooled connections are handed back on close, so Django must not also
+    # keep them open per thread.
+    database['CONN_MAX_AGE'] = 0
+    database.setdefault('OPTIONS', {})['pool'] = pool_options(alias)
+    return database
+
+
+def get_pools():
+    from django.db import connections
+
+    pools = {}
+    for alias in connections:
+        pool = getattr(connections[alias], 'pool', None)
+        if pool is not None:
+            pools[alias] = pool
+    return pools
+
+
+def open_pools():
+    # Fill each pool up to min_size in the background at startup, so the
+    # first websocket handshakes don't pay the TCP/TLS connect time.
+    for alias, pool in get_pools().items():
+        pool.open(wait=False)
+        logger.info(f"Opened connection pool for {alias}")
+
+
+def get_pool_stats():
+    stats = {}
+    for alias, pool in get_pools().items():
+        raw = pool.get_stats()
+        checkouts = raw.get('requests_num', 0)
+        connections_opened = raw.get('connections_num', 0)
+        stats[alias] = {
+            'size': raw.get('pool_size', 0),
+            'min_size': raw.get('pool_min', 0),
+            'max_size': raw.get('pool_max', 0),
+            'available': raw.get('pool_available', 0),
+            'waiting': raw.get('requests_waiting', 0),
+            'checkouts': checkouts,
+            'checkouts_queued': raw.get('requests_queued', 0),
+            'checkout_errors': raw.get('requests_errors', 0),
+            'checkout_wait_ms': raw.get('requests_wait_ms', 0),
+            'avg_checkout_wait_ms': round(raw.get('requests_wait_ms', 0) / checkouts, 2) if checkouts else 0,
+            'avg_checkout_usage_ms': round(raw.get('usage_ms', 0) / checkouts, 2) if checkouts else 0,
+            'connections_opened': connections_opened,
+            'connections_lost': raw.get('connections_lost', 0),
+            'connection_errors': raw.get('connections_errors', 0),
+            'avg_connect_ms': round(raw.get('connections_ms', 0) / connections_opened, 2) if connections_opened else 0,
+            'returns_bad': raw.get('returns_bad', 0),
+        }
+    return stats
@@ -0,0 +1,142 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+# Reads only go to a replica inside an explicit replica_reads() block, and
+# never once the current unit of work (request or websocket message) has
+# written to the primary.
+_replica_reads = ContextVar('replica_reads', default=False)
+_pinned_to_primary = ContextVar('pinned_to_primary', default=False)
+_wrote_to_primary = ContextVar('wrote_to_primary', default=False)
+
+# Sessions, auth and admin bookkeeping are read right after they are
+# written (login, signup), so they always stay on the primary.
+PRIMARY_ONLY_APPS = frozenset(['sessions', 'auth', 'contenttypes', 'admin'])
+
+PRIMARY_PIN_COOKIE = 'db_primary_pin'
+
+
+def get_read_replicas():
+    return getattr(settings, 'DATABASE_READ_REPLICAS', [])
+
+
+def get_replica_lag():
+    return getattr(settings, 'DATABASE_REPLICA_LAG', 5)
+
+
+def reading_from_replica():
+    return bool(get_read_replicas()) and _replica_reads.get() and not _pinned_to_primary.get()
+
+
+def wrote_to_primary():
+    return _wrote_to_primary.get()
+
+
+def pin_to_primary():
+    _pinned_to_primary.set(True)
+
+
+def replica_cache_timeout(timeout):
+    # Anything cached from replica data may be missing a write that has
+    # already bumped its cache version, so it must not outlive the lag.
+    if reading_from_replica():
+        return min(timeout, get_replica_lag())
+    return timeout
+
+
+@contextmanager
+def routing_scope(pinned=False):
+    pinned_token = _pinned_to_primary.set(pinned)
+    wrote_token = _wrote_to_primary.set(False)
+    replica_token = _replica_reads.set(False)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(replica_token)
+        _wrote_to_primary.reset(wrote_token)
+        _pinned_to_primary.reset(pinned_token)
+
+
+@contextmanager
+def replica_reads(enabled=True):
+    token = _replica_reads.set(enabled)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def prefer_replica(view_func):
+    """
+    Lets a read-heavy view read from a replica. The user and session are
+    loaded from the primary first.
+    """
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def _view(request, *args, **kwargs):
+            await request.auser()
+            with replica_reads():
+                return await view_func(request, *args, **kwargs)
+    else:
+        @wraps(view_func)
+        def _view(request, *args, **kwargs):
+            request.user.is_authenticated
+            with replica_reads():
+                return view_func(request, *args, **kwargs)
+    return _view
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in PRIMARY_ONLY_APPS or not reading_from_replica():
+            return DEFAULT_DB_ALIAS
+        return random.choice(get_read_replicas())
+
+    def db_for_write(self, model, **hints):
+        _wrote_to_primary.set(True)
+        pin_to_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+
+class PrimaryPinningMiddleware:
+    """
+    Gives every request its own routing scope. Unsafe methods and requests
+    that follow a write within the replica lag read from the primary, so
+    users always see their own changes.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        with routing_scope(pinned=self.starts_pinned(request)):
+            response = self.get_response(request)
+            self.remember_write(request, response)
+        return response
+
+    async def __acall__(self, request):
+        with routing_scope(pinned=self.starts_pinned(request)):
+            response = await self.get_response(request)
+            self.remember_write(request, response)
+        return response
+
+    def starts_pinned(self, request):
+        return request.method not in ('GET', 'HEAD', 'OPTIONS') or PRIMARY_PIN_COOKIE in request.COOKIES
+
+    def remember_write(self, request, response):
+        if get_read_replicas() and wrote_to_primary():
+            response.set_cookie(PRIMARY_PIN_COOKIE, '1', max_age=get_replica_lag(), httponly=True, samesite='Lax')
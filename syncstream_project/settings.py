@@ -2,6 +2,8 @@ import dj_database_url
 import os
 from pathlib import Path
 
+from syncstream_project.db_pool import configure_pool
+
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -42,6 +44,7 @@ AUTH_USER_MODEL = 'users.CustomUser'
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     "whitenoise.middleware.WhiteNoiseMiddleware",
+    'syncstream_project.db_routers.PrimaryPinningMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -73,17 +76,54 @@ TEMPLATES = [
 ASGI_APPLICATION = 'syncstream_project.asgi.application'
 WSGI_APPLICATION = 'syncstream_project.wsgi.application'
 
-# Channel layer configuration (using Redis in production, InMemory for development)
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
-        # For production, use Redis:
-        # 'BACKEND': 'channels_redis.core.RedisChannelLayer',
-        # 'CONFIG': {
-        #     "hosts": [('127.0.0.1', 6379)],
-        # },
-    },
-}
+# Channel layer: Redis whenever CHANNEL_REDIS_URL (or REDIS_URL) is set, so
+# group messages reach consumers in every worker process. Otherwise the
+# in-process layer (syncstream_project/channel_layer.py) serves single-node
+# deployments; CHANNEL_LAYER_DROP_POLICY picks what a full channel loses.
+CHANNEL_REDIS_URL = os.getenv('CHANNEL_REDIS_URL', os.getenv('REDIS_URL'))
+
+if CHANNEL_REDIS_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': [CHANNEL_REDIS_URL],
+                'capacity': int(os.getenv('CHANNEL_LAYER_CAPACITY', 1500)),
+                'expiry': int(os.getenv('CHANNEL_LAYER_EXPIRY', 10)),
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'syncstream_project.channel_layer.LocalChannelLayer',
+            'CONFIG': {
+                'capacity': int(os.getenv('CHANNEL_LAYER_CAPACITY', 1500)),
+                'expiry': int(os.getenv('CHANNEL_LAYER_EXPIRY', 10)),
+                'drop_policy': os.getenv('CHANNEL_LAYER_DROP_POLICY', 'drop_oldest'),
+            },
+        },
+    }
+
+# With REDIS_URL set, the cache is shared by all workers through Redis, with
+# a small per-process LRU in front of it for hot keys (room settings, room
+# state snapshots, rendered directory fragments). Local copies live for at
+# most CACHE_LOCAL_TIMEOUT seconds; versioned keys invalidate across workers
+# immediately. Hit/miss counters are served to staff at /rooms/api/cache/.
+REDIS_URL = os.getenv('REDIS_URL')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'syncstream_project.cache.TwoTierCache',
+            'LOCATION': REDIS_URL,
+            'OPTIONS': {
+                'SHARED_BACKEND': 'django.core.cache.backends.redis.RedisCache',
+                'LOCAL_TIMEOUT': int(os.getenv('CACHE_LOCAL_TIMEOUT', 2)),
+                'LOCAL_MAX_ENTRIES': int(os.getenv('CACHE_LOCAL_MAX_ENTRIES', 1000)),
+            },
+        }
+    }
 
 # 
 DATABASE_URL = os.getenv("DATABASE_URL")
@@ -96,7 +136,7 @@ if DATABASE_URL:
             env="DATABASE_URL",
             conn_health_checks=True,      
             conn_max_age=600,
-            ssl_require=True,
+            ssl_require=not DATABASE_URL.startswith('sqlite'),
         )
     }
 else:
@@ -108,6 +148,108 @@ else:
         }
     }
 
+# PostgreSQL connections come from a psycopg 3 pool per process instead of a
+# new TCP/TLS connection per request or websocket handshake. Sizing is set with
+# DATABASE_POOL_MIN_SIZE/MAX_SIZE/TIMEOUT/MAX_IDLE/MAX_LIFETIME; pool metrics
+# are served to staff at /rooms/api/db-pool/.
+DATABASE_POOL = os.getenv('DATABASE_POOL', 'true').lower() == 'true'
+
+if DATABASE_POOL:
+    configure_pool(DATABASES['default'], 'default')
+
+# Read replicas: DATABASE_REPLICA_URL adds a 'replica' alias that views and
+# consumer lookups marked with prefer_replica/replica_reads read from. After a
+# write, the user's requests stay on the primary for DATABASE_REPLICA_LAG
+# seconds. Two local SQLite files work as stand-ins for testing the routing.
+DATABASE_REPLICA_URL = os.getenv('DATABASE_REPLICA_URL')
+DATABASE_READ_REPLICAS = []
+DATABASE_REPLICA_LAG = int(os.getenv('DATABASE_REPLICA_LAG', 5))
+DATABASE_ROUTERS = ['syncstream_project.db_routers.PrimaryReplicaRouter']
+
+if DATABASE_REPLICA_URL:
+    DATABASES['replica'] = dj_database_url.parse(
+        DATABASE_REPLICA_URL,
+        conn_health_checks=True,
+        conn_max_age=600,
+        ssl_require=not DATABASE_REPLICA_URL.startswith('sqlite'),
+    )
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+    if DATABASE_POOL:
+        configure_pool(DATABASES['replica'], 'replica')
+    DATABASE_READ_REPLICAS = ['replica']
+
+# Permanent room deletes run as chunked background jobs (rooms/deletion.py).
+# Set ROOM_DELETION_IN_PROCESS=false when a separate worker runs
+# `python manage.py process_room_deletions --loop`.
+ROOM_DELETION_IN_PROCESS = os.getenv('ROOM_DELETION_IN_PROCESS', 'true').lower() == 'true'
+ROOM_DELETION_CHUNK_SIZE = int(os.getenv('ROOM_DELETION_CHUNK_SIZE', 5000))
+
+# Chat messages older than MESSAGE_RETENTION_DAYS are moved into compressed
+# per-room, per-day archive files by `python manage.py archive_messages`.
+# Unset keeps messages forever; rooms can set their own retention.
+MESSAGE_RETENTION_DAYS = int(os.getenv('MESSAGE_RETENTION_DAYS')) if os.getenv('MESSAGE_RETENTION_DAYS') else None
+MESSAGE_ARCHIVE_ROOT = os.getenv('MESSAGE_ARCHIVE_ROOT', BASE_DIR / 'archive')
+
+# Uploaded profile pictures are resized to 32/64/256px WebP thumbnails without
+# EXIF by a small thread pool after the upload is saved. Set
+# PROFILE_THUMBNAILS_IN_PROCESS=false when a separate worker runs
+# `python manage.py generate_profile_thumbnails --loop`.
+PROFILE_THUMBNAILS_IN_PROCESS = os.getenv('PROFILE_THUMBNAILS_IN_PROCESS', 'true').lower() == 'true'
+PROFILE_THUMBNAIL_WORKERS = int(os.getenv('PROFILE_THUMBNAIL_WORKERS', 2))
+
+# Video sync events are buffered per process and written in batches of
+# SYNC_INGEST_BATCH_SIZE (or after SYNC_INGEST_FLUSH_INTERVAL seconds).
+# `python manage.py rollup_sync_data --loop` turns them into hourly per-room
+# latency/drift percentiles and prunes raw events older than
+# SYNC_DATA_RETENTION_HOURS. Each run re-summarizes the last
+# SYNC_ROLLUP_LOOKBACK_HOURS finished hours, so events flushed late are counted.
+SYNC_INGEST_BATCH_SIZE = int(os.getenv('SYNC_INGEST_BATCH_SIZE', 200))
+SYNC_INGEST_FLUSH_INTERVAL = float(os.getenv('SYNC_INGEST_FLUSH_INTERVAL', 5))
+SYNC_DATA_RETENTION_HOURS = int(os.getenv('SYNC_DATA_RETENTION_HOURS', 24))
+SYNC_ROLLUP_LOOKBACK_HOURS = int(os.getenv('SYNC_ROLLUP_LOOKBACK_HOURS', 6))
+
+# video_control messages carry an execute_at instant this many seconds after
+# the server received them; clients convert it to their own clock with the
+# per-connection offset estimated from pings (rooms/clock.py).
+VIDEO_CONTROL_LEAD = float(os.getenv('VIDEO_CONTROL_LEAD', 0.3))
+
+# Clients report their playback position every few seconds; one that is
+# further than SYNC_DRIFT_THRESHOLD seconds from the room clock gets a
+# sync_correction, at most once per SYNC_CORRECTION_COOLDOWN seconds.
+SYNC_DRIFT_THRESHOLD = float(os.getenv('SYNC_DRIFT_THRESHOLD', 0.5))
+SYNC_CORRECTION_COOLDOWN = float(os.getenv('SYNC_CORRECTION_COOLDOWN', 3))
+
+# Each room's live state is owned by an actor task in the process serving
+# it (rooms/actors.py). Its video clock is saved at most this often, and the
+# actor stops this many seconds after the room's last connection closes.
+ROOM_ACTOR_SNAPSHOT_INTERVAL = float(os.getenv('ROOM_ACTOR_SNAPSHOT_INTERVAL', 1.0))
+ROOM_ACTOR_IDLE_TIMEOUT = float(os.getenv('ROOM_ACTOR_IDLE_TIMEOUT', 30))
+
+# With several ASGI workers, each room is served by one of them, chosen by
+# consistent hashing over the workers with a live heartbeat (rooms/workers.py).
+# ROOM_WORKERS lists every worker as id=websocket base URL, comma separated,
+# e.g. "0=wss://example.com:8001,1=wss://example.com:8002"; ROOM_WORKER_ID
+# names this process. Without them every room is served locally.
+ROOM_WORKER_ID = os.getenv('ROOM_WORKER_ID')
+ROOM_WORKERS = dict(
+    worker.split('=', 1) for worker in os.getenv('ROOM_WORKERS', '').split(',') if '=' in worker
+)
+ROOM_WORKER_HEARTBEAT_INTERVAL = float(os.getenv('ROOM_WORKER_HEARTBEAT_INTERVAL', 5))
+ROOM_WORKER_TTL = float(os.getenv('ROOM_WORKER_TTL', 15))
+
+# On SIGTERM a worker stops taking handshakes, saves room state and closes
+# its WebSockets in WEBSOCKET_DRAIN_WAVES waves, WEBSOCKET_DRAIN_WAVE_INTERVAL
+# seconds apart, each client told when to reconnect (rooms/drain.py). Keep the
+# total under the supervisor's --graceful-timeout.
+WEBSOCKET_DRAIN_WAVES = int(os.getenv('WEBSOCKET_DRAIN_WAVES', 5))
+WEBSOCKET_DRAIN_WAVE_INTERVAL = float(os.getenv('WEBSOCKET_DRAIN_WAVE_INTERVAL', 2.0))
+# Drained and moved clients stay online for ROOM_RECONNECT_GRACE seconds; the
+# room actors of the workers still serving sweep out the ones that haven't
+# reconnected by then every ROOM_PRESENCE_SWEEP_INTERVAL seconds
+# (rooms/presence.py).
+ROOM_RECONNECT_GRACE = float(os.getenv('ROOM_RECONNECT_GRACE', 60))
+ROOM_PRESENCE_SWEEP_INTERVAL = float(os.getenv('ROOM_PRESENCE_SWEEP_INTERVAL', 30))
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
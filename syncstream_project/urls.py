@@ -3,11 +3,15 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from rooms import views as room_views
+from users import views as user_views
+from users.thumbnails import THUMBNAIL_DIR
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', room_views.home, name='home'),
+    path('healthz/', room_views.health, name='health'),
     path('rooms/', include('rooms.urls', namespace='rooms')),
     path('accounts/', include('django.contrib.auth.urls')),
     path('accounts/', include('users.urls')),
+    path(f'{settings.MEDIA_URL.strip("/")}/{THUMBNAIL_DIR}/<str:filename>', user_views.avatar_thumbnail, name='avatar_thumbnail'),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
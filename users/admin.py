@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import CustomUser
+from .models import CustomUser, UserStats
 
 @admin.register(CustomUser)
 class CustomUserAdmin(UserAdmin):
@@ -8,4 +8,10 @@ class CustomUserAdmin(UserAdmin):
     list_filter = ('is_staff', 'is_superuser', 'is_online', 'last_login')
     fieldsets = UserAdmin.fieldsets + (
         ('Additional Info', {'fields': ('profile_picture', 'bio', 'is_online')}),
-    )
\ No newline at end of file
+    )
+
+@admin.register(UserStats)
+class UserStatsAdmin(admin.ModelAdmin):
+    list_display = ('user', 'total_messages', 'rooms_created', 'rooms_joined', 'updated_at')
+    search_fields = ('user__username',)
+    readonly_fields = ('updated_at',)
@@ -0,0 +1,42 @@
+import time
+from django.core.management.base import BaseCommand
+from django.contrib.auth import get_user_model
+from django.db.models import Q
+from users.thumbnails import generate_profile_thumbnails
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Render avatar thumbnails for profile pictures that are missing them or are out of date'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Regenerate thumbnails for every profile picture')
+        parser.add_argument('--user', action='append', dest='usernames', help='Only these usernames')
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new uploads')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds between polls with --loop')
+
+    def pending_users(self, options):
+        users = User.objects.exclude(Q(profile_picture='') | Q(profile_picture__isnull=True))
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+        if options['all']:
+            return list(users.values_list('pk', flat=True))
+        return [
+            pk for pk, picture, thumbnails in users.values_list('pk', 'profile_picture', 'profile_thumbnails')
+            if thumbnails.get('source') != picture
+        ]
+
+    def handle(self, *args, **options):
+        while True:
+            for user_id in self.pending_users(options):
+                try:
+                    generate_profile_thumbnails(user_id)
+                    self.stdout.write(self.style.SUCCESS(f"Generated thumbnails for user {user_id}"))
+                except Exception as e:
+                    self.stdout.write(self.style.WARNING(f"Thumbnails for user {user_id} failed: {e}"))
+
+            if not options['loop']:
+                break
+            options['all'] = False
+            time.sleep(options['interval'])
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth import get_user_model
+from users.models import UserStats
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Rebuild per-user activity counters from the message, room and participant tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--user', action='append', dest='usernames', help='Only rebuild these usernames')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        users = User.objects.order_by('pk')
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+
+        total = 0
+        last_pk = 0
+        while True:
+            user_ids = list(users.filter(pk__gt=last_pk).values_list('pk', flat=True)[:batch_size])
+            if not user_ids:
+                break
+            UserStats.rebuild(user_ids)
+            total += len(user_ids)
+            last_pk = user_ids[-1]
+            self.stdout.write(f"Rebuilt stats for {total} users")
+
+        self.stdout.write(self.style.SUCCESS(f"Done: {total} users"))
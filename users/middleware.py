@@ -1,21 +1,50 @@
 import logging
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.utils import timezone
 from .models import CustomUser
 
 logger = logging.getLogger(__name__)
 
+ACTIVITY_UPDATE_INTERVAL = timezone.timedelta(seconds=60)
+
 class UpdateLastActivityMiddleware:
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
         response = self.get_response(request)
         
-        if request.user.is_authenticated:
+        if request.user.is_authenticated and self.needs_update(request.user):
             updated = CustomUser.objects.filter(id=request.user.id).update(
                 last_activity=timezone.now(),
                 is_online=True
             )
             logger.debug(f"Updated user {request.user.username} activity. Rows updated: {updated}")
         
-        return response
\ No newline at end of file
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        
+        user = await request.auser()
+        if user.is_authenticated and self.needs_update(user):
+            updated = await CustomUser.objects.filter(id=user.id).aupdate(
+                last_activity=timezone.now(),
+                is_online=True
+            )
+            logger.debug(f"Updated user {user.username} activity. Rows updated: {updated}")
+        
+        return response
+
+    def needs_update(self, user):
+        if not user.is_online or not user.last_activity:
+            return True
+        return timezone.now() - user.last_activity > ACTIVITY_UPDATE_INTERVAL
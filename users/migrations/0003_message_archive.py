@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-19 08:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_userstats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userstats',
+            name='archived_messages',
+            field=models.IntegerField(default=0),
+        ),
+    ]
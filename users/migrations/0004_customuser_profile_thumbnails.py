@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-19 08:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_message_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='profile_thumbnails',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
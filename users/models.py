@@ -1,9 +1,13 @@
 from django.contrib.auth.models import AbstractUser
+from django.core.files.storage import default_storage
 from django.db import models
 from django.utils import timezone
 
 class CustomUser(AbstractUser):
     profile_picture = models.ImageField(upload_to='profile_pics/', blank=True, null=True)
+    # {'source': <profile_picture name>, 'sizes': {'32': <path>, ...}}, filled
+    # in by users.thumbnails after each upload.
+    profile_thumbnails = models.JSONField(default=dict, blank=True, editable=False)
     bio = models.TextField(max_length=500, blank=True)
     last_activity = models.DateTimeField(default=timezone.now)
     is_online = models.BooleanField(default=False)
@@ -11,6 +15,16 @@ class CustomUser(AbstractUser):
     def __str__(self):
         return self.username
     
+    def avatar_url(self, size=64):
+        from .thumbnails import get_thumbnail_path
+        
+        if not self.profile_picture:
+            return ''
+        path = get_thumbnail_path(self, size)
+        if path is None:
+            return self.profile_picture.url
+        return default_storage.url(path)
+    
     def update_activity(self):
         self.last_activity = timezone.now()
         self.is_online = True
@@ -25,4 +39,95 @@ class CustomUser(AbstractUser):
             time_diff = timezone.now() - self.last_activity
             if time_diff.total_seconds() > threshold_minutes * 60:
                 self.set_offline()
-        return self.is_online
\ No newline at end of file
+        return self.is_online
+
+class UserStats(models.Model):
+    user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    total_messages = models.IntegerField(default=0)
+    rooms_created = models.IntegerField(default=0)
+    rooms_joined = models.IntegerField(default=0)
+    # Messages moved to the cold archive are still counted in total_messages;
+    # this keeps their share so rebuilds don't lose them.
+    archived_messages = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name_plural = 'user stats'
+    
+    def __str__(self):
+        return f"Stats for {self.user_id}"
+    
+    @classmethod
+    def adjust(cls, user_id, **deltas):
+        # Users without a row yet are skipped; their row is built from the
+        # source tables the first time it is needed, which already includes
+        # this change.
+        cls.objects.filter(user_id=user_id).update(
+            **{field: models.F(field) + delta for field, delta in deltas.items()}
+        )
+    
+    @classmethod
+    def adjust_many(cls, deltas, *fields, batch_size=500):
+        # Applies {user_id: delta} to each of the given fields with one
+        # UPDATE per batch instead of one per user.
+        user_ids = list(deltas)
+        for i in range(0, len(user_ids), batch_size):
+            batch = user_ids[i:i + batch_size]
+            delta = models.Case(
+                *(models.When(user_id=user_id, then=models.Value(deltas[user_id])) for user_id in batch),
+                default=models.Value(0),
+                output_field=models.IntegerField(),
+            )
+            cls.objects.filter(user_id__in=batch).update(
+                **{field: models.F(field) + delta for field in fields}
+            )
+    
+    @classmethod
+    def rebuild(cls, user_ids):
+        from rooms.models import Room, Participant, Message
+        
+        user_ids = list(user_ids)
+        
+        def grouped(queryset, field):
+            return dict(
+                queryset.filter(**{f'{field}__in': user_ids})
+                .values_list(field)
+                .annotate(total=models.Count('pk'))
+                .order_by()
+            )
+        
+        # Room counts match the lists on the profile page: active rooms only,
+        # and no memberships the user is banned from.
+        messages = grouped(Message.objects.all(), 'user_id')
+        created = grouped(Room.objects.filter(is_active=True), 'creator_id')
+        joined = grouped(
+            Participant.objects.filter(room__is_active=True, is_banned=False)
+            .exclude(room__creator_id=models.F('user_id')),
+            'user_id'
+        )
+        
+        archived = dict(cls.objects.filter(user_id__in=user_ids).values_list('user_id', 'archived_messages'))
+        
+        stats = [
+            cls(
+                user_id=user_id,
+                total_messages=messages.get(user_id, 0) + archived.get(user_id, 0),
+                archived_messages=archived.get(user_id, 0),
+                rooms_created=created.get(user_id, 0),
+                rooms_joined=joined.get(user_id, 0),
+            )
+            for user_id in user_ids
+        ]
+        return cls.objects.bulk_create(
+            stats,
+            update_conflicts=True,
+            unique_fields=['user'],
+            update_fields=['total_messages', 'rooms_created', 'rooms_joined', 'updated_at'],
+        )
+    
+    @classmethod
+    def for_user(cls, user):
+        try:
+            return user.stats
+        except cls.DoesNotExist:
+            return cls.rebuild([user.pk])[0]
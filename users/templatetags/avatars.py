@@ -0,0 +1,9 @@
+from django import template
+
+register = template.Library()
+
+
+@register.filter
+def avatar_url(user, size=64):
+    """Usage: {{ user|avatar_url:64 }} -> URL of the closest thumbnail size."""
+    return user.avatar_url(int(size))
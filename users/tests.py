@@ -1,3 +1,232 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from io import BytesIO
+from PIL import Image
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rooms.models import Room, Participant, Message
+from rooms.tests import QueryBudgetMixin
+from .models import UserStats
+from .thumbnails import AVATAR_SIZES, generate_profile_thumbnails
 
-# Create your tests here.
+User = get_user_model()
+
+ROOM_COUNT = 5
+
+
+class UserViewQueryBudgetTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('viewer', password='pass')
+        cls.other = User.objects.create_user('other', password='pass')
+
+        for i in range(ROOM_COUNT):
+            created = Room.objects.create(name=f'Created {i}', creator=cls.other, max_users=50)
+            joined = Room.objects.create(name=f'Joined {i}', creator=cls.user, max_users=50)
+            Participant.objects.create(room=created, user=cls.other, is_online=True)
+            Participant.objects.create(room=created, user=cls.user, is_online=True)
+            Participant.objects.create(room=joined, user=cls.other, is_online=True)
+            Message.objects.create(room=created, user=cls.other, message='hello')
+        
+        UserStats.rebuild([cls.user.pk, cls.other.pk])
+
+    def setUp(self):
+        User.objects.update(is_online=True, last_activity=timezone.now())
+        self.client.force_login(self.user)
+
+    def test_view_profile(self):
+        with self.assertMaxQueries(5):
+            response = self.client.get(reverse('view_profile', args=['other']))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['stats'].rooms_created, ROOM_COUNT)
+
+    def test_view_profile_rebuilds_missing_stats(self):
+        UserStats.objects.filter(user=self.other).delete()
+        with self.assertMaxQueries(10):
+            response = self.client.get(reverse('view_profile', args=['other']))
+        self.assertEqual(response.context['stats'].total_messages, ROOM_COUNT)
+
+    def test_own_profile(self):
+        with self.assertMaxQueries(5):
+            response = self.client.get(reverse('profile'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_profile_edit(self):
+        with self.assertMaxQueries(2):
+            self.client.get(reverse('profile_edit'))
+        with self.assertMaxQueries(4):
+            response = self.client.post(reverse('profile_edit'), {
+                'username': 'viewer',
+                'email': 'viewer@example.com',
+                'bio': 'Hello',
+            })
+        self.assertEqual(response.status_code, 302)
+
+    def test_signup(self):
+        self.client.logout()
+        with self.assertMaxQueries(0):
+            self.client.get(reverse('signup'))
+        with self.assertMaxQueries(12):
+            response = self.client.post(reverse('signup'), {
+                'username': 'newcomer',
+                'email': 'newcomer@example.com',
+                'password1': 'a-Strong-pass-123',
+                'password2': 'a-Strong-pass-123',
+            })
+        self.assertEqual(response.status_code, 302)
+
+    def test_logout(self):
+        with self.assertMaxQueries(4):
+            response = self.client.post(reverse('logout'))
+        self.assertEqual(response.status_code, 200)
+
+class UserStatsTests(TestCase):
+    def setUp(self):
+        self.creator = User.objects.create_user('creator', password='pass')
+        self.member = User.objects.create_user('member', password='pass')
+        self.room = Room.objects.create(name='Counted', creator=self.creator)
+        UserStats.rebuild([self.creator.pk, self.member.pk])
+        Participant.objects.create(room=self.room, user=self.creator)
+        self.participant = Participant.objects.create(room=self.room, user=self.member)
+
+    def stats(self, user):
+        return UserStats.objects.values_list('total_messages', 'rooms_created', 'rooms_joined').get(user=user)
+
+    def assert_stats(self, user, expected):
+        # The signals must land where a rebuild from the source tables does.
+        self.assertEqual(self.stats(user), expected)
+        UserStats.rebuild([user.pk])
+        self.assertEqual(self.stats(user), expected)
+
+    def test_counters_follow_messages_and_bans(self):
+        self.assert_stats(self.creator, (0, 1, 0))
+        self.assert_stats(self.member, (0, 0, 1))
+        
+        message = Message.objects.create(room=self.room, user=self.member, message='hello')
+        self.assert_stats(self.member, (1, 0, 1))
+        message.delete()
+        self.assert_stats(self.member, (0, 0, 1))
+        
+        self.participant.ban(self.creator)
+        self.participant.ban(self.creator)
+        self.assert_stats(self.member, (0, 0, 0))
+        self.participant.unban()
+        self.assert_stats(self.member, (0, 0, 1))
+        
+        self.participant.delete()
+        self.assert_stats(self.member, (0, 0, 0))
+
+    def test_counters_match_the_profile_lists(self):
+        other = Room.objects.create(name='Banned from', creator=self.creator)
+        Participant.objects.create(room=other, user=self.member, is_banned=True)
+        self.room.hard_delete(self.creator)
+        Room.objects.create(name='Still open', creator=self.creator)
+        
+        self.client.force_login(self.creator)
+        for user in (self.creator, self.member):
+            response = self.client.get(reverse('view_profile', args=[user.username]))
+            stats = self.stats(user)
+            self.assertEqual(
+                (len(response.context['created_rooms']), len(response.context['participant_rooms'])),
+                (stats[1], stats[2]),
+            )
+        self.assert_stats(self.creator, (0, 2, 0))
+        self.assert_stats(self.member, (0, 0, 0))
+
+    def test_room_cascade_is_counted_once(self):
+        for i in range(3):
+            Message.objects.create(room=self.room, user=self.member, message=f'message {i}')
+        # Rows removed by the cascade are settled in bulk by room_pre_delete,
+        # not again by their own post_delete receivers.
+        self.room.delete()
+        self.assert_stats(self.creator, (0, 0, 0))
+        self.assert_stats(self.member, (0, 0, 0))
+
+    def test_adjust_many_applies_each_delta_in_batches(self):
+        missing = User.objects.create_user('missing', password='pass')
+        UserStats.adjust_many(
+            {self.creator.pk: 3, self.member.pk: -2, missing.pk: 5}, 'total_messages', 'archived_messages', batch_size=2
+        )
+        rows = dict(UserStats.objects.values_list('user_id', 'total_messages'))
+        self.assertEqual(rows, {self.creator.pk: 3, self.member.pk: -2})
+        self.assertEqual(UserStats.objects.get(user=self.member).archived_messages, -2)
+
+    def test_rebuild_keeps_archived_messages(self):
+        Message.objects.create(room=self.room, user=self.member, message='hello')
+        UserStats.objects.filter(user=self.member).update(total_messages=0, archived_messages=4)
+        UserStats.rebuild([self.member.pk])
+        self.assertEqual(
+            UserStats.objects.values_list('total_messages', 'archived_messages').get(user=self.member), (5, 4)
+        )
+
+
+def make_upload(name='avatar.jpg', size=(800, 600), color='red'):
+    exif = Image.Exif()
+    exif[0x010F] = 'Camera maker'
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'JPEG', exif=exif)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+class ProfileThumbnailTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        
+        self.user = User.objects.create_user('viewer', password='pass')
+        self.client.force_login(self.user)
+
+    def upload(self, upload):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(reverse('profile_edit'), {
+                'username': 'viewer',
+                'profile_picture': upload,
+            })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(callbacks), 1)
+        self.user.refresh_from_db()
+
+    def test_upload_renders_thumbnails_without_exif(self):
+        self.upload(make_upload())
+        self.assertEqual(self.user.avatar_url(64), self.user.profile_picture.url)
+        
+        thumbnails = generate_profile_thumbnails(self.user.pk)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.profile_thumbnails, thumbnails)
+        for size in AVATAR_SIZES:
+            with default_storage.open(thumbnails['sizes'][str(size)]) as f:
+                image = Image.open(f)
+                self.assertEqual(image.size, (size, size))
+                self.assertNotIn('exif', image.info)
+        
+        self.assertTrue(self.user.avatar_url(48).endswith('_64.webp'))
+        self.assertTrue(self.user.avatar_url(512).endswith('_256.webp'))
+
+    def test_thumbnails_are_served_with_long_cache_headers(self):
+        self.upload(make_upload())
+        generate_profile_thumbnails(self.user.pk)
+        self.user.refresh_from_db()
+        
+        response = self.client.get(self.user.avatar_url(32))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+
+    def test_new_upload_replaces_old_thumbnails(self):
+        self.upload(make_upload())
+        old = generate_profile_thumbnails(self.user.pk)
+        
+        self.upload(make_upload('second.jpg', color='blue'))
+        self.assertEqual(self.user.avatar_url(64), self.user.profile_picture.url)
+        new = generate_profile_thumbnails(self.user.pk)
+        
+        self.assertNotEqual(old['sizes'], new['sizes'])
+        for path in old['sizes'].values():
+            self.assertFalse(default_storage.exists(path))
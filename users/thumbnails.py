@@ -0,0 +1,136 @@
+import hashlib
+import logging
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction, connections, close_old_connections
+from django.db.models import Q
+from PIL import Image, ImageOps, features
+
+logger = logging.getLogger(__name__)
+
+AVATAR_SIZES = (32, 64, 256)
+THUMBNAIL_DIR = 'profile_pics/thumbs'
+THUMBNAIL_QUALITY = 82
+
+_executor = None
+
+
+def thumbnail_format():
+    return ('WEBP', 'webp') if features.check('webp') else ('JPEG', 'jpg')
+
+
+def open_normalized(image_file):
+    image = Image.open(image_file)
+    # Apply the EXIF rotation before the metadata is dropped; nothing from the
+    # original's EXIF (camera, GPS) is written into the thumbnails.
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+    return image
+
+
+def render_thumbnails(image_file):
+    image = open_normalized(image_file)
+    image_format, extension = thumbnail_format()
+    if image_format == 'JPEG' and image.mode == 'RGBA':
+        image = image.convert('RGB')
+
+    rendered = {}
+    for size in AVATAR_SIZES:
+        thumbnail = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+        buffer = BytesIO()
+        thumbnail.save(buffer, image_format, quality=THUMBNAIL_QUALITY, method=4 if image_format == 'WEBP' else 0)
+        rendered[size] = (buffer.getvalue(), extension)
+    return rendered
+
+
+def generate_profile_thumbnails(user_id):
+    """
+    Renders the fixed avatar sizes for a user's current profile picture and
+    records their paths on the user. Names include a hash of the content, so
+    a stored thumbnail never changes and can be cached indefinitely.
+    """
+    from .models import CustomUser
+
+    user = CustomUser.objects.filter(pk=user_id).only('profile_picture', 'profile_thumbnails').first()
+    if user is None:
+        return None
+    old_paths = set(user.profile_thumbnails.get('sizes', {}).values())
+
+    if not user.profile_picture:
+        cleared = CustomUser.objects.filter(Q(profile_picture='') | Q(profile_picture__isnull=True), pk=user_id)
+        if cleared.update(profile_thumbnails={}):
+            delete_thumbnails(old_paths)
+        return None
+
+    source_name = user.profile_picture.name
+    with user.profile_picture.open('rb') as image_file:
+        rendered = render_thumbnails(image_file)
+
+    stem = posixpath.splitext(posixpath.basename(source_name))[0]
+    sizes = {}
+    for size, (content, extension) in rendered.items():
+        digest = hashlib.sha256(content).hexdigest()[:12]
+        path = posixpath.join(THUMBNAIL_DIR, f'{user_id}_{stem}_{digest}_{size}.{extension}')
+        if not default_storage.exists(path):
+            path = default_storage.save(path, ContentFile(content))
+        sizes[str(size)] = path
+    thumbnails = {'source': source_name, 'sizes': sizes}
+
+    # The picture may have been replaced while this one was rendering; only
+    # the job for the current picture gets to record its thumbnails.
+    updated = CustomUser.objects.filter(pk=user_id, profile_picture=source_name).update(profile_thumbnails=thumbnails)
+    if not updated:
+        delete_thumbnails(set(sizes.values()) - old_paths)
+        return None
+
+    delete_thumbnails(old_paths - set(sizes.values()))
+    return thumbnails
+
+
+def get_thumbnail_path(user, size):
+    # Falls back to None while the current picture's thumbnails are pending.
+    thumbnails = user.profile_thumbnails or {}
+    if not user.profile_picture or thumbnails.get('source') != user.profile_picture.name:
+        return None
+    sizes = thumbnails.get('sizes', {})
+    fitting = [int(s) for s in sizes if int(s) >= size]
+    chosen = min(fitting) if fitting else max((int(s) for s in sizes), default=None)
+    return sizes.get(str(chosen)) if chosen is not None else None
+
+
+def delete_thumbnails(paths):
+    for path in paths:
+        try:
+            default_storage.delete(path)
+        except Exception:
+            logger.warning(f"Could not delete thumbnail {path}")
+
+
+def _run_in_background(user_id):
+    close_old_connections()
+    try:
+        generate_profile_thumbnails(user_id)
+    except Exception:
+        logger.exception(f"Error generating profile thumbnails for user {user_id}")
+    finally:
+        connections.close_all()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'PROFILE_THUMBNAIL_WORKERS', 2),
+            thread_name_prefix='profile-thumbnails',
+        )
+    return _executor
+
+
+def enqueue_profile_thumbnails(user):
+    if getattr(settings, 'PROFILE_THUMBNAILS_IN_PROCESS', True):
+        transaction.on_commit(lambda: _get_executor().submit(_run_in_background, user.pk))
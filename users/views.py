@@ -2,12 +2,21 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
+from django.core.files.storage import default_storage
+from django.utils.cache import patch_cache_control
+from django.views.static import serve
 from django.contrib.auth import get_user_model
 from .forms import CustomUserCreationForm, ProfileEditForm
-from rooms.models import Room, Message, Participant
+from django.db.models import Count
+from rooms.models import Room, Participant
+from .models import UserStats
+from .thumbnails import THUMBNAIL_DIR, enqueue_profile_thumbnails
+from syncstream_project.db_routers import prefer_replica
 
 User = get_user_model()
 
+AVATAR_THUMBNAIL_MAX_AGE = 60 * 60 * 24 * 365
+
 def signup(request):
     if request.method == 'POST':
         form = CustomUserCreationForm(request.POST)
@@ -24,24 +33,28 @@ def profile(request):
     return view_profile(request, request.user.username)
 
 @login_required
+@prefer_replica
 def view_profile(request, username):
-    target_user = get_object_or_404(User, username=username)
+    target_user = get_object_or_404(User.objects.select_related('stats'), username=username)
     
-    created_rooms = Room.objects.filter(creator=target_user, is_active=True)
+    # UserStats.rooms_created and rooms_joined count these same two lists.
+    created_rooms = Room.objects.filter(
+        creator=target_user,
+        is_active=True
+    ).annotate(participant_count=Count('participants'))
     
     participant_rooms = Room.objects.filter(
-        participants__user=target_user,
-        participants__is_online=True,
+        id__in=Participant.objects.filter(user=target_user, is_banned=False).values('room_id'),
         is_active=True
-    ).exclude(creator=target_user).distinct()
-    
-    total_messages = Message.objects.filter(user=target_user).count()
+    ).exclude(creator=target_user).select_related('creator').annotate(
+        participant_count=Count('participants')
+    )
     
     context = {
         'target_user': target_user,
         'created_rooms': created_rooms,
         'participant_rooms': participant_rooms,
-        'total_messages': total_messages,
+        'stats': UserStats.for_user(target_user),
         'is_own_profile': target_user == request.user,
     }
     
@@ -52,7 +65,9 @@ def profile_edit(request):
     if request.method == 'POST':
         form = ProfileEditForm(request.POST, request.FILES, instance=request.user)
         if form.is_valid():
-            form.save()
+            user = form.save()
+            if 'profile_picture' in form.changed_data:
+                enqueue_profile_thumbnails(user)
             return redirect('profile')
     else:
         form = ProfileEditForm(instance=request.user)
@@ -69,4 +84,10 @@ def online_status_api(request):
 @login_required
 def custom_logout(request):
     logout(request)
-    return render(request, 'registration/logged_out.html')
\ No newline at end of file
+    return render(request, 'registration/logged_out.html')
+
+def avatar_thumbnail(request, filename):
+    # Thumbnail names contain a hash of their content, so they never change.
+    response = serve(request, f'{THUMBNAIL_DIR}/{filename}', document_root=default_storage.location)
+    patch_cache_control(response, public=True, max_age=AVATAR_THUMBNAIL_MAX_AGE, immutable=True)
+    return response